@@ -0,0 +1,67 @@
+import configparser
+import os
+import boto3
+
+BENCH_PROFILE = 'bench'
+BENCH_REGION = 'us-east-1'
+# Instances per load balancer target group, and run_instances batch size
+TARGETS_PER_GROUP = 10
+LAUNCH_BATCH = 1000
+VOLUME_TYPES = ('gp3', 'gp2', 'io1', 'st1')
+
+
+def write_config(config_dir):
+    """Write a config file with a fake-credential bench profile into `config_dir`."""
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
+    config = configparser.ConfigParser()
+    config[BENCH_PROFILE] = {
+        'aws_access_key_id': 'testing',
+        'aws_secret_access_key': 'testing',
+        'aws_region': BENCH_REGION,
+    }
+    with open(os.path.join(config_dir, 'config'), 'w') as f:
+        config.write(f)
+
+
+def seed_fleet(size):
+    """Create `size` instances, volumes and buckets, and one load balancer per 10 instances, in a mocked account.
+
+    Seeding goes through its own boto3 clients, so none of it is counted against
+    the commands being measured.
+    """
+    ec2 = boto3.client('ec2', region_name=BENCH_REGION)
+    elbv2 = boto3.client('elbv2', region_name=BENCH_REGION)
+    s3 = boto3.client('s3', region_name=BENCH_REGION)
+
+    image_id = ec2.describe_images(Owners=['amazon'])['Images'][0]['ImageId']
+    instance_ids = []
+    for start in range(0, size, LAUNCH_BATCH):
+        count = min(LAUNCH_BATCH, size - start)
+        response = ec2.run_instances(ImageId=image_id, MinCount=count, MaxCount=count, InstanceType='m5.large',
+                                     TagSpecifications=[{'ResourceType': 'instance',
+                                                         'Tags': [{'Key': 'Name', 'Value': 'bench'}]}])
+        instance_ids.extend(instance['InstanceId'] for instance in response['Instances'])
+
+    for index in range(size):
+        volume_type = VOLUME_TYPES[index % len(VOLUME_TYPES)]
+        ec2.create_volume(Size=125 + index % 500, AvailabilityZone=BENCH_REGION + 'a', VolumeType=volume_type,
+                          **({'Iops': 1000} if volume_type == 'io1' else {}))
+
+    vpc_id = ec2.describe_vpcs()['Vpcs'][0]['VpcId']
+    subnets = [subnet['SubnetId'] for subnet in ec2.describe_subnets()['Subnets']][:2]
+    for index, start in enumerate(range(0, size, TARGETS_PER_GROUP)):
+        name = 'bench-{}'.format(index)
+        lb_arn = elbv2.create_load_balancer(Name=name, Subnets=subnets, Scheme='internal')['LoadBalancers'][0][
+            'LoadBalancerArn']
+        tg_arn = elbv2.create_target_group(Name=name, Protocol='HTTP', Port=80, VpcId=vpc_id,
+                                           TargetType='instance')['TargetGroups'][0]['TargetGroupArn']
+        elbv2.register_targets(TargetGroupArn=tg_arn, Targets=[
+            {'Id': instance_id} for instance_id in instance_ids[start:start + TARGETS_PER_GROUP]])
+        elbv2.create_listener(LoadBalancerArn=lb_arn, Protocol='HTTP', Port=80,
+                              DefaultActions=[{'Type': 'forward', 'TargetGroupArn': tg_arn}])
+
+    for index in range(size):
+        bucket = 'bench-{}'.format(index)
+        s3.create_bucket(Bucket=bucket)
+        s3.put_object(Bucket=bucket, Key='object', Body=b'x' * (index % 4096))
@@ -0,0 +1,170 @@
+"""Benchmark the list-* commands against a mocked AWS account and a fake SSH fleet.
+
+Each fleet size runs in its own worker process (`python -m know_my_health.bench.runner`),
+so peak memory and warm caches of one size never leak into the next.
+"""
+import contextlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import click
+from .fleet import BENCH_PROFILE, write_config
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+RSS_SAMPLE_INTERVAL = 0.005
+HEADERS = ["Size", "Command", "Wall (s)", "API calls", "Bastion handshakes", "Host sessions", "Peak RSS (MiB)"]
+
+
+def _rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class _PeakRss:
+    """Sample RSS on a thread while a command runs; `peak` is the highest value seen, in bytes."""
+
+    def __init__(self):
+        self.peak = _rss()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, _rss())
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stopped.set()
+        if self.peak is None:
+            # Without /proc, fall back to the process-wide high-water mark (KiB on Linux, bytes on macOS)
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = peak if sys.platform == 'darwin' else peak * 1024
+        else:
+            self._thread.join()
+            self.peak = max(self.peak, _rss())
+
+
+def _measure(size, bastion, key_path, concurrency, bastion_connections):
+    """Seed a mocked account with `size` resources of each kind and time every list command against it."""
+    from moto import mock_aws
+    from .fleet import seed_fleet
+    from ..config import register_event_handler
+    from ..cache import set_inventory_policy
+    from ..ec2.instances import list_ec2_instances
+    from ..ebs.volumes import list_ebs_volumes
+    from ..elb.load_balancers import list_elb_instances
+    from ..s3.buckets import list_s3_buckets
+
+    commands = [
+        ('list-instances', lambda: list_ec2_instances(BENCH_PROFILE, bastion_ip=bastion, key_path=key_path,
+                                                      bastion_username='bench', concurrency=concurrency,
+                                                      bastion_connections=bastion_connections)),
+        ('list-volumes', lambda: list_ebs_volumes(BENCH_PROFILE)),
+        ('list-load-balancers', lambda: list_elb_instances(BENCH_PROFILE)),
+        ('list-buckets', lambda: list_s3_buckets(BENCH_PROFILE)),
+    ]
+
+    api_calls = [0]
+
+    def count_call(**kwargs):
+        api_calls[0] += 1
+
+    results = []
+    with mock_aws():
+        seed_fleet(size)
+        register_event_handler('before-call', count_call)
+        # Every command goes to (mocked) AWS rather than the inventory cache
+        set_inventory_policy(refresh=True)
+        for name, command in commands:
+            api_calls[0] = 0
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), _PeakRss() as rss:
+                started = time.perf_counter()
+                command()
+                wall = time.perf_counter() - started
+            results.append({'command': name, 'wall': wall, 'api_calls': api_calls[0], 'peak_rss': rss.peak})
+    return results
+
+
+class _FakeFleet:
+    """The fake bastion process; `stats()` returns its connection counters."""
+
+    def __init__(self, latency):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'know_my_health.bench.sshd', '--latency', str(latency)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.address = "127.0.0.1:{}".format(self.process.stdout.readline().strip())
+
+    def stats(self):
+        self.process.stdin.write("stats\n")
+        self.process.stdin.flush()
+        return json.loads(self.process.stdout.readline())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def _write_key(path):
+    import paramiko
+    paramiko.ECDSAKey.generate().write_private_key_file(path)
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, latency=0.05, concurrency=50, bastion_connections=1, output='grid',
+                  columns=None):
+    """Benchmark the list commands at each fleet size and write one row per (size, command)."""
+    # moto is only needed by the worker processes, so it is looked up rather than imported here
+    if importlib.util.find_spec('moto') is None:
+        raise click.ClickException("The benchmark requires moto: pip install 'moto[ec2,elbv2,s3,cloudwatch]'")
+    from ..output import open_writer
+
+    writer = open_writer(output, HEADERS, columns)
+    with tempfile.TemporaryDirectory(prefix='know-my-health-bench-') as home:
+        write_config(home)
+        key_path = os.path.join(home, 'id_bench')
+        _write_key(key_path)
+        env = dict(os.environ, KNOW_MY_HEALTH_HOME=home, AWS_ACCESS_KEY_ID='testing',
+                   AWS_SECRET_ACCESS_KEY='testing', AWS_DEFAULT_REGION='us-east-1')
+        fleet = _FakeFleet(latency)
+        try:
+            for size in sizes:
+                click.echo("Benchmarking {} resources...".format(size), err=True)
+                before = fleet.stats()
+                worker = subprocess.run(
+                    [sys.executable, '-m', 'know_my_health.bench.runner', str(size), fleet.address, key_path,
+                     str(concurrency), str(bastion_connections)],
+                    env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                if worker.returncode:
+                    raise click.ClickException("Benchmark of {} resources failed:\n{}".format(
+                        size, worker.stderr.strip()))
+                after = fleet.stats()
+                for result in json.loads(worker.stdout):
+                    # Only list-instances talks SSH, and each worker runs it once
+                    ssh = result['command'] == 'list-instances'
+                    writer.write([
+                        size, result['command'], round(result['wall'], 3), result['api_calls'],
+                        after['bastion_handshakes'] - before['bastion_handshakes'] if ssh else 0,
+                        after['host_sessions'] - before['host_sessions'] if ssh else 0,
+                        round(result['peak_rss'] / 2 ** 20, 1),
+                    ])
+        finally:
+            fleet.close()
+    writer.close()
+
+
+if __name__ == '__main__':
+    size, bastion, key_path, concurrency, bastion_connections = sys.argv[1:]
+    print(json.dumps(_measure(int(size), bastion, key_path, int(concurrency), int(bastion_connections))))
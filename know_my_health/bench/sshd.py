@@ -0,0 +1,139 @@
+"""A fake bastion and fleet for benchmarks, run as its own process so its CPU cost stays out of the measurements.
+
+Every connection is accepted as the bastion. Each direct-tcpip channel opened through it
+is answered by an emulated target host, which runs its own SSH session over the tunnel
+and replies to the collector script with canned sar/df output after a configurable latency.
+
+    python -m know_my_health.bench.sshd --latency 0.05
+
+prints the listening port on the first line, then answers "stats" on stdin with a JSON
+line of counters.
+"""
+import argparse
+import json
+import logging
+import socket
+import sys
+import threading
+import time
+import paramiko
+
+SAMPLE_OUTPUT = "\n".join([
+    "cpu=Linux 5.10.0 (bench)   01/01/24    _x86_64_    (2 CPU)",
+    "cpu=",
+    "cpu=12:00:00     CPU     %user     %nice   %system   %iowait    %steal     %idle",
+    "cpu=12:00:01     all     21.50      0.00      3.50      1.25      0.00     73.75",
+    "cpu=Average:     all     21.50      0.00      3.50      1.25      0.00     73.75",
+    "mem=12:00:00    kbmemfree   kbavail kbmemused  %memused kbbuffers  kbcached",
+    "mem=12:00:01       812344   2823344   3112820     61.75     20480   1921632",
+    "mem=Average:       812344   2823344   3112820     61.75     20480   1921632",
+    "df=Filesystem      Size  Used Avail Capacity Mounted on",
+    "df=/dev/nvme0n1p1   22G  4.1G   18G      19% /",
+    "df=/dev/nvme1n1    108G   52G   56G      48% /data",
+    "meminfo=MemTotal:        8041204 kB",
+    "meminfo=MemAvailable:    2823344 kB",
+]) + "\n"
+
+
+class _Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {'bastion_handshakes': 0, 'host_sessions': 0, 'commands': 0}
+
+    def add(self, name):
+        with self.lock:
+            self.values[name] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+
+class _Server(paramiko.ServerInterface):
+    """Accepts any user and key; the bastion allows tunnels, targets allow exec."""
+
+    def __init__(self, counters, latency, bastion):
+        self.counters = counters
+        self.latency = latency
+        self.bastion = bastion
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        if not self.bastion:
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        self.counters.add('commands')
+        threading.Thread(target=self._reply, args=(channel,), daemon=True).start()
+        return True
+
+    def _reply(self, channel):
+        time.sleep(self.latency)
+        try:
+            channel.sendall(SAMPLE_OUTPUT.encode())
+            channel.send_exit_status(0)
+        finally:
+            channel.close()
+
+
+def _serve_transport(sock, host_key, counters, latency, bastion):
+    transport = paramiko.Transport(sock)
+    transport.add_server_key(host_key)
+    server = _Server(counters, latency, bastion)
+    try:
+        transport.start_server(server=server)
+    except (paramiko.SSHException, EOFError, OSError):
+        return
+    counters.add('bastion_handshakes' if bastion else 'host_sessions')
+    while transport.is_active():
+        channel = transport.accept(timeout=1)
+        if channel is None:
+            continue
+        if bastion and channel.get_name() != 'session':
+            # A tunnel to a "host": that host's SSH session runs over the channel itself
+            threading.Thread(target=_serve_transport, args=(channel, host_key, counters, latency, False),
+                             daemon=True).start()
+
+
+def serve(latency=0.05, port=0):
+    """Listen on 127.0.0.1:`port` until stdin closes; returns only on shutdown."""
+    # Clients hanging up mid-session is expected; keep paramiko's tracebacks off the terminal
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    host_key = paramiko.ECDSAKey.generate()
+    counters = _Counters()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(128)
+
+    def accept():
+        while True:
+            client, _ = listener.accept()
+            threading.Thread(target=_serve_transport, args=(client, host_key, counters, latency, True),
+                             daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    out = sys.stdout
+    out.write("{}\n".format(listener.getsockname()[1]))
+    out.flush()
+    for line in sys.stdin:
+        if line.strip() == 'stats':
+            out.write(json.dumps(counters.snapshot()) + "\n")
+            out.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds each collector run takes')
+    parser.add_argument('--port', type=int, default=0)
+    arguments = parser.parse_args()
+    serve(arguments.latency, arguments.port)
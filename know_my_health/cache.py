@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+import time
+from .config import CONFIG_DIR
+from .daemon import daemon_inventory
+
+CACHE_FILE = os.path.join(CONFIG_DIR, "cache.db")
+
+# How long a cached inventory is served before it is fetched again, in seconds
+INVENTORY_TTLS = {
+    'ec2-instances': 300,
+    'ebs-volumes': 300,
+    'elb-instances': 300,
+    's3-buckets': 3600,
+    'cost-and-usage': 3600,
+}
+INVENTORY_WRITE_BATCH = 500
+
+_inventory_policy = {'refresh': False, 'max_age': None}
+_snapshot_listeners = []
+
+
+def encode_record(value):
+    """JSON fallback for cached values: slotted records become dicts, anything else (datetimes) a string."""
+    return value.to_dict() if hasattr(value, 'to_dict') else str(value)
+
+
+def _connect():
+    if not os.path.exists(CONFIG_DIR):
+        os.makedirs(CONFIG_DIR)
+    # Inventory generators may be resumed from a different worker thread than the one that started them
+    connection = sqlite3.connect(CACHE_FILE, timeout=30, check_same_thread=False)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS entries ("
+        " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+        " stored_at REAL NOT NULL, expires_at REAL,"
+        " PRIMARY KEY (namespace, key))"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS inventory_snapshots ("
+        " generation INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, key TEXT NOT NULL,"
+        " stored_at REAL NOT NULL, complete INTEGER NOT NULL DEFAULT 0)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS inventory_snapshots_lookup ON inventory_snapshots (kind, key)")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS inventory_records ("
+        " generation INTEGER NOT NULL, seq INTEGER NOT NULL, record TEXT NOT NULL,"
+        " PRIMARY KEY (generation, seq))"
+    )
+    return connection
+
+
+def cache_get_many(namespace, keys):
+    """Return {key: value} for every unexpired cached entry among `keys`."""
+    keys = list(keys)
+    found = {}
+    if not keys:
+        return found
+    now = time.time()
+    connection = _connect()
+    try:
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = connection.execute(
+                "SELECT key, value FROM entries WHERE namespace = ? AND key IN ({})"
+                " AND (expires_at IS NULL OR expires_at > ?)".format(", ".join("?" * len(chunk))),
+                [namespace] + chunk + [now])
+            for key, value in rows:
+                found[key] = json.loads(value)
+    finally:
+        connection.close()
+    return found
+
+
+def cache_get_all(namespace):
+    """Return {key: value} for every unexpired cached entry in `namespace`."""
+    connection = _connect()
+    try:
+        rows = connection.execute(
+            "SELECT key, value FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time()))
+        return {key: json.loads(value) for key, value in rows}
+    finally:
+        connection.close()
+
+
+def cache_put_many(namespace, items, ttl=None):
+    """Store {key: value} entries, expiring after `ttl` seconds (never if None)."""
+    now = time.time()
+    expires_at = now + ttl if ttl is not None else None
+    connection = _connect()
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, stored_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(namespace, key, json.dumps(value, default=encode_record), now, expires_at) for key, value in items.items()])
+            connection.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+    finally:
+        connection.close()
+
+
+def cache_delete_many(namespace, keys):
+    """Drop cached entries for `keys`."""
+    connection = _connect()
+    try:
+        with connection:
+            connection.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?",
+                                   [(namespace, key) for key in keys])
+    finally:
+        connection.close()
+
+
+def set_inventory_policy(refresh=False, max_age=None):
+    """Choose whether cached inventories are bypassed (`refresh`) or how old they may be (`max_age` seconds)."""
+    _inventory_policy['refresh'] = refresh
+    _inventory_policy['max_age'] = max_age
+
+
+def refresh_requested():
+    """Return True when cached inventories (and a daemon's warm samples) are to be bypassed."""
+    return _inventory_policy['refresh']
+
+
+def add_snapshot_listener(listener):
+    """Call `listener(kind, key, records)` every time a complete inventory snapshot has been written."""
+    _snapshot_listeners.append(listener)
+
+
+def _read_inventory(kind, key, max_age):
+    connection = _connect()
+    row = connection.execute(
+        "SELECT generation FROM inventory_snapshots WHERE kind = ? AND key = ? AND complete = 1 AND stored_at >= ?"
+        " ORDER BY generation DESC LIMIT 1", (kind, key, time.time() - max_age)).fetchone()
+    if row is None:
+        connection.close()
+        return None
+
+    def records():
+        try:
+            # Iterating the cursor streams rows, so large inventories are never loaded at once
+            for (record,) in connection.execute(
+                    "SELECT record FROM inventory_records WHERE generation = ? ORDER BY seq", row):
+                yield json.loads(record)
+        finally:
+            connection.close()
+
+    return records()
+
+
+def _write_inventory(kind, key, records):
+    connection = _connect()
+    with connection:
+        generation = connection.execute(
+            "INSERT INTO inventory_snapshots (kind, key, stored_at) VALUES (?, ?, ?)",
+            (kind, key, time.time())).lastrowid
+    complete = False
+    # Only kept when someone (the daemon) wants the finished snapshot in memory
+    kept = [] if _snapshot_listeners else None
+    try:
+        batch = []
+        for seq, record in enumerate(records):
+            batch.append((generation, seq, json.dumps(record, default=encode_record)))
+            if kept is not None:
+                kept.append(record)
+            if len(batch) >= INVENTORY_WRITE_BATCH:
+                with connection:
+                    connection.executemany("INSERT INTO inventory_records VALUES (?, ?, ?)", batch)
+                batch = []
+            yield record
+        with connection:
+            connection.executemany("INSERT INTO inventory_records VALUES (?, ?, ?)", batch)
+            connection.execute("UPDATE inventory_snapshots SET complete = 1, stored_at = ? WHERE generation = ?",
+                               (time.time(), generation))
+            stale = [row[0] for row in connection.execute(
+                "SELECT generation FROM inventory_snapshots WHERE kind = ? AND key = ? AND generation != ?",
+                (kind, key, generation))]
+            _drop_generations(connection, stale)
+        complete = True
+    finally:
+        if not complete:
+            # Never serve a partial inventory: an interrupted fetch leaves nothing behind
+            with connection:
+                _drop_generations(connection, [generation])
+        connection.close()
+    for listener in _snapshot_listeners:
+        listener(kind, key, kept)
+
+
+def _drop_generations(connection, generations):
+    for generation in generations:
+        connection.execute("DELETE FROM inventory_records WHERE generation = ?", (generation,))
+        connection.execute("DELETE FROM inventory_snapshots WHERE generation = ?", (generation,))
+
+
+def cached_inventory(kind, key_parts, fetch):
+    """Yield the `kind` inventory identified by `key_parts`, from the local cache when it is fresh enough.
+
+    A running `serve` daemon is asked first, since it keeps its snapshots fresh on a schedule.
+    Otherwise `fetch()` is streamed through while its records are written to the cache,
+    and the new snapshot only becomes visible once the fetch completes.
+    """
+    key = json.dumps(key_parts, default=str)
+    if not _inventory_policy['refresh']:
+        max_age = _inventory_policy['max_age']
+        records = daemon_inventory(kind, key, max_age)
+        if records is not None:
+            yield from records
+            return
+        records = _read_inventory(kind, key, INVENTORY_TTLS[kind] if max_age is None else max_age)
+        if records is not None:
+            yield from records
+            return
+    yield from _write_inventory(kind, key, fetch())
@@ -0,0 +1,104 @@
+import html
+import io
+import threading
+import time
+import click
+from concurrent.futures import ThreadPoolExecutor
+from .output import numeric
+
+# Past this many resources a panel shows the largest ones plus a histogram of all of them
+TOP_N = 30
+HISTOGRAM_BINS = 30
+
+_executor = {}
+_executor_lock = threading.Lock()
+
+
+def _background():
+    with _executor_lock:
+        if 'executor' not in _executor:
+            # One worker: figures are independent, and charts are only drawn once per command
+            _executor['executor'] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='charts')
+        return _executor['executor']
+
+
+def _no_data(ax, title):
+    ax.text(0.5, 0.5, 'No data', ha='center', va='center', transform=ax.transAxes)
+    ax.set_title(title)
+
+
+def _draw_bars(ax, labels, values, title):
+    import numpy as np
+    reported = np.flatnonzero(~np.isnan(values))
+    if not len(reported):
+        return _no_data(ax, title)
+    order = reported[np.argsort(-values[reported], kind='stable')[:TOP_N]]
+    positions = np.arange(len(order))
+    ax.bar(positions, values[order])
+    ax.set_xticks(positions)
+    ax.set_xticklabels(labels[order], rotation=45, ha='right', fontsize='small')
+    ax.set_title(title if len(values) <= TOP_N else "{} (top {} of {})".format(title, TOP_N, len(values)))
+
+
+def _draw_histogram(ax, values, title):
+    import numpy as np
+    present = values[~np.isnan(values)]
+    if not len(present):
+        return _no_data(ax, "{} distribution".format(title))
+    counts, edges = np.histogram(present, bins=HISTOGRAM_BINS)
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
+    ax.set_title("{} distribution ({} of {} reported)".format(title, len(present), len(values)))
+    ax.set_ylabel('Resources')
+
+
+def render_chart(name, title, labels, series, chart_format='png'):
+    """Draw one panel per {series title: values} and write `<name>-<timestamp>.<format>`; returns the path.
+
+    Rendering uses the Agg canvas and the Figure API, never pyplot, so it needs no
+    display, never blocks, and is safe off the main thread.
+    """
+    import numpy as np
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    labels = np.array(labels, dtype=object)
+    aggregated = len(labels) > TOP_N
+    columns = 2 if aggregated else 1
+    figure = Figure(figsize=(8 * columns, 4 * len(series)), layout='tight')
+    FigureCanvasAgg(figure)
+    axes = figure.subplots(len(series), columns, squeeze=False)
+    for row, (series_title, values) in enumerate(series.items()):
+        values = numeric(values)
+        _draw_bars(axes[row][0], labels, values, series_title)
+        if aggregated:
+            _draw_histogram(axes[row][1], values, series_title)
+    figure.suptitle(title)
+
+    path = "{}-{}.{}".format(name, time.strftime('%Y%m%d-%H%M%S'), chart_format)
+    if chart_format == 'html':
+        svg = io.StringIO()
+        figure.savefig(svg, format='svg')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{}</title></head>"
+                    "<body>\n{}\n</body></html>\n".format(html.escape(title), svg.getvalue()))
+    else:
+        figure.savefig(path, format=chart_format)
+    return path
+
+
+def render_in_background(name, title, records, extract, chart_format='png'):
+    """Start rendering a chart on the chart worker and return a Future of the written path.
+
+    `extract(records)` returns (labels, {series title: values}); it runs on the worker
+    too, so the caller can go on printing its table straight away.
+    """
+    def render():
+        labels, series = extract(records)
+        return render_chart(name, title, labels, series, chart_format)
+
+    return _background().submit(render)
+
+
+def echo_chart(chart, err=False):
+    """Wait for a background chart and report the file it was written to."""
+    click.echo("Chart written to {}".format(chart.result()), err=err)
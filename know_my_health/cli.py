@@ -1,15 +1,67 @@
 import click
+import datetime
+import functools
 from .config import setup_config
-from .ec2.instances import list_ec2_instances
-from .ebs.volumes import list_ebs_volumes
-from .elb.load_balancers import list_elb_instances
-from .s3.buckets import list_s3_buckets
-from .cost.cost_explorer import list_cost_and_usage
+from .fanout import parse_list_option
+from .snapshots import SNAPSHOT_KINDS
+
+# Command modules (and boto3, paramiko, matplotlib behind them) are imported inside each
+# command, so --help and single-service commands only pay for what they use.
+
+profiles_option = click.option('--profiles', callback=lambda ctx, param, value: parse_list_option(value),
+                               help='Comma-separated profiles to fan out over, or "all"; overrides --profile')
+regions_option = click.option('--regions', callback=lambda ctx, param, value: parse_list_option(value),
+                              help='Comma-separated regions to fan out over, or "all" enabled regions')
+
+output_option = click.option('--output', default='grid', type=click.Choice(['grid', 'jsonl', 'csv', 'parquet']),
+                             help='grid for people; jsonl, csv or parquet (needs pyarrow) stream rows as they arrive')
+columns_option = click.option('--columns', callback=lambda ctx, param, value: parse_list_option(value),
+                              help='Comma-separated columns to output, e.g. "Name,Private IP"')
+
+snapshot_option = click.option('--snapshot', is_flag=True,
+                               help='Also append the listed resources to the local snapshot history for diff')
+
+chart_format_option = click.option('--chart-format', default='png', type=click.Choice(['png', 'svg', 'html']),
+                                   help='File format of the --visualize chart, written to the current directory')
+
+
+def _flatten_list_option(ctx, param, values):
+    """Accept a multiple option both repeated and comma-separated."""
+    return [item for value in values for item in parse_list_option(value) or []]
+
+
+def _as_utc(ctx, param, value):
+    return value.replace(tzinfo=datetime.timezone.utc) if value else None
+
+
+def inventory_cache_options(command):
+    """Add --refresh/--max-age and apply them to the local inventory cache before the command runs."""
+    @click.option('--refresh', is_flag=True, help='Ignore the local inventory cache and fetch from AWS')
+    @click.option('--max-age', type=click.IntRange(min=0),
+                  help='Maximum age in seconds of cached inventory to accept (default: per resource type)')
+    @functools.wraps(command)
+    def wrapper(*args, refresh, max_age, **kwargs):
+        from .cache import set_inventory_policy
+        set_inventory_policy(refresh, max_age)
+        return command(*args, **kwargs)
+    return wrapper
 
 @click.group()
-def cli():
+@click.option('--timings', is_flag=True,
+              help='Record every AWS API call and SSH step and print latency, retry and throttling stats on exit')
+@click.option('--timings-export', type=click.Path(dir_okay=False, writable=True),
+              help='Also write the timings to this file (implies --timings)')
+@click.option('--timings-format', default='json', type=click.Choice(['json', 'prometheus']),
+              help='Format of --timings-export')
+@click.pass_context
+def cli(ctx, timings, timings_export, timings_format):
     """Know My Health CLI"""
-    pass
+    if timings or timings_export:
+        from .timings import enable_timings, echo_timings, export_timings
+        enable_timings()
+        ctx.call_on_close(echo_timings)
+        if timings_export:
+            ctx.call_on_close(lambda: export_timings(timings_export, timings_format))
 
 @cli.command()
 def setup():
@@ -17,46 +69,278 @@ def setup():
     setup_config()
 
 @cli.command()
+@inventory_cache_options
 @click.option('--profile', default='default', help='AWS profile to use')
 @click.option('--tag', multiple=True, help='Tag key-value pair to filter instances, format: key:value')
 @click.option('--instance-type', help='Instance type to filter instances')
-@click.option('--bastion-ip', required=True, help='Bastion server IP address')
-@click.option('--key-path', required=True, help='Path to SSH private key file')
+@click.option('--vpc-id', multiple=True, callback=_flatten_list_option, help='VPC to filter instances by')
+@click.option('--subnet-id', multiple=True, callback=_flatten_list_option, help='Subnet to filter instances by')
+@click.option('--availability-zone', multiple=True, callback=_flatten_list_option,
+              help='Availability zone to filter instances by')
+@click.option('--instance-id', multiple=True, callback=_flatten_list_option,
+              help='Instance ID(s) to include, repeatable or comma-separated')
+@click.option('--tag-key', multiple=True, callback=_flatten_list_option,
+              help='Only instances that have any of these tag keys, whatever the value')
+@click.option('--launched-after', type=click.DateTime(), callback=_as_utc,
+              help='Only instances launched at or after this UTC time')
+@click.option('--launched-before', type=click.DateTime(), callback=_as_utc,
+              help='Only instances launched before this UTC time')
+@click.option('--bastion-ip', help='Bastion server IP address, optionally as host:port; sample hosts over SSH')
+@click.option('--key-path', help='Path to SSH private key file')
+@click.option('--metrics-source', default='auto', type=click.Choice(['auto', 'ssh', 'ssm', 'cloudwatch']),
+              help='Where host metrics come from; auto (default) uses SSH when a bastion is given, SSM Run Command '
+                   'for hosts SSH missed, and CloudWatch for the rest; ssm runs the collector on every '
+                   'SSM-managed host')
 @click.option('--bastion-username', default='ec2-user', help='Username for bastion server')
-@click.option('--visualize', is_flag=True, help='Visualize the instance metrics')
-def list_instances(profile, tag, instance_type, bastion_ip, key_path, bastion_username, visualize):
+@click.option('--bastion-connections', default=1, type=click.IntRange(min=1),
+              help='Number of pooled bastion SSH connections to multiplex host sessions over')
+@click.option('--concurrency', default=50, type=click.IntRange(min=1),
+              help='Maximum number of hosts scanned concurrently')
+@click.option('--host-timeout', default=15.0, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds before a single host is reported as timed out')
+@click.option('--deadline', type=click.FloatRange(min=0, min_open=True),
+              help='Overall time limit in seconds for the fleet scan')
+@click.option('--visualize', is_flag=True, help='Write a chart of the instance metrics')
+@chart_format_option
+@snapshot_option
+@click.option('--watch', is_flag=True,
+              help='Keep sampling every host over one long-lived session and refresh rolling statistics')
+@click.option('--interval', default=5, type=click.IntRange(min=1),
+              help='Seconds per sample in --watch mode')
+@click.option('--violations', is_flag=True,
+              help='Only list hosts that break a rule, worst first, with the severity and the rules broken')
+@click.option('--rule', multiple=True, callback=_flatten_list_option,
+              help='Rule such as "cpu>90" or "disk>95:critical" on cpu, iowait, ram, disk (fullest mount) or '
+                   'unhealthy (targets); repeatable, implies --violations and replaces the configured rules')
+@output_option
+@columns_option
+@profiles_option
+@regions_option
+def list_instances(profile, tag, instance_type, vpc_id, subnet_id, availability_zone, instance_id, tag_key,
+                   launched_after, launched_before, bastion_ip, key_path, metrics_source, bastion_username,
+                   bastion_connections, concurrency, host_timeout, deadline, visualize, chart_format, snapshot, watch,
+                   interval, violations, rule, output, columns, profiles, regions):
     """List EC2 instances with Private IP, Name tag, and Instance Type."""
-    list_ec2_instances(profile, tag, instance_type, bastion_ip, key_path, bastion_username, visualize)
+    from .ec2.instances import list_ec2_instances
+    from .rules import configured_rules
+    if watch and (violations or rule):
+        raise click.BadParameter('--violations does not apply to --watch', param_hint="'--violations'")
+    if watch and snapshot:
+        raise click.BadParameter('--snapshot does not apply to --watch', param_hint="'--snapshot'")
+    if watch and output != 'grid':
+        raise click.BadParameter('--watch redraws a grid; it cannot write {}'.format(output), param_hint="'--output'")
+    if watch and columns:
+        raise click.BadParameter('--columns does not apply to --watch', param_hint="'--columns'")
+    if bastion_ip and not key_path:
+        raise click.BadParameter('--key-path is required with --bastion-ip', param_hint="'--key-path'")
+    if not bastion_ip and (watch or metrics_source == 'ssh'):
+        raise click.BadParameter('--bastion-ip is required with {}'.format(
+            '--watch' if watch else '--metrics-source ssh'), param_hint="'--bastion-ip'")
+    rules = configured_rules(profile, rule) if violations or rule else None
+    filters = {'vpc-id': vpc_id, 'subnet-id': subnet_id, 'availability-zone': availability_zone,
+               'instance-id': instance_id, 'tag-key': tag_key}
+    list_ec2_instances(profile, tag, instance_type, bastion_ip, key_path, bastion_username, visualize,
+                       bastion_connections, concurrency, host_timeout, deadline, regions, profiles, watch, interval,
+                       filters=filters, launched_after=launched_after, launched_before=launched_before,
+                       output=output, columns=columns, chart_format=chart_format, rules=rules,
+                       snapshot=snapshot, source=metrics_source)
 
 @cli.command()
+@inventory_cache_options
 @click.option('--profile', default='default', help='AWS profile to use')
 @click.option('--volume-type', help='Volume type to filter volumes')
-@click.option('--visualize', is_flag=True, help='Visualize the volume metrics')
-def list_volumes(profile, volume_type, visualize):
+@click.option('--metrics', is_flag=True,
+              help='Add the last hour of IOPS, queue length and burst balance and flag saturated or idle volumes')
+@click.option('--bastion-ip', help='Bastion server IP address, optionally as host:port; adds host disk usage '
+                                   'to --metrics')
+@click.option('--key-path', help='Path to SSH private key file')
+@click.option('--bastion-username', default='ec2-user', help='Username for bastion server')
+@click.option('--bastion-connections', default=1, type=click.IntRange(min=1),
+              help='Number of pooled bastion SSH connections to multiplex host sessions over')
+@click.option('--concurrency', default=50, type=click.IntRange(min=1),
+              help='Maximum number of hosts scanned concurrently')
+@click.option('--host-timeout', default=15.0, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds before a single host is reported as timed out')
+@click.option('--visualize', is_flag=True, help='Write a chart of the volume metrics')
+@chart_format_option
+@snapshot_option
+@output_option
+@columns_option
+@profiles_option
+@regions_option
+def list_volumes(profile, volume_type, metrics, bastion_ip, key_path, bastion_username, bastion_connections,
+                 concurrency, host_timeout, visualize, chart_format, snapshot, output, columns, profiles, regions):
     """List EBS volumes with details."""
-    list_ebs_volumes(profile, volume_type, visualize)
+    from .ebs.volumes import list_ebs_volumes
+    if bastion_ip and not metrics:
+        raise click.BadParameter('--bastion-ip needs --metrics', param_hint="'--bastion-ip'")
+    if bastion_ip and not key_path:
+        raise click.BadParameter('--key-path is required with --bastion-ip', param_hint="'--key-path'")
+    list_ebs_volumes(profile, volume_type, visualize, regions, profiles, output, columns, chart_format, metrics,
+                     bastion_ip, key_path, bastion_username, bastion_connections, concurrency, host_timeout, snapshot)
 
 @cli.command()
+@inventory_cache_options
 @click.option('--profile', default='default', help='AWS profile to use')
-@click.option('--visualize', is_flag=True, help='Visualize the load balancer metrics')
-def list_load_balancers(profile, visualize):
+@click.option('--visualize', is_flag=True, help='Write a chart of the load balancer metrics')
+@chart_format_option
+@snapshot_option
+@output_option
+@columns_option
+@profiles_option
+@regions_option
+def list_load_balancers(profile, visualize, chart_format, snapshot, output, columns, profiles, regions):
     """List ELB instances with details."""
-    list_elb_instances(profile, visualize)
+    from .elb.load_balancers import list_elb_instances
+    list_elb_instances(profile, visualize, regions, profiles, output, columns, chart_format, snapshot)
 
 @cli.command()
+@inventory_cache_options
 @click.option('--profile', default='default', help='AWS profile to use')
-@click.option('--visualize', is_flag=True, help='Visualize the bucket metrics')
-def list_buckets(profile, visualize):
+@click.option('--exact', is_flag=True,
+              help='Size buckets by listing every object instead of using CloudWatch storage metrics')
+@click.option('--visualize', is_flag=True, help='Write a chart of the bucket metrics')
+@chart_format_option
+@snapshot_option
+@output_option
+@columns_option
+@profiles_option
+@click.option('--regions', callback=lambda ctx, param, value: parse_list_option(value),
+              help='Comma-separated regions to keep buckets from')
+def list_buckets(profile, exact, visualize, chart_format, snapshot, output, columns, profiles, regions):
     """List S3 buckets with details."""
-    list_s3_buckets(profile, visualize)
+    from .s3.buckets import list_s3_buckets
+    list_s3_buckets(profile, visualize, exact, regions, profiles, output, columns, chart_format, snapshot)
 
 @cli.command()
+@inventory_cache_options
 @click.option('--profile', default='default', help='AWS profile to use')
 @click.option('--start-date', help='Start date for cost and usage report (YYYY-MM-DD)')
 @click.option('--end-date', help='End date for cost and usage report (YYYY-MM-DD)')
-def list_cost(profile, start_date, end_date):
+@click.option('--granularity', default='DAILY', type=click.Choice(['DAILY', 'MONTHLY', 'HOURLY'], case_sensitive=False),
+              help='Period each row covers (HOURLY needs hourly granularity enabled in Cost Explorer)')
+@click.option('--group-by', multiple=True,
+              help='Break costs down by SERVICE, LINKED_ACCOUNT, REGION, USAGE_TYPE, INSTANCE_TYPE or TAG:<key>; '
+                   'may be given twice')
+@click.option('--metric', 'metrics', multiple=True,
+              help='Cost metric to report, e.g. UnblendedCost, AmortizedCost, UsageQuantity (default: UnblendedCost)')
+@output_option
+@columns_option
+@profiles_option
+def list_cost(profile, start_date, end_date, granularity, group_by, metrics, output, columns, profiles):
     """List AWS cost and usage data."""
-    list_cost_and_usage(profile, start_date, end_date)
+    from .cost.cost_explorer import list_cost_and_usage, parse_group_by
+    if len(group_by) > 2:
+        raise click.BadParameter('Cost Explorer groups by at most two keys', param_hint="'--group-by'")
+    group_by = [parse_group_by(value) for value in group_by]
+    list_cost_and_usage(profile, start_date, end_date, profiles, granularity.upper(), metrics, group_by, output,
+                        columns)
+
+@cli.command()
+@click.option('--profile', default='default', help='AWS profile to use')
+@profiles_option
+@regions_option
+@click.option('--interval', 'intervals', multiple=True, metavar='KIND=SECONDS',
+              help='Poll interval for an inventory, e.g. ec2-instances=60 (kinds: ec2-instances, ebs-volumes, '
+                   'elb-instances, s3-buckets, cost-and-usage)')
+@click.option('--bastion-ip', help='Bastion server IP address; enables keeping EC2 host metrics warm')
+@click.option('--key-path', help='Path to SSH private key file')
+@click.option('--bastion-username', default='ec2-user', help='Username for bastion server')
+@click.option('--bastion-connections', default=1, type=click.IntRange(min=1),
+              help='Number of pooled bastion SSH connections to keep open')
+@click.option('--concurrency', default=50, type=click.IntRange(min=1),
+              help='Maximum number of hosts sampled concurrently')
+@click.option('--host-timeout', default=15.0, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds before sampling a single host is abandoned')
+def serve(profile, profiles, regions, intervals, bastion_ip, key_path, bastion_username, bastion_connections,
+          concurrency, host_timeout):
+    """Keep inventories warm in the background and serve them to list-* commands."""
+    from .daemon import serve as serve_daemon, DEFAULT_SCHEDULES
+    schedules = {}
+    for interval in intervals:
+        kind, _, seconds = interval.partition('=')
+        if kind not in DEFAULT_SCHEDULES or not seconds.isdigit() or int(seconds) < 1:
+            raise click.BadParameter("'{}' is not KIND=SECONDS".format(interval), param_hint="'--interval'")
+        schedules[kind] = int(seconds)
+    if bastion_ip and not key_path:
+        raise click.BadParameter('--key-path is required with --bastion-ip', param_hint="'--key-path'")
+    serve_daemon(profiles or [profile], regions, schedules, bastion_ip, key_path, bastion_username,
+                 bastion_connections, concurrency, host_timeout)
+
+@cli.command()
+@inventory_cache_options
+@click.option('--profile', default='default', help='AWS profile to use')
+@click.option('--tag', multiple=True, help='Tag key-value pair to filter instances, format: key:value')
+@click.option('--instance-type', help='Instance type to filter instances')
+@click.option('--vpc-id', multiple=True, callback=_flatten_list_option, help='VPC to filter instances by')
+@click.option('--instance-id', multiple=True, callback=_flatten_list_option,
+              help='Instance ID(s) to include, repeatable or comma-separated')
+@click.option('--bastion-ip', help='Bastion server IP address, optionally as host:port; adds SSH metrics')
+@click.option('--key-path', help='Path to SSH private key file')
+@click.option('--bastion-username', default='ec2-user', help='Username for bastion server')
+@click.option('--bastion-connections', default=1, type=click.IntRange(min=1),
+              help='Number of pooled bastion SSH connections to multiplex host sessions over')
+@click.option('--concurrency', default=50, type=click.IntRange(min=1),
+              help='Maximum number of hosts scanned concurrently')
+@click.option('--host-timeout', default=15.0, type=click.FloatRange(min=0, min_open=True),
+              help='Seconds before a single host is reported as timed out')
+@click.option('--violations', is_flag=True,
+              help='Only list instances that break a rule, worst first, with the severity and the rules broken')
+@click.option('--rule', multiple=True, callback=_flatten_list_option,
+              help='Rule such as "unhealthy>0:critical" or "cpu>90"; repeatable, implies --violations and replaces '
+                   'the configured rules')
+@output_option
+@columns_option
+@profiles_option
+@regions_option
+def report(profile, tag, instance_type, vpc_id, instance_id, bastion_ip, key_path, bastion_username,
+           bastion_connections, concurrency, host_timeout, violations, rule, output, columns, profiles, regions):
+    """Report each EC2 instance joined with its EBS volumes, load balancer health and SSH metrics."""
+    from .report import report_instances
+    from .rules import configured_rules
+    if bastion_ip and not key_path:
+        raise click.BadParameter('--key-path is required with --bastion-ip', param_hint="'--key-path'")
+    report_instances(profile, tag, instance_type, {'vpc-id': vpc_id, 'instance-id': instance_id}, regions,
+                     profiles, bastion_ip, key_path, bastion_username, bastion_connections, concurrency,
+                     host_timeout, output, columns, configured_rules(profile, rule) if violations or rule else None)
+
+@cli.command()
+@click.argument('kind', type=click.Choice(SNAPSHOT_KINDS))
+@click.option('--from', 'from_ref', default='previous',
+              help='Older snapshot: latest, previous (default), an age such as 24h or 7d, or a UTC time')
+@click.option('--to', 'to_ref', default='latest', help='Newer snapshot, in the same forms (default: latest)')
+@click.option('--fields', callback=lambda ctx, param, value: parse_list_option(value),
+              help='Comma-separated fields to compare, e.g. "DiskUsed,CPUUtilization"; default all')
+@click.option('--min-delta', default=0.0, type=click.FloatRange(min=0),
+              help='Ignore numeric changes smaller than this')
+@output_option
+@columns_option
+def diff(kind, from_ref, to_ref, fields, min_delta, output, columns):
+    """Compare two snapshots saved with --snapshot: added, removed and changed resources."""
+    from .snapshots import compare_snapshots
+    compare_snapshots(kind, from_ref, to_ref, fields, min_delta, output, columns)
+
+@cli.command()
+@click.option('--sizes', default='10,100,1000,10000',
+              help='Comma-separated fleet sizes; each is that many instances, volumes and buckets')
+@click.option('--latency', default=0.05, type=click.FloatRange(min=0),
+              help='Seconds each fake host takes to answer the collector')
+@click.option('--concurrency', default=50, type=click.IntRange(min=1),
+              help='Maximum number of hosts sampled concurrently')
+@click.option('--bastion-connections', default=1, type=click.IntRange(min=1),
+              help='Number of pooled bastion SSH connections shared by all host sessions')
+@output_option
+@columns_option
+def bench(sizes, latency, concurrency, bastion_connections, output, columns):
+    """Benchmark the list commands against a mocked AWS account and a fake SSH fleet (needs moto)."""
+    from .bench.runner import run_benchmark
+    try:
+        sizes = [int(size) for size in parse_list_option(sizes) or []]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) < 1:
+        raise click.BadParameter('expected comma-separated positive integers', param_hint="'--sizes'")
+    run_benchmark(sizes, latency, concurrency, bastion_connections, output, columns)
 
 if __name__ == "__main__":
     cli()
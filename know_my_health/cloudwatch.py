@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+
+# GetMetricData accepts at most 500 MetricDataQueries per request
+MAX_QUERIES_PER_REQUEST = 500
+
+
+def aligned_window(length, align=300):
+    """Return the most recent closed (start, end) window of `length` seconds aligned to `align`."""
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    end = now - timedelta(seconds=int(now.timestamp()) % align)
+    return end - timedelta(seconds=length), end
+
+
+def metric_query(query_id, namespace, metric_name, dimensions, stat, period):
+    """Build a single MetricStat query for GetMetricData."""
+    return {
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': namespace,
+                'MetricName': metric_name,
+                'Dimensions': [{'Name': name, 'Value': value} for name, value in dimensions.items()]
+            },
+            'Period': period,
+            'Stat': stat
+        },
+        'ReturnData': True
+    }
+
+
+def get_metric_data(cloudwatch_client, queries, start_time, end_time, timestamps=False):
+    """Run `queries` packed 500 per GetMetricData call, returning {query_id: [values]}.
+
+    With `timestamps` each value comes as a (timestamp, value) pair, for lining up
+    datapoints of different metrics.
+    """
+    values = {query['Id']: [] for query in queries}
+    paginator = cloudwatch_client.get_paginator('get_metric_data')
+    for i in range(0, len(queries), MAX_QUERIES_PER_REQUEST):
+        batch = queries[i:i + MAX_QUERIES_PER_REQUEST]
+        for page in paginator.paginate(MetricDataQueries=batch, StartTime=start_time, EndTime=end_time):
+            for result in page['MetricDataResults']:
+                values[result['Id']].extend(
+                    zip(result['Timestamps'], result['Values']) if timestamps else result['Values'])
+    return values
@@ -0,0 +1,58 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'SlowDown',
+    'EC2ThrottledException',
+    'ProvisionedThroughputExceededException',
+    'BandwidthLimitExceeded',
+    'PriorRequestNotComplete',
+}
+
+
+class TokenBucket:
+    """Allow `rate` calls per second on average with bursts of up to `capacity`, blocking callers beyond that.
+
+    One bucket is shared by every thread calling the same API, so a wide fan-out
+    queues for tokens instead of tripping the account's request limits.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive")
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            # Jitter keeps the waiting threads from waking in lockstep and racing for one token
+            time.sleep(wait * random.uniform(1, 1.5))
+
+
+def parallel_map(func, items, max_workers=16):
+    """Apply `func` to every item on a bounded thread pool, returning results in input order."""
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
@@ -1,11 +1,35 @@
 import os
 import click
 import configparser
-import boto3
+import threading
 
-CONFIG_DIR = os.path.expanduser("~/.know_my_health")
+# KNOW_MY_HEALTH_HOME points everything (config, cache, daemon socket) at another directory,
+# e.g. for benchmarks or to keep separate sets of credentials
+CONFIG_DIR = os.environ.get("KNOW_MY_HEALTH_HOME") or os.path.expanduser("~/.know_my_health")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config")
 
+# AWS client defaults, overridable per profile (or for every profile under [DEFAULT]) in the config file:
+#   retry_mode = adaptive            botocore retry mode: legacy, standard or adaptive
+#   max_attempts = 10                attempts per call, including the first
+#   max_pool_connections = 50        HTTP connections per client, shared by concurrent workers
+#   requests_per_second = 20         optional ceiling per credentials, region and service...
+#   ec2_requests_per_second = 50     ...or for one service
+RETRY_MODES = ('legacy', 'standard', 'adaptive')
+DEFAULT_RETRY_MODE = 'adaptive'
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+
+# Process-wide caches: the config file is parsed once per modification, each profile gets
+# one boto3 session, and clients are shared per (profile, region, service). boto3 sessions
+# are not safe for concurrent client creation, so everything is built under one lock.
+_lock = threading.RLock()
+_parsed_config = {'mtime': None, 'config': None}
+_sessions = {}
+_clients = {}
+_loader = {}
+_event_handlers = []
+_rate_limiters = {}
+
 
 def setup_config():
     """Setup AWS credentials and initial settings."""
@@ -32,14 +56,35 @@ def setup_config():
 
     with open(CONFIG_FILE, "w") as f:
         config.write(f)
+    _forget_profile(profile)
 
     click.echo("Configuration saved successfully.")
 
 
+def _read_config():
+    try:
+        mtime = os.path.getmtime(CONFIG_FILE)
+    except OSError:
+        mtime = None
+    with _lock:
+        if _parsed_config['config'] is None or _parsed_config['mtime'] != mtime:
+            config = configparser.ConfigParser()
+            config.read(CONFIG_FILE)
+            _parsed_config['config'] = config
+            _parsed_config['mtime'] = mtime
+        return _parsed_config['config']
+
+
+def _forget_profile(profile):
+    with _lock:
+        _sessions.pop(profile, None)
+        for key in [key for key in _clients if key[0] == profile]:
+            del _clients[key]
+
+
 def get_config(profile="default"):
     """Load configuration from the config file."""
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
+    config = _read_config()
 
     if profile not in config:
         raise click.ClickException("Profile '{}' not found in configuration file.".format(profile))
@@ -51,12 +96,105 @@ def get_config(profile="default"):
     }
 
 
-def get_boto3_client(service, profile="default"):
-    """Get a boto3 client using the configured credentials."""
-    config = get_config(profile)
-    return boto3.client(
-        service,
-        aws_access_key_id=config["aws_access_key_id"],
-        aws_secret_access_key=config["aws_secret_access_key"],
-        region_name=config["aws_region"]
-    )
+def get_setting(profile, name, default=None):
+    """Return an optional setting of a profile, falling back to [DEFAULT] and then `default`."""
+    config = _read_config()
+    if profile not in config:
+        raise click.ClickException("Profile '{}' not found in configuration file.".format(profile))
+    return config[profile].get(name, default)
+
+
+def list_profiles():
+    """Return every profile name in the config file."""
+    return _read_config().sections()
+
+
+def get_boto3_session(profile="default"):
+    """Get the cached boto3 session for a profile."""
+    with _lock:
+        if profile not in _sessions:
+            # boto3 is imported on first use so commands like --help and setup start instantly
+            import boto3
+            import botocore.session
+            config = get_config(profile)
+            core_session = botocore.session.get_session()
+            # Share one data loader so service models are parsed once, not once per profile
+            if 'data_loader' in _loader:
+                core_session.register_component('data_loader', _loader['data_loader'])
+            else:
+                _loader['data_loader'] = core_session.get_component('data_loader')
+            for event_name, handler in _event_handlers:
+                core_session.register(event_name, handler)
+            _sessions[profile] = boto3.session.Session(
+                aws_access_key_id=config["aws_access_key_id"],
+                aws_secret_access_key=config["aws_secret_access_key"],
+                region_name=config["aws_region"],
+                botocore_session=core_session
+            )
+        return _sessions[profile]
+
+
+def register_event_handler(event_name, handler):
+    """Register a botocore event handler, e.g. for 'before-call', on every current and future session."""
+    with _lock:
+        _event_handlers.append((event_name, handler))
+        for session in _sessions.values():
+            session._session.register(event_name, handler)
+
+
+def get_client_settings(profile, service):
+    """Return the retry mode, max attempts, connection pool size and requests-per-second ceiling (or None)
+    configured for a profile's clients of `service`."""
+    section = _read_config()[profile]
+    retry_mode = section.get("retry_mode", DEFAULT_RETRY_MODE)
+    if retry_mode not in RETRY_MODES:
+        raise click.ClickException("retry_mode for profile '{}' must be one of: {}".format(
+            profile, ", ".join(RETRY_MODES)))
+    try:
+        max_attempts = section.getint("max_attempts", DEFAULT_MAX_ATTEMPTS)
+        max_pool_connections = section.getint("max_pool_connections", DEFAULT_MAX_POOL_CONNECTIONS)
+        requests_per_second = section.getfloat("{}_requests_per_second".format(service),
+                                               section.getfloat("requests_per_second", None))
+    except ValueError as e:
+        raise click.ClickException("Invalid client setting for profile '{}': {}".format(profile, e))
+    return retry_mode, max_attempts, max_pool_connections, requests_per_second
+
+
+def _rate_limiter(credentials, region, service, requests_per_second):
+    """Return a handler that takes a token from the bucket shared by these credentials, region and service."""
+    from .concurrency import TokenBucket
+    key = (credentials, region, service)
+    if key not in _rate_limiters or _rate_limiters[key].rate != requests_per_second:
+        _rate_limiters[key] = TokenBucket(requests_per_second)
+    bucket = _rate_limiters[key]
+
+    def take_token(**kwargs):
+        # before-send fires for every attempt, so retries are paced as well
+        bucket.acquire()
+
+    return take_token
+
+
+def get_boto3_client(service, profile="default", region=None):
+    """Get a cached boto3 client using the configured credentials, optionally for a region other than the profile's.
+
+    Clients retry throttled calls with jittered backoff (adaptive mode also paces
+    the client to the throughput AWS accepts), and may share a configured
+    requests-per-second ceiling with every other client of the same account credentials.
+    """
+    with _lock:
+        session = get_boto3_session(profile)
+        key = (profile, region or session.region_name, service)
+        if key not in _clients:
+            from botocore.config import Config
+            retry_mode, max_attempts, max_pool_connections, requests_per_second = get_client_settings(
+                profile, service)
+            client = session.client(service, region_name=key[1], config=Config(
+                retries={'mode': retry_mode, 'total_max_attempts': max_attempts},
+                max_pool_connections=max_pool_connections))
+            if requests_per_second:
+                credentials = get_config(profile)["aws_access_key_id"]
+                client.meta.events.register('before-send', _rate_limiter(credentials, key[1], service,
+                                                                         requests_per_second))
+            _clients[key] = client
+        return _clients[key]
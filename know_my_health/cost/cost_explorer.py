@@ -1,48 +1,198 @@
 import click
-from tabulate import tabulate
 from datetime import datetime, timedelta
 from ..config import get_boto3_client
+from ..cache import cache_get_many, cache_put_many, cached_inventory
+from ..output import open_writer
+from ..fanout import resolve_targets, fan_out, account_label, echo_failures
 
+DIMENSION_GROUPS = ('SERVICE', 'LINKED_ACCOUNT', 'REGION', 'USAGE_TYPE', 'INSTANCE_TYPE')
+DEFAULT_METRICS = ('UnblendedCost',)
+# Reports cover the last 30 days unless told otherwise; Cost Explorer keeps hourly data for 14 days only
+DEFAULT_DAYS = 30
+HOURLY_DAYS = 14
 
-def fetch_cost_and_usage(profile="default", start_date=None, end_date=None):
-    """Fetch cost and usage data from AWS Cost Explorer."""
-    ce_client = get_boto3_client('ce', profile)
+# Cost Explorer keeps revising recent usage; periods that ended longer ago than this are
+# treated as final, cached forever and never queried (or paid for) again
+SETTLE_DAYS = 2
 
-    if not start_date:
-        start_date = (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%d')
-    if not end_date:
-        end_date = datetime.utcnow().strftime('%Y-%m-%d')
 
-    response = ce_client.get_cost_and_usage(
-        TimePeriod={
-            'Start': start_date,
-            'End': end_date
+def parse_group_by(value):
+    """Turn "SERVICE" or "TAG:team" into a Cost Explorer GroupBy definition."""
+    if value.upper().startswith('TAG:'):
+        return {'Type': 'TAG', 'Key': value[4:]}
+    if value.upper() in DIMENSION_GROUPS:
+        return {'Type': 'DIMENSION', 'Key': value.upper()}
+    raise click.BadParameter("'{}' is not one of {} or TAG:<key>".format(value, ', '.join(DIMENSION_GROUPS)))
+
+
+def _parse_time(value):
+    return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S' if 'T' in value else '%Y-%m-%d')
+
+
+def _format_time(value, granularity):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ' if granularity == 'HOURLY' else '%Y-%m-%d')
+
+
+def cost_window(start_date=None, end_date=None, granularity='DAILY'):
+    """Return the (start, end) of the report, defaulting to the last DEFAULT_DAYS days, or HOURLY_DAYS for HOURLY."""
+    now = datetime.utcnow()
+    if granularity != 'HOURLY':
+        return (start_date or (now - timedelta(days=DEFAULT_DAYS)).strftime('%Y-%m-%d'),
+                end_date or now.strftime('%Y-%m-%d'))
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    # The oldest whole hour still inside Cost Explorer's hourly retention
+    earliest = hour - timedelta(days=HOURLY_DAYS) + timedelta(hours=1)
+    if start_date and _parse_time(start_date) < earliest:
+        raise click.BadParameter("HOURLY data only covers the last {} days; start at {} or later".format(
+            HOURLY_DAYS, _format_time(earliest, granularity)), param_hint="'--start-date'")
+    return start_date or _format_time(earliest, granularity), end_date or _format_time(hour, granularity)
+
+
+def _periods(start, end, granularity):
+    """Split [start, end) into the (start, end) periods Cost Explorer reports for `granularity`."""
+    periods = []
+    current = start
+    while current < end:
+        if granularity == 'HOURLY':
+            following = current + timedelta(hours=1)
+        elif granularity == 'MONTHLY':
+            following = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        else:
+            following = current + timedelta(days=1)
+        following = min(following, end)
+        periods.append((_format_time(current, granularity), _format_time(following, granularity)))
+        current = following
+    return periods
+
+
+def _group_label(keys):
+    # Tag keys come back as "team$payments"; an empty value means the resource is untagged
+    return " / ".join(key.split('$', 1)[1] or '(untagged)' if '$' in key else key for key in keys)
+
+
+def _query_cost_and_usage(ce_client, start, end, granularity, metrics, group_by):
+    """Query one contiguous range, following NextPageToken, and return {period start: (estimated, rows)}."""
+    request = {
+        'TimePeriod': {
+            'Start': start,
+            'End': end
         },
-        Granularity='DAILY',
-        Metrics=['UnblendedCost'],
-    )
+        'Granularity': granularity,
+        'Metrics': list(metrics),
+    }
+    if group_by:
+        request['GroupBy'] = list(group_by)
 
-    results = []
-    for result in response['ResultsByTime']:
-        date = result['TimePeriod']['Start']
-        amount = result['Total']['UnblendedCost']['Amount']
-        results.append({
-            'Date': date,
-            'Amount': float(amount)
-        })
+    periods = {}
+    # Cost Explorer has no boto3 paginator, so follow NextPageToken by hand. With GroupBy,
+    # the groups of one period can be split across pages, so rows are gathered per period.
+    while True:
+        response = ce_client.get_cost_and_usage(**request)
+        for result in response['ResultsByTime']:
+            date = result['TimePeriod']['Start']
+            estimated, rows = periods.setdefault(date, (result.get('Estimated', False), []))
+            if group_by:
+                for group in result.get('Groups', []):
+                    rows.append(_cost_row(date, _group_label(group['Keys']), group['Metrics'], metrics))
+            else:
+                rows.append(_cost_row(date, None, result['Total'], metrics))
+        if not response.get('NextPageToken'):
+            break
+        request['NextPageToken'] = response['NextPageToken']
+    return periods
 
-    return results
 
+def _cost_row(date, group, values, metrics):
+    amounts = {metric: float(values[metric]['Amount']) if metric in values else 0.0 for metric in metrics}
+    return {
+        'Date': date,
+        'Group': group,
+        'Amount': amounts[metrics[0]],
+        'Metrics': amounts,
+        'Units': {metric: values[metric].get('Unit') for metric in metrics if metric in values}
+    }
 
-def list_cost_and_usage(profile="default", start_date=None, end_date=None):
+
+def fetch_cost_and_usage(profile="default", start_date=None, end_date=None, granularity='DAILY',
+                         metrics=DEFAULT_METRICS, group_by=()):
+    """Fetch cost and usage rows from the inventory cache, or from AWS Cost Explorer."""
+    metrics = tuple(metrics) or DEFAULT_METRICS
+    group_by = tuple(parse_group_by(value) if isinstance(value, str) else value for value in group_by)
+
+    start_date, end_date = cost_window(start_date, end_date, granularity)
+    key = [profile, start_date, end_date, granularity, metrics, group_by]
+    return cached_inventory('cost-and-usage', key, lambda: _fetch_cost_and_usage(
+        profile, start_date, end_date, granularity, metrics, group_by))
+
+
+def _fetch_cost_and_usage(profile, start_date, end_date, granularity, metrics, group_by):
+    """Fetch cost and usage data from AWS Cost Explorer, reusing cached settled periods.
+
+    Only periods that are missing from the cache are queried, in as few contiguous ranges
+    as possible, so a rolling report re-fetches just the last few unsettled days.
+    """
+    periods = _periods(_parse_time(start_date), _parse_time(end_date), granularity)
+    cache_prefix = "{}|{}|{}|{}|".format(profile, granularity, ",".join(metrics),
+                                         ",".join("{Type}:{Key}".format(**group) for group in group_by))
+    keys = {period: cache_prefix + "/".join(period) for period in periods}
+    cached = cache_get_many('cost-periods', keys.values())
+
+    # Consecutive uncached periods are fetched with a single query
+    ranges = []
+    for period in periods:
+        if keys[period] in cached:
+            continue
+        if ranges and ranges[-1][1] == period[0]:
+            ranges[-1][1] = period[1]
+        else:
+            ranges.append([period[0], period[1]])
+
+    ce_client = get_boto3_client('ce', profile) if ranges else None
+    fetched = {}
+    settled_before = datetime.utcnow() - timedelta(days=SETTLE_DAYS)
+    for start, end in ranges:
+        fetched.update(_query_cost_and_usage(ce_client, start, end, granularity, metrics, group_by))
+
+    settled = {}
+    for period in periods:
+        if period[0] in fetched:
+            estimated, rows = fetched[period[0]]
+            if not estimated and _parse_time(period[1]) <= settled_before:
+                settled[keys[period]] = rows
+        else:
+            rows = cached.get(keys[period], [])
+        yield from rows
+    if settled:
+        cache_put_many('cost-periods', settled)
+
+
+def list_cost_and_usage(profile="default", start_date=None, end_date=None, profiles=None, granularity='DAILY',
+                        metrics=DEFAULT_METRICS, group_by=(), output='grid', columns=None):
     """List cost and usage data."""
-    costs = fetch_cost_and_usage(profile, start_date, end_date)
+    metrics = tuple(metrics) or DEFAULT_METRICS
+    # Checked once up front, so a bad window is a usage error rather than one failure per profile
+    start_date, end_date = cost_window(start_date, end_date, granularity)
+    # Cost Explorer is a global service, so only profiles fan out
+    targets = resolve_targets(profiles or [profile], regional=False)
+    multi_target = len(targets) > 1
+    failures = []
+
+    headers = ["S.No", "Date"]
+    if group_by:
+        headers.append("Group")
+    headers += ["Amount (USD)"] if metrics == DEFAULT_METRICS else list(metrics)
+    if multi_target:
+        headers.append("Account")
+    writer = open_writer(output, headers, columns)
 
-    table = []
-    for cost in costs:
-        table.append([
-            len(table) + 1, cost['Date'], cost['Amount']
-        ])
+    for row_number, (target, cost) in enumerate(fan_out(
+            lambda p, r: fetch_cost_and_usage(p, start_date, end_date, granularity, metrics, group_by),
+            targets, failures), 1):
+        writer.write(
+            [row_number, cost['Date']]
+            + ([cost['Group']] if group_by else [])
+            + [cost['Metrics'][metric] for metric in metrics]
+            + ([account_label(target[0])] if multi_target else []))
 
-    headers = ["S.No", "Date", "Amount (USD)"]
-    click.echo(tabulate(table, headers, tablefmt="grid"))
+    writer.close()
+    echo_failures(failures)
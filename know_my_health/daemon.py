@@ -0,0 +1,327 @@
+import heapq
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+import click
+from concurrent.futures import ThreadPoolExecutor
+from .config import CONFIG_DIR
+
+SOCKET_FILE = os.path.join(CONFIG_DIR, "daemon.sock")
+
+# Default poll interval per inventory kind, in seconds
+DEFAULT_SCHEDULES = {
+    'ec2-instances': 300,
+    'ebs-volumes': 300,
+    'elb-instances': 300,
+    's3-buckets': 3600,
+    'cost-and-usage': 3600,
+}
+# A snapshot the daemon failed to refresh for this many intervals is no longer served
+STALE_AFTER_INTERVALS = 2
+POLL_WORKERS = 8
+CLIENT_TIMEOUT = 2
+
+
+def _request(request):
+    """Send one newline-delimited JSON request to the daemon, returning (socket, reader) or None if none is running."""
+    if not os.path.exists(SOCKET_FILE):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CLIENT_TIMEOUT)
+    try:
+        sock.connect(SOCKET_FILE)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+    except OSError:
+        # A socket file left behind by a daemon that died
+        sock.close()
+        return None
+    return sock, sock.makefile('r', encoding='utf-8')
+
+
+def _read_reply(connection):
+    sock, reader = connection
+    try:
+        return json.loads(reader.readline())
+    except (OSError, ValueError):
+        reader.close()
+        sock.close()
+        return None
+
+
+def daemon_inventory(kind, key, max_age=None):
+    """Return a running daemon's snapshot of an inventory as a record generator, or None if it has none.
+
+    The daemon only answers with snapshots it is keeping fresh; `max_age` seconds
+    additionally bounds how old an accepted snapshot may be.
+    """
+    connection = _request({'op': 'inventory', 'kind': kind, 'key': key})
+    if connection is None:
+        return None
+    header = _read_reply(connection)
+    sock, reader = connection
+    if not header or not header.get('found') or (max_age is not None and time.time() - header['stored_at'] > max_age):
+        reader.close()
+        sock.close()
+        return None
+
+    def records():
+        try:
+            for _ in range(header['count']):
+                yield json.loads(reader.readline())
+        finally:
+            reader.close()
+            sock.close()
+
+    return records()
+
+
+def daemon_instance_metrics():
+    """Return {instance_id: metrics} for every host a running daemon has recently sampled over SSH."""
+    connection = _request({'op': 'metrics'})
+    if connection is None:
+        return {}
+    reply = _read_reply(connection)
+    if reply is None:
+        return {}
+    connection[1].close()
+    connection[0].close()
+    return reply['metrics']
+
+
+def daemon_status():
+    """Return the status reply of a running daemon, or None."""
+    connection = _request({'op': 'status'})
+    if connection is None:
+        return None
+    reply = _read_reply(connection)
+    if reply is not None:
+        connection[1].close()
+        connection[0].close()
+    return reply
+
+
+class _Daemon:
+    """In-memory inventory snapshots, refreshed on schedules and served over the Unix socket."""
+
+    def __init__(self, schedules):
+        self.schedules = schedules
+        self.started_at = time.time()
+        self.snapshots = {}
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def store_snapshot(self, kind, key, records):
+        with self.lock:
+            self.snapshots[(kind, key)] = (time.time(), records)
+
+    def store_metrics(self, sampled_at, metrics):
+        with self.lock:
+            for instance_id, values in metrics.items():
+                self.metrics[instance_id] = dict(values, SampledAt=sampled_at)
+
+    def fresh(self, kind, stored_at):
+        return time.time() - stored_at <= self.schedules[kind] * STALE_AFTER_INTERVALS
+
+    def handle(self, request, write):
+        op = request.get('op')
+        if op == 'inventory':
+            with self.lock:
+                snapshot = self.snapshots.get((request['kind'], request['key']))
+            if snapshot is None or not self.fresh(request['kind'], snapshot[0]):
+                write({'found': False})
+                return
+            stored_at, records = snapshot
+            write({'found': True, 'stored_at': stored_at, 'count': len(records)})
+            for record in records:
+                write(record)
+        elif op == 'metrics':
+            with self.lock:
+                metrics = {instance_id: values for instance_id, values in self.metrics.items()
+                           if self.fresh('ec2-instances', values['SampledAt'])}
+            write({'metrics': metrics})
+        elif op == 'status':
+            with self.lock:
+                snapshots = [{'kind': kind, 'key': key, 'stored_at': stored_at, 'count': len(records)}
+                             for (kind, key), (stored_at, records) in self.snapshots.items()]
+                sampled = len(self.metrics)
+            write({'pid': os.getpid(), 'started_at': self.started_at, 'snapshots': snapshots,
+                   'sampled_hosts': sampled})
+        else:
+            write({'error': "unknown op '{}'".format(op)})
+
+
+def _make_server(daemon):
+    from .cache import encode_record
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline())
+            except ValueError:
+                return
+
+            def write(message):
+                self.wfile.write(json.dumps(message, default=encode_record).encode() + b"\n")
+
+            try:
+                daemon.handle(request, write)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    if daemon_status() is not None:
+        raise click.ClickException("A daemon is already listening on {}".format(SOCKET_FILE))
+    if os.path.exists(SOCKET_FILE):
+        os.unlink(SOCKET_FILE)
+    if not os.path.exists(CONFIG_DIR):
+        os.makedirs(CONFIG_DIR)
+    server = socketserver.ThreadingUnixStreamServer(SOCKET_FILE, Handler)
+    server.daemon_threads = True
+    # Snapshots come from the configured credentials; keep them to this user
+    os.chmod(SOCKET_FILE, 0o600)
+    return server
+
+
+def _pollers(profiles, regions, bastion):
+    """Build (kind, name, poll) for every inventory the daemon keeps warm."""
+    from .fanout import resolve_targets
+    from .ec2.instances import fetch_ec2_instances
+    from .ebs.volumes import fetch_ebs_volumes
+    from .elb.load_balancers import fetch_elb_instances
+    from .s3.buckets import fetch_s3_buckets
+    from .cost.cost_explorer import fetch_cost_and_usage
+
+    def drain(records):
+        for _ in records:
+            pass
+
+    pollers = []
+    for profile, region in resolve_targets(profiles, regions):
+        name = "{}/{}".format(profile, region) if region else profile
+
+        def poll_instances(profile=profile, region=region):
+            instances = list(fetch_ec2_instances(profile, None, None, region))
+            if bastion:
+                bastion(instances)
+
+        pollers.append(('ec2-instances', name, poll_instances))
+        pollers.append(('ebs-volumes', name,
+                        lambda profile=profile, region=region: drain(fetch_ebs_volumes(profile, None, region))))
+        pollers.append(('elb-instances', name,
+                        lambda profile=profile, region=region: drain(fetch_elb_instances(profile, region))))
+    for profile, _ in resolve_targets(profiles, regional=False):
+        pollers.append(('s3-buckets', profile, lambda profile=profile: drain(fetch_s3_buckets(profile))))
+        pollers.append(('cost-and-usage', profile, lambda profile=profile: drain(fetch_cost_and_usage(profile))))
+    return pollers
+
+
+def _bastion_sampler(daemon, bastion_ip, key_path, bastion_username, bastion_connections, concurrency,
+                     host_timeout):
+    """Return a function that samples instances over SSH through one long-lived bastion pool."""
+    from .ec2.bastion import BastionPool
+    from .ec2.instances import get_instance_metrics_via_ssh
+    from .ec2.scanner import scan_fleet, STATUS_OK
+
+    bastion_pool = BastionPool(bastion_ip, key_path, bastion_username, size=bastion_connections,
+                               timeout=host_timeout)
+
+    def sample(instances):
+        sampled_at = time.time()
+        results = scan_fleet(
+            instances,
+            lambda instance: get_instance_metrics_via_ssh(instance, bastion_pool, key_path, timeout=host_timeout),
+            concurrency=concurrency, host_timeout=host_timeout)
+        daemon.store_metrics(sampled_at, {
+            instance['InstanceId']: {'CPUUtilization': result[1], 'IOWait': result[2], 'RAMUsage': result[3],
+                                     'EBSVolumes': result[4]}
+            for instance, status, result in results if status == STATUS_OK and result[1] is not None})
+
+    sample.pool = bastion_pool
+    return sample
+
+
+def _log(message):
+    click.echo("{} {}".format(time.strftime('%Y-%m-%d %H:%M:%S'), message), err=True)
+
+
+def _run_schedule(daemon, pollers, stopped):
+    """Run every poller on its kind's interval until `stopped` is set, never overlapping a poller with itself."""
+    executor = ThreadPoolExecutor(max_workers=POLL_WORKERS)
+    running = set()
+    running_lock = threading.Lock()
+    due = [(time.time(), index) for index in range(len(pollers))]
+    heapq.heapify(due)
+
+    def run(index):
+        kind, name, poll = pollers[index]
+        started = time.time()
+        try:
+            poll()
+            _log("Refreshed {} for {} in {:.1f}s".format(kind, name, time.time() - started))
+        except Exception as e:
+            _log("Failed to refresh {} for {}: {}".format(kind, name, e))
+        finally:
+            with running_lock:
+                running.discard(index)
+
+    try:
+        while not stopped.is_set():
+            when, index = due[0]
+            if stopped.wait(max(0, when - time.time())):
+                break
+            heapq.heapreplace(due, (when + daemon.schedules[pollers[index][0]], index))
+            with running_lock:
+                if index in running:
+                    continue
+                running.add(index)
+            executor.submit(run, index)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def serve(profiles, regions=None, schedules=None, bastion_ip=None, key_path=None, bastion_username='ec2-user',
+          bastion_connections=1, concurrency=50, host_timeout=15):
+    """Run the daemon in the foreground until interrupted.
+
+    Inventories are refreshed on `schedules` ({kind: seconds}) with long-lived boto3
+    clients, and with a bastion the EC2 hosts are sampled over a warm SSH pool. list-*
+    commands read the current snapshots over the Unix socket instead of calling AWS.
+    """
+    from .cache import add_snapshot_listener, set_inventory_policy
+
+    daemon = _Daemon(dict(DEFAULT_SCHEDULES, **(schedules or {})))
+    # The daemon is the thing keeping the cache fresh, so its own fetches always go to AWS
+    set_inventory_policy(refresh=True)
+    add_snapshot_listener(daemon.store_snapshot)
+
+    bastion = None
+    if bastion_ip:
+        bastion = _bastion_sampler(daemon, bastion_ip, key_path, bastion_username, bastion_connections,
+                                   concurrency, host_timeout)
+    pollers = _pollers(profiles, regions, bastion)
+
+    server = _make_server(daemon)
+    stopped = threading.Event()
+    scheduler = threading.Thread(target=_run_schedule, args=(daemon, pollers, stopped), daemon=True)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+    _log("Serving {} inventories on {}".format(len(pollers), SOCKET_FILE))
+    scheduler.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        if os.path.exists(SOCKET_FILE):
+            os.unlink(SOCKET_FILE)
+        if bastion:
+            bastion.pool.close()
+        _log("Stopped")
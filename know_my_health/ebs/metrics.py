@@ -0,0 +1,199 @@
+from ..config import get_boto3_client
+from ..cache import cache_get_many, cache_put_many
+from ..cloudwatch import aligned_window, metric_query, get_metric_data
+from ..concurrency import parallel_map
+from ..ec2.collector import disk_device
+from ..ec2.scanner import STATUS_OK
+
+# Volume metrics cover the last closed hour in 5-minute periods, so peaks are 5-minute averages
+METRICS_WINDOW = 3600
+METRICS_PERIOD = 300
+VOLUME_METRICS = [
+    ('ReadOps', 'VolumeReadOps', 'Sum'),
+    ('WriteOps', 'VolumeWriteOps', 'Sum'),
+    ('QueueLength', 'VolumeQueueLength', 'Average'),
+    ('BurstBalance', 'BurstBalance', 'Minimum'),
+]
+# Fields each volume gets, None where CloudWatch had no datapoints
+METRIC_FIELDS = ('AvgIops', 'PeakIops', 'QueueLength', 'BurstBalance')
+# Metrics fetches running at once, one per profile/region
+METRICS_WORKERS = 8
+
+# gp3 includes 3000 IOPS in its price; provisioned IOPS above that (or any on io1/io2) cost extra
+INCLUDED_IOPS = {'gp3': 3000, 'io1': 0, 'io2': 0}
+SATURATED_IOPS_PERCENT = 90
+LOW_BURST_BALANCE_PERCENT = 20
+UNUSED_IOPS_PERCENT = 10
+MOSTLY_EMPTY_PERCENT = 20
+
+
+def _summarise(series):
+    """Reduce one volume's {field: {timestamp: value}} datapoints to IOPS, queue length and burst balance."""
+    ops = {}
+    for field in ('ReadOps', 'WriteOps'):
+        for timestamp, value in series.get(field, {}).items():
+            ops[timestamp] = ops.get(timestamp, 0) + value
+    queue = list(series.get('QueueLength', {}).values())
+    burst = list(series.get('BurstBalance', {}).values())
+    return {
+        'AvgIops': sum(ops.values()) / METRICS_WINDOW if ops else None,
+        'PeakIops': max(ops.values()) / METRICS_PERIOD if ops else None,
+        'QueueLength': sum(queue) / len(queue) if queue else None,
+        # Only gp2, st1 and sc1 volumes publish a burst balance
+        'BurstBalance': min(burst) if burst else None,
+    }
+
+
+def fetch_volume_metrics(profile, region, volume_ids):
+    """Fetch IOPS, queue length and burst balance for volumes in one region.
+
+    Every volume's queries are packed into as few GetMetricData calls as possible
+    (125 volumes per call), and results are cached per aligned metrics window.
+    Returns {volume_id: metrics}.
+    """
+    start_time, end_time = aligned_window(METRICS_WINDOW)
+    window_key = "{}/{}".format(start_time.isoformat(), METRICS_WINDOW)
+    keys = {volume_id: "{}|{}".format(volume_id, window_key) for volume_id in volume_ids}
+    cached = cache_get_many('ebs-volume-metrics', keys.values())
+
+    queries = []
+    query_ids = {}
+    for volume_id, key in keys.items():
+        if key in cached:
+            continue
+        for field, metric_name, stat in VOLUME_METRICS:
+            query_id = 'm{}'.format(len(queries))
+            query_ids[query_id] = (volume_id, field)
+            queries.append(metric_query(query_id, 'AWS/EBS', metric_name, {'VolumeId': volume_id}, stat,
+                                        METRICS_PERIOD))
+
+    fetched = {}
+    if queries:
+        series = {}
+        cloudwatch_client = get_boto3_client('cloudwatch', profile, region)
+        for query_id, datapoints in get_metric_data(cloudwatch_client, queries, start_time, end_time,
+                                                    timestamps=True).items():
+            volume_id, field = query_ids[query_id]
+            series.setdefault(volume_id, {})[field] = dict(datapoints)
+        fetched = {volume_id: _summarise(fields) for volume_id, fields in series.items()}
+        cache_put_many('ebs-volume-metrics', {keys[volume_id]: metrics for volume_id, metrics in fetched.items()},
+                       ttl=METRICS_WINDOW)
+
+    return {volume_id: fetched.get(volume_id) or cached.get(key) or {} for volume_id, key in keys.items()}
+
+
+def _disk_name(device):
+    # Xen guests see an attachment's /dev/sdf as /dev/xvdf
+    name = disk_device(device).rsplit('/', 1)[-1]
+    return 'sd' + name[3:] if name.startswith('xvd') else name
+
+
+def fetch_host_disk_usage(volumes_by_target, bastion_ip, key_path, bastion_username='ec2-user', bastion_connections=1,
+                          concurrency=50, host_timeout=15):
+    """Measure how full each attached volume's filesystems are, with df on its instance over SSH.
+
+    A filesystem belongs to a volume when its NVMe serial is the volume ID (Nitro), or
+    its disk matches the attachment device, allowing for xvdX/sdX renaming (Xen).
+    Returns ({volume_id: highest Use% across its filesystems}, scan results).
+    """
+    # paramiko is only loaded when a bastion is used, so plain list-volumes starts quickly
+    from ..ec2.bastion import BastionPool
+    from ..ec2.instances import fetch_ec2_instances, metrics_collector
+    from ..ec2.scanner import scan_fleet
+    attachments = {}
+    for volumes in volumes_by_target.values():
+        for volume in volumes:
+            for attachment in volume.get('AttachedInstances', []):
+                if attachment['State'] == 'attached':
+                    attachments.setdefault(attachment['InstanceId'], []).append(
+                        (volume['VolumeId'], attachment['Device']))
+
+    def attached_instances():
+        for (profile, region), volumes in volumes_by_target.items():
+            instance_ids = sorted({attachment['InstanceId'] for volume in volumes
+                                   for attachment in volume.get('AttachedInstances', [])} & set(attachments))
+            if instance_ids:
+                yield from fetch_ec2_instances(profile, None, None, region, {'instance-id': instance_ids})
+
+    with BastionPool(bastion_ip, key_path, bastion_username, size=bastion_connections,
+                     timeout=host_timeout) as bastion_pool:
+        results = scan_fleet(attached_instances(), metrics_collector(bastion_pool, key_path, host_timeout),
+                             concurrency=concurrency, host_timeout=host_timeout)
+
+    usage = {}
+    for instance, status, result in results:
+        if status != STATUS_OK:
+            continue
+        for volume_id, device in attachments.get(instance['InstanceId'], []):
+            used = [int(filesystem['Use%'].rstrip('%')) for filesystem in result[4]
+                    if filesystem['Use%'].rstrip('%').isdigit() and (
+                        filesystem.get('VolumeId') == volume_id or
+                        _disk_name(filesystem.get('Disk', filesystem['Filesystem'])) == _disk_name(device))]
+            if used:
+                usage[volume_id] = max(used)
+    return usage, results
+
+
+def iops_used_percent(volume, metrics):
+    """Peak IOPS as a percentage of the volume's provisioned (or gp2 baseline) IOPS, or None."""
+    if metrics.get('PeakIops') is None or not isinstance(volume.get('Iops'), int) or not volume['Iops']:
+        return None
+    return 100.0 * metrics['PeakIops'] / volume['Iops']
+
+
+def volume_flags(volume, metrics, disk_used=None):
+    """Name what looks wrong with a volume: saturated, low on burst credits, paying for unused IOPS or mostly empty."""
+    flags = []
+    used = iops_used_percent(volume, metrics)
+    if used is not None and used >= SATURATED_IOPS_PERCENT:
+        flags.append('Saturated IOPS')
+    if metrics.get('BurstBalance') is not None and metrics['BurstBalance'] <= LOW_BURST_BALANCE_PERCENT:
+        flags.append('Low burst balance')
+    included = INCLUDED_IOPS.get(volume['VolumeType'])
+    if (used is not None and used < UNUSED_IOPS_PERCENT and included is not None
+            and volume['Iops'] > included):
+        flags.append('Unused IOPS')
+    if disk_used is not None and disk_used < MOSTLY_EMPTY_PERCENT:
+        flags.append('Mostly empty')
+    return flags
+
+
+def add_volume_metrics(records, bastion_ip=None, key_path=None, bastion_username='ec2-user', bastion_connections=1,
+                       concurrency=50, host_timeout=15, failures=None):
+    """Attach CloudWatch metrics, host disk usage (with a bastion) and flags to (target, volume) records.
+
+    Returns (records, scan results or None). Metrics for each profile/region are
+    fetched concurrently once all of its volumes are known; a target whose fetch fails
+    is appended to `failures` as (target, error) and its volumes are listed without metrics.
+    """
+    records = list(records)
+    volumes_by_target = {}
+    for target, volume in records:
+        volumes_by_target.setdefault(target, []).append(volume)
+
+    def fetch(item):
+        (profile, region), volumes = item
+        try:
+            return fetch_volume_metrics(profile, region, [volume['VolumeId'] for volume in volumes])
+        except Exception as e:
+            if failures is not None:
+                failures.append(((profile, region), "CloudWatch: {}".format(e)))
+            return {}
+
+    fetched = parallel_map(fetch, list(volumes_by_target.items()), METRICS_WORKERS)
+    metrics_by_volume = {}
+    for metrics in fetched:
+        metrics_by_volume.update(metrics)
+
+    usage, results = {}, None
+    if bastion_ip:
+        usage, results = fetch_host_disk_usage(volumes_by_target, bastion_ip, key_path, bastion_username,
+                                               bastion_connections, concurrency, host_timeout)
+
+    for target, volume in records:
+        metrics = metrics_by_volume.get(volume['VolumeId'], {})
+        volume.update({field: metrics.get(field) for field in METRIC_FIELDS})
+        volume['IopsUsed'] = iops_used_percent(volume, metrics)
+        volume['DiskUsed'] = usage.get(volume['VolumeId'])
+        volume['Flags'] = volume_flags(volume, metrics, volume['DiskUsed'])
+    return records, results
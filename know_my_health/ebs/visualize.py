@@ -1,26 +1,19 @@
-import matplotlib.pyplot as plt
+from ..charts import render_in_background
 
-def visualize_volumes(volumes):
-    """Visualize EBS volumes using Matplotlib."""
-    volume_ids = [volume['VolumeId'] for volume in volumes]
-    sizes = [volume['Size'] for volume in volumes]
-    iops = [volume['Iops'] if volume['Iops'] != 'N/A' else 0 for volume in volumes]
-    throughput = [volume['Throughput'] if volume['Throughput'] != 'N/A' else 0 for volume in volumes]
 
-    fig, ax = plt.subplots()
+def _volume_series(volumes):
+    labels = [volume['VolumeId'] for volume in volumes]
+    series = {
+        'Size (GiB)': [volume['Size'] for volume in volumes],
+        'IOPS': [volume['Iops'] for volume in volumes],
+        'Throughput (MB/s)': [volume['Throughput'] for volume in volumes],
+    }
+    # Present when listed with --metrics
+    if volumes and 'IopsUsed' in volumes[0]:
+        series['IOPS Used (%)'] = [volume['IopsUsed'] for volume in volumes]
+    return labels, series
 
-    bar_width = 0.25
-    index = range(len(volumes))
 
-    bar1 = plt.bar(index, sizes, bar_width, label='Size (GiB)')
-    bar2 = plt.bar([i + bar_width for i in index], iops, bar_width, label='IOPS')
-    bar3 = plt.bar([i + 2 * bar_width for i in index], throughput, bar_width, label='Throughput (MB/s)')
-
-    plt.xlabel('Volume ID')
-    plt.ylabel('Metrics')
-    plt.title('EBS Volume Metrics')
-    plt.xticks([i + bar_width for i in index], volume_ids, rotation=45)
-    plt.legend()
-
-    plt.tight_layout()
-    plt.show()
+def visualize_volumes(volumes, chart_format='png'):
+    """Render EBS volume size, IOPS and throughput to a chart file in the background; returns a Future of its path."""
+    return render_in_background('ebs-volumes', 'EBS Volume Metrics', volumes, _volume_series, chart_format)
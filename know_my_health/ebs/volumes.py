@@ -1,11 +1,25 @@
-import click
-from tabulate import tabulate
-from ..config import get_boto3_client
+from ..config import get_boto3_client, get_config
+from ..cache import cached_inventory
+from ..output import open_writer
+from ..charts import echo_chart
+from ..fanout import resolve_targets, fan_out, target_columns, echo_failures, TARGET_HEADERS
+from ..snapshots import Snapshot, save_snapshot
+from .metrics import add_volume_metrics
 from .visualize import visualize_volumes
 
-def fetch_ebs_volumes(profile="default", volume_type=None):
-    """Fetch EBS volumes and list their details."""
-    ec2_client = get_boto3_client('ec2', profile)
+# Volume fields kept in snapshots; the metrics are only present with --metrics
+SNAPSHOT_FIELDS = ('Size', 'State', 'VolumeType', 'Iops', 'Throughput', 'Attachments', 'AvgIops', 'PeakIops',
+                   'IopsUsed', 'QueueLength', 'BurstBalance', 'DiskUsed')
+
+
+def fetch_ebs_volumes(profile="default", volume_type=None, region=None):
+    """Fetch EBS volumes from the inventory cache, or page by page from AWS, yielding their details."""
+    key = [profile, region or get_config(profile)['aws_region'], volume_type]
+    return cached_inventory('ebs-volumes', key, lambda: _describe_volumes(profile, volume_type, region))
+
+
+def _describe_volumes(profile, volume_type, region):
+    ec2_client = get_boto3_client('ec2', profile, region)
 
     filters = []
     if volume_type:
@@ -14,48 +28,107 @@ def fetch_ebs_volumes(profile="default", volume_type=None):
             'Values': [volume_type]
         })
 
-    response = ec2_client.describe_volumes(Filters=filters)
-
-    volumes = []
-    for volume in response['Volumes']:
-        volume_id = volume['VolumeId']
-        size = volume['Size']
-        state = volume['State']
-        volume_type = volume['VolumeType']
-        iops = volume.get('Iops', 'N/A')
-        throughput = volume.get('Throughput', 'N/A')
-        attachments = volume['Attachments']
-        attachment_details = ', '.join(
-            [f"{attachment['InstanceId']} ({attachment['State']})" for attachment in attachments])
-
-        volumes.append({
-            'VolumeId': volume_id,
-            'Size': size,
-            'State': state,
-            'VolumeType': volume_type,
-            'Iops': iops,
-            'Throughput': throughput,
-            'Attachments': attachment_details
-        })
+    paginator = ec2_client.get_paginator('describe_volumes')
+    for page in paginator.paginate(Filters=filters):
+        for volume in page['Volumes']:
+            volume_id = volume['VolumeId']
+            size = volume['Size']
+            state = volume['State']
+            volume_type = volume['VolumeType']
+            iops = volume.get('Iops', 'N/A')
+            throughput = volume.get('Throughput', 'N/A')
+            attachments = volume['Attachments']
+            attachment_details = ', '.join(
+                [f"{attachment['InstanceId']} ({attachment['State']})" for attachment in attachments])
 
-    # Sort by VolumeType by default
-    volumes.sort(key=lambda x: x['VolumeType'])
-    return volumes
+            yield {
+                'VolumeId': volume_id,
+                'Size': size,
+                'State': state,
+                'VolumeType': volume_type,
+                'Iops': iops,
+                'Throughput': throughput,
+                'Attachments': attachment_details,
+                # Structured copy of the attachments for joining volumes to instances
+                'AttachedInstances': [{'InstanceId': attachment['InstanceId'],
+                                       'Device': attachment.get('Device', 'N/A'),
+                                       'State': attachment['State']} for attachment in attachments]
+            }
 
 
-def list_ebs_volumes(profile="default", volume_type=None, visualize=False):
-    """List EBS volumes with details."""
-    volumes = fetch_ebs_volumes(profile, volume_type)
+def _format_metric(value, fmt):
+    return fmt.format(value) if value is not None else 'N/A'
 
-    table = []
-    for volume in volumes:
-        table.append([
-            len(table) + 1, volume['VolumeId'], volume['Size'], volume['State'], volume['VolumeType'],
-            volume['Iops'], volume['Throughput'], volume['Attachments']
-        ])
+
+def list_ebs_volumes(profile="default", volume_type=None, visualize=False, regions=None, profiles=None,
+                     output='grid', columns=None, chart_format='png', metrics=False, bastion_ip=None, key_path=None,
+                     bastion_username='ec2-user', bastion_connections=1, concurrency=50, host_timeout=15,
+                     snapshot=False):
+    """List EBS volumes with details.
+
+    With `metrics`, adds the last hour of IOPS, queue length and burst balance from
+    CloudWatch and flags saturated or over-provisioned volumes; with a bastion too, adds
+    how full each attached volume is according to df on its instance. With `snapshot`,
+    the volumes are also appended to the snapshot history.
+    """
+    volumes = [] if visualize else None
+    history = Snapshot('volumes') if snapshot else None
+    targets = resolve_targets(profiles or [profile], regions)
+    multi_target = len(targets) > 1
+    human = output == 'grid'
+    failures = []
 
     headers = ["S.No", "Volume ID", "Size (GiB)", "State", "Volume Type", "IOPS", "Throughput", "Attachments"]
-    click.echo(tabulate(table, headers, tablefmt="grid"))
+    if metrics:
+        headers += ["Avg IOPS", "Peak IOPS", "IOPS Used (%)", "Queue Length", "Burst Balance (%)"]
+        if bastion_ip:
+            headers += ["Disk Used (%)"]
+        headers += ["Flags"]
+        flags = len(headers) - 1
+        # Flagged volumes first, then by VolumeType
+        sort_key = lambda x: (not x[flags], x[4])
+    else:
+        # Sort the grid by VolumeType by default
+        sort_key = lambda x: x[4]
+    if multi_target:
+        headers += TARGET_HEADERS
+    writer = open_writer(output, headers, columns, sort_key=sort_key, renumber=True)
+
+    records = fan_out(lambda p, r: fetch_ebs_volumes(p, volume_type, r), targets, failures)
+    results = None
+    if metrics:
+        # Metrics are fetched in batches per region, so every volume is listed first
+        records, results = add_volume_metrics(records, bastion_ip, key_path, bastion_username, bastion_connections,
+                                              concurrency, host_timeout, failures)
+
+    for row_number, (target, volume) in enumerate(records, 1):
+        row = [
+            row_number, volume['VolumeId'], volume['Size'], volume['State'], volume['VolumeType'],
+            volume['Iops'], volume['Throughput'], volume['Attachments']
+        ]
+        if metrics:
+            values = [volume['AvgIops'], volume['PeakIops'], volume['IopsUsed'], volume['QueueLength'],
+                      volume['BurstBalance']] + ([volume['DiskUsed']] if bastion_ip else [])
+            if human:
+                formats = ["{:.0f}", "{:.0f}", "{:.1f}", "{:.2f}", "{:.0f}", "{}"]
+                row += [_format_metric(value, fmt) for value, fmt in zip(values, formats)]
+                row += ["\n".join(volume['Flags'])]
+            else:
+                row += values + [", ".join(volume['Flags'])]
+        writer.write(row + (target_columns(target) if multi_target else []))
+        if visualize:
+            volumes.append(volume)
+        if snapshot:
+            fields = {field: volume[field] for field in SNAPSHOT_FIELDS if field in volume}
+            history.add(volume['VolumeId'], **fields)
 
-    if visualize:
-        visualize_volumes(volumes)
+    # The chart renders in the background while the table is printed
+    chart = visualize_volumes(volumes, chart_format) if visualize else None
+    writer.close()
+    echo_failures(failures)
+    if results is not None:
+        from ..ec2.instances import echo_scan_problems
+        echo_scan_problems(results, err=not human)
+    save_snapshot(history, err=not human)
+    if chart:
+        echo_chart(chart, err=not human)
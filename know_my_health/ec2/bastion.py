@@ -0,0 +1,119 @@
+import socket
+import threading
+import paramiko
+from paramiko import SSHClient, AutoAddPolicy
+from ..timings import timed
+
+
+class BastionPool:
+    """A small pool of bastion SSH transports shared by every per-host session.
+
+    Each transport is opened once and multiplexes any number of direct-tcpip
+    channels, so a fleet scan costs one key exchange per pooled connection
+    instead of one per instance. Dropped transports are reconnected lazily.
+    """
+
+    def __init__(self, bastion_ip, key_path, username='ec2-user', size=1, timeout=None):
+        if size < 1:
+            raise ValueError("Bastion pool size must be at least 1")
+        # "host:port" reaches a bastion listening somewhere other than 22
+        host, _, port = bastion_ip.rpartition(':') if bastion_ip.count(':') == 1 else ('', '', '')
+        self.bastion_ip = host if port.isdigit() else bastion_ip
+        self.port = int(port) if port.isdigit() else 22
+        self.key_path = key_path
+        self.username = username
+        self.timeout = timeout
+        self.handshakes = 0
+        self._clients = [None] * size
+        self._locks = [threading.Lock() for _ in range(size)]
+        self._counter_lock = threading.Lock()
+        self._next = 0
+        self._auth_error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _connect(self):
+        if self._auth_error:
+            # Retrying a rejected key per host would only hammer the bastion
+            raise self._auth_error
+        client = SSHClient()
+        client.set_missing_host_key_policy(AutoAddPolicy())
+        try:
+            with timed('ssh', 'bastion-handshake'):
+                client.connect(self.bastion_ip, port=self.port, username=self.username,
+                               key_filename=self.key_path, timeout=self.timeout, banner_timeout=self.timeout,
+                               auth_timeout=self.timeout)
+        except paramiko.AuthenticationException as e:
+            self._auth_error = e
+            client.close()
+            raise
+        transport = client.get_transport()
+        # Keepalives stop idle NAT/firewall state from silently killing the shared transport
+        transport.set_keepalive(30)
+        with self._counter_lock:
+            self.handshakes += 1
+        return client
+
+    def _transport(self, slot, stale=None):
+        """Return a live transport for the slot, reconnecting if it dropped or is `stale`."""
+        with self._locks[slot]:
+            client = self._clients[slot]
+            transport = client.get_transport() if client else None
+            if transport is None or not transport.is_active() or transport is stale:
+                if client:
+                    client.close()
+                self._clients[slot] = None
+                client = self._connect()
+                self._clients[slot] = client
+                transport = client.get_transport()
+            return transport
+
+    def _next_slot(self):
+        with self._counter_lock:
+            slot = self._next
+            self._next = (self._next + 1) % len(self._clients)
+        return slot
+
+    def open_channel(self, dest_addr, timeout=None):
+        """Open a direct-tcpip channel to `dest_addr` over one of the pooled transports."""
+        slot = self._next_slot()
+        transport = self._transport(slot)
+        src_addr = ('127.0.0.1', 0)
+        try:
+            return transport.open_channel("direct-tcpip", dest_addr, src_addr, timeout=timeout)
+        except paramiko.ChannelException:
+            # The bastion answered but refused this destination; the transport is fine
+            raise
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            if isinstance(e, paramiko.SSHException) and transport.is_active():
+                # e.g. "Timeout opening channel." for an unreachable host: only this host
+                # fails, as reconnecting would kill every session on the shared transport
+                raise
+            # The transport dropped underneath us: reconnect once and retry
+            transport = self._transport(slot, stale=transport)
+            return transport.open_channel("direct-tcpip", dest_addr, src_addr, timeout=timeout)
+
+    def connect_target(self, host, username, key_path, timeout=None):
+        """Open an SSH session to `host` tunnelled through the pool; the caller closes the returned client."""
+        ssh = SSHClient()
+        ssh.set_missing_host_key_policy(AutoAddPolicy())
+        try:
+            # Multiplex a direct-tcpip channel over the shared bastion transport
+            channel = self.open_channel((host, 22), timeout=timeout)
+            ssh.connect(host, username=username, key_filename=key_path, sock=channel,
+                        timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
+        except Exception:
+            ssh.close()
+            raise
+        return ssh
+
+    def close(self):
+        """Close every pooled bastion connection."""
+        for slot, client in enumerate(self._clients):
+            if client:
+                client.close()
+            self._clients[slot] = None
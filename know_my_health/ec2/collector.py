@@ -0,0 +1,145 @@
+import re
+
+# Samples CPU/iowait and memory in parallel during the same sar interval while
+# df and lsblk run, then emits every line as `section=raw line` so the whole host costs
+# one exec and one round trip.
+_COLLECTOR_BODY = r"""
+d=$(mktemp -d 2>/dev/null || echo /tmp/kmh.$$) && mkdir -p "$d" || exit 1
+sar -u @INTERVAL@ 1 > "$d/cpu" 2>/dev/null &
+sar -r @INTERVAL@ 1 > "$d/mem" 2>/dev/null &
+df -P -H > "$d/df" 2>/dev/null &
+cat /proc/meminfo > "$d/meminfo" 2>/dev/null &
+lsblk -dn -o NAME,SERIAL > "$d/blk" 2>/dev/null &
+wait
+for s in cpu mem df meminfo blk; do sed "s/^/$s=/" "$d/$s"; done
+rm -rf "$d"
+"""
+
+COLLECTOR_SCRIPT = "export LC_ALL=C LANG=C" + _COLLECTOR_BODY.replace('@INTERVAL@', '1')
+
+# Ends each sample in a watch stream
+WATCH_DELIMITER = '@@know-my-health-sample@@'
+
+
+def watch_script(interval):
+    """Return a collector that loops forever, averaging each sample over a full `interval` seconds.
+
+    Because sar averages over the whole interval, back-to-back samples leave no
+    gaps for a short spike to hide in. Every sample ends with WATCH_DELIMITER.
+    """
+    interval = int(interval)
+    # Without sysstat nothing paces the loop, so sleep instead of streaming as fast as possible
+    return ("export LC_ALL=C LANG=C\ncommand -v sar >/dev/null && pace=: || pace='sleep {0}'\n"
+            "while :; do{1}echo '{2}'\n$pace\ndone\n").format(
+        interval, _COLLECTOR_BODY.replace('@INTERVAL@', str(interval)), WATCH_DELIMITER)
+
+
+def split_sections(output):
+    """Group `section=line` collector output into {section: [lines]}."""
+    sections = {}
+    for line in output.splitlines():
+        section, sep, value = line.partition('=')
+        if sep:
+            sections.setdefault(section, []).append(value)
+    return sections
+
+
+def parse_sar_average(lines, column):
+    """Return the named column of a sar report's Average row, matched by header name.
+
+    Header and data rows are aligned from the right, because the left-hand time
+    stamp takes one or two fields depending on the sysstat version and locale.
+    """
+    header = None
+    for line in lines:
+        fields = line.split()
+        if column in fields:
+            header = fields
+        elif header and fields and fields[0].endswith(':') and not fields[0][0].isdigit():
+            # The Average row label is localised ("Average:", "Moyenne:", ...); time stamps are not
+            offset = len(header) - len(fields)
+            index = header.index(column) - offset
+            if 0 < index < len(fields):
+                return float(fields[index].replace(',', '.'))
+    return None
+
+
+def parse_meminfo_used_percent(lines):
+    """Compute used memory percent from /proc/meminfo, excluding reclaimable cache."""
+    values = {}
+    for line in lines:
+        key, _, rest = line.partition(':')
+        parts = rest.split()
+        if parts:
+            values[key] = int(parts[0])
+    total = values.get('MemTotal')
+    if not total:
+        return None
+    available = values.get('MemAvailable')
+    if available is None:
+        available = values.get('MemFree', 0) + values.get('Buffers', 0) + values.get('Cached', 0)
+    return 100.0 * (total - available) / total
+
+
+def parse_df(lines):
+    """Parse POSIX `df -P -H` output into per-filesystem dicts for block devices."""
+    volumes = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 6 and parts[0].startswith('/dev'):
+            filesystem, size, used, avail, percent = parts[:5]
+            volumes.append({
+                'Filesystem': filesystem,
+                'Size': size,
+                'Used': used,
+                'Available': avail,
+                'Use%': percent,
+                # Mount points may contain spaces
+                'Mountpoint': ' '.join(parts[5:]),
+                'Disk': disk_device(filesystem)
+            })
+    return volumes
+
+
+def disk_device(filesystem):
+    """Return the whole-disk device of a partition, e.g. /dev/nvme0n1 for /dev/nvme0n1p1 and /dev/xvda for /dev/xvda1."""
+    directory, _, name = filesystem.rpartition('/')
+    if re.match(r'nvme\d+n\d+p\d+$', name):
+        return directory + '/' + name.rsplit('p', 1)[0]
+    if re.match(r'(xv|s|h)d[a-z]+\d+$', name):
+        return directory + '/' + name.rstrip('0123456789')
+    return filesystem
+
+
+def parse_block_devices(lines):
+    """Map disk devices to EBS volume IDs from `lsblk -dn -o NAME,SERIAL`.
+
+    On Nitro instances EBS volumes are NVMe disks whose serial is the volume ID
+    without its dash, e.g. vol0123456789abcdef0.
+    """
+    volume_ids = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 2 and parts[1].startswith('vol') and not parts[1].startswith('vol-'):
+            volume_ids['/dev/' + parts[0]] = 'vol-' + parts[1][3:]
+    return volume_ids
+
+
+def parse_collector_output(output):
+    """Parse the collector payload into (cpu_usage, iowait, ram_usage, ebs_volumes)."""
+    sections = split_sections(output)
+
+    idle = parse_sar_average(sections.get('cpu', []), '%idle')
+    cpu_usage = 100 - idle if idle is not None else None
+    iowait = parse_sar_average(sections.get('cpu', []), '%iowait')
+
+    ram_usage = parse_sar_average(sections.get('mem', []), '%memused')
+    if ram_usage is None:
+        ram_usage = parse_meminfo_used_percent(sections.get('meminfo', []))
+
+    filesystems = parse_df(sections.get('df', []))
+    volume_ids = parse_block_devices(sections.get('blk', []))
+    for filesystem in filesystems:
+        if filesystem['Disk'] in volume_ids:
+            filesystem['VolumeId'] = volume_ids[filesystem['Disk']]
+    return cpu_usage, iowait, ram_usage, filesystems
@@ -1,157 +1,408 @@
 import click
 from tabulate import tabulate
-import paramiko
-from paramiko import SSHClient, AutoAddPolicy
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from ..config import get_boto3_client
+from ..config import get_boto3_client, get_config
+from ..cache import cached_inventory, refresh_requested
+from ..daemon import daemon_instance_metrics
+from ..output import open_writer
+from ..charts import echo_chart
+from ..timings import timed
+from ..concurrency import parallel_map
+from ..fanout import resolve_targets, fan_out, target_columns, echo_failures, TARGET_HEADERS
+from ..snapshots import Snapshot, save_snapshot
+from ..rules import metric_arrays, evaluate, violators_first, severity_name, echo_violation_summary, highest_first
+from .collector import COLLECTOR_SCRIPT, parse_collector_output
+from .scanner import STATUS_OK, STATUS_TIMEOUT, STATUS_ERROR
+from .sources import (known_unreachable, remember_reachability, fetch_cloudwatch_metrics, fetch_ssm_metrics,
+                      ssm_online)
+from .records import InstanceRecord
 from .visualize import visualize_instance_metrics
 
+# DescribeInstances returns at most 1000 instances per page; the instance-id filter takes 200 values
+DESCRIBE_PAGE_SIZE = 1000
+INSTANCE_ID_BATCH = 200
+# Profile/region groups whose SSM and CloudWatch lookups run at once
+AGENTLESS_WORKERS = 8
 
-def get_instance_metrics_via_ssh(instance, bastion_ip, key_path, bastion_username='ec2-user',
-                                 target_username='ec2-user'):
-    """Fetch instance metrics via SSH using the sar and df -H commands through a bastion server."""
+
+def get_instance_metrics_via_ssh(instance, bastion_pool, key_path, target_username='ec2-user', timeout=None):
+    """Fetch instance metrics via SSH with a single batched collector exec through a pooled bastion connection.
+
+    Connection and authentication failures (paramiko.SSHException, OSError) propagate
+    so the scan can report why a host has no metrics.
+    """
     instance_id = instance['InstanceId']
     private_ip = instance.get('PrivateIpAddress', 'N/A')
 
-    bastion = SSHClient()
-    bastion.set_missing_host_key_policy(AutoAddPolicy())
-
+    ssh = None
     try:
-        # Connect to bastion server
-        bastion.connect(bastion_ip, username=bastion_username, key_filename=key_path)
+        # Connect to target instance through bastion
+        with timed('ssh', 'connect'):
+            ssh = bastion_pool.connect_target(private_ip, target_username, key_path, timeout=timeout)
 
-        # Setup proxy command
-        bastion_transport = bastion.get_transport()
-        dest_addr = (private_ip, 22)
-        local_addr = ('127.0.0.1', 22)
-        channel = bastion_transport.open_channel("direct-tcpip", dest_addr, local_addr)
+        # Sample CPU, memory and filesystems in a single exec
+        with timed('ssh', 'exec'):
+            stdin, stdout, stderr = ssh.exec_command(COLLECTOR_SCRIPT, timeout=timeout)
+            output = stdout.read().decode()
+        cpu_usage, iowait, ram_usage, ebs_volumes = parse_collector_output(output)
 
-        # Connect to target instance through bastion
-        ssh = SSHClient()
-        ssh.set_missing_host_key_policy(AutoAddPolicy())
-        ssh.connect(private_ip, username=target_username, key_filename=key_path, sock=channel)
-
-        # Run the sar command for CPU and RAM usage
-        stdin, stdout, stderr = ssh.exec_command("sar -u 1 1 | grep Average")
-        cpu_output = stdout.read().decode()
-        stdin, stdout, stderr = ssh.exec_command("sar -r 1 1 | grep Average")
-        ram_output = stdout.read().decode()
-
-        # Extract CPU and RAM usage
-        columns = cpu_output.split()
-        cpu_usage = 100 - float(columns[7])  # %idle is the eighth column, so CPU usage is 100 - %idle
-        iowait = float(columns[5])  # %iowait is the sixth column
-        ram_usage = float(ram_output.split()[3])  # %memused is the fourth column
-
-        # Run the df -H command for EBS volumes
-        stdin, stdout, stderr = ssh.exec_command("df -H | grep '^/dev'")
-        ebs_output = stdout.read().decode()
-
-        ebs_volumes = []
-        for line in ebs_output.strip().split("\n"):
-            parts = line.split()
-            if len(parts) >= 6:
-                filesystem, size, used, avail, percent, mountpoint = parts[:6]
-                ebs_volumes.append({
-                    'Filesystem': filesystem,
-                    'Size': size,
-                    'Used': used,
-                    'Available': avail,
-                    'Use%': percent,
-                    'Mountpoint': mountpoint
-                })
-
-        ssh.close()
         return instance_id, cpu_usage, iowait, ram_usage, ebs_volumes
-    except Exception as e:
-        return instance_id, None, None, None, []
     finally:
-        bastion.close()
+        if ssh:
+            ssh.close()
+
+
+def metrics_collector(bastion_pool, key_path, host_timeout):
+    """Return a scan_fleet `collect` that samples a host over SSH, unless a running daemon sampled it recently.
+
+    With --refresh every host is sampled afresh, as cached inventories are bypassed too.
+    """
+    warm_metrics = {} if refresh_requested() else daemon_instance_metrics()
+
+    def collect(instance):
+        metrics = warm_metrics.get(instance['InstanceId'])
+        if metrics:
+            return (instance['InstanceId'], metrics['CPUUtilization'], metrics['IOWait'], metrics['RAMUsage'],
+                    metrics['EBSVolumes'])
+        return get_instance_metrics_via_ssh(instance, bastion_pool, key_path, timeout=host_timeout)
+
+    return collect
+
+
+def apply_scan_result(instance, status, result):
+    """Store a host's scan outcome on its record; unsampled hosts get 'Timeout' or 'N/A' placeholders."""
+    if status == STATUS_OK:
+        instance_id, cpu_usage, iowait, ram_usage, ebs_volumes = result
+        instance['CPUUtilization'] = cpu_usage if cpu_usage is not None else 'N/A'
+        instance['IOWait'] = iowait if iowait is not None else 'N/A'
+        instance['RAMUsage'] = ram_usage if ram_usage is not None else 'N/A'
+        instance['EBSVolumes'] = ebs_volumes
+    else:
+        unavailable = 'Timeout' if status == STATUS_TIMEOUT else 'N/A'
+        instance['CPUUtilization'] = unavailable
+        instance['IOWait'] = unavailable
+        instance['RAMUsage'] = unavailable
+        instance['EBSVolumes'] = []
+
+
+def collect_fleet_metrics(instances, source='auto', bastion_ip=None, key_path=None, bastion_username='ec2-user',
+                          bastion_connections=1, concurrency=50, host_timeout=15, deadline=None, failures=None):
+    """Sample (target, instance) pairs, each from one metrics source, returning (results, summary).
+
+    `source` ssh, ssm or cloudwatch uses that source alone. auto uses SSH through the
+    bastion when one is given, skipping hosts that failed SSH within the last hour, and
+    sends the hosts left without SSH metrics to SSM Run Command if their agent is online;
+    without a bastion it never runs remote commands. Whatever remains goes to CloudWatch,
+    which covers a region in a few batched calls. Each record's
+    MetricsSource says where its metrics came from ('none' if nowhere). SSM and CloudWatch
+    errors are appended to `failures` per target. The summary holds the SSH scan results
+    (or None), the bastion handshakes and how many hosts skipped SSH.
+    """
+    summary = {'ssh_results': None, 'handshakes': 0, 'skipped': 0}
+    use_ssh = source == 'ssh' or (source == 'auto' and bool(bastion_ip))
+    # Run Command executes the collector on the hosts, so auto only falls back to it once SSH was asked for
+    use_ssm = source == 'ssm' or (source == 'auto' and use_ssh)
+    unreachable = known_unreachable() if source == 'auto' and use_ssh else set()
+    targets = {}
+    deferred = []
+    results = []
+
+    def ssh_hosts():
+        for target, instance in instances:
+            targets[instance['InstanceId']] = target
+            if instance['InstanceId'] in unreachable:
+                summary['skipped'] += 1
+                deferred.append(instance)
+            else:
+                yield instance
+
+    if use_ssh:
+        # paramiko is only loaded when hosts are sampled over SSH, so agentless runs start quickly
+        from .bastion import BastionPool
+        from .scanner import scan_fleet
+        with BastionPool(bastion_ip, key_path, bastion_username, size=bastion_connections,
+                         timeout=host_timeout) as bastion_pool:
+            scanned = scan_fleet(ssh_hosts(), metrics_collector(bastion_pool, key_path, host_timeout),
+                                 concurrency=concurrency, host_timeout=host_timeout, deadline=deadline)
+        summary['ssh_results'] = scanned
+        summary['handshakes'] = bastion_pool.handshakes
+        remember_reachability(scanned, timeouts=deadline is None)
+        for instance, status, result in scanned:
+            if status == STATUS_OK or source == 'ssh':
+                instance['MetricsSource'] = 'ssh'
+                results.append((instance, status, result))
+            else:
+                deferred.append(instance)
+    else:
+        for target, instance in instances:
+            targets[instance['InstanceId']] = target
+            deferred.append(instance)
+
+    groups = {}
+    for instance in deferred:
+        groups.setdefault(targets[instance['InstanceId']], []).append(instance)
+
+    def agentless(item):
+        (profile, region), group = item
+        instance_ids = [instance['InstanceId'] for instance in group]
+        found = {}
+        try:
+            if use_ssm:
+                online = ssm_online(profile, region)
+                managed = [instance_id for instance_id in instance_ids if instance_id in online]
+                for instance_id, result in fetch_ssm_metrics(profile, region, managed, host_timeout).items():
+                    found[instance_id] = ('ssm', result)
+        except Exception as e:
+            if failures is not None:
+                failures.append(((profile, region), "SSM Run Command: {}".format(e)))
+        try:
+            remaining = [instance_id for instance_id in instance_ids if instance_id not in found]
+            if source in ('auto', 'cloudwatch') and remaining:
+                for instance_id, result in fetch_cloudwatch_metrics(profile, region, remaining).items():
+                    found[instance_id] = ('cloudwatch', result)
+        except Exception as e:
+            if failures is not None:
+                failures.append(((profile, region), "CloudWatch: {}".format(e)))
+        return group, found
+
+    for group, found in parallel_map(agentless, list(groups.items()), AGENTLESS_WORKERS):
+        for instance in group:
+            metrics_source, result = found.get(instance['InstanceId'], ('none', None))
+            instance['MetricsSource'] = metrics_source
+            results.append((instance, STATUS_OK, result or (instance['InstanceId'], None, None, None, [])))
+    return results, summary
+
+
+def echo_metrics_summary(results, summary, err=False):
+    """Report bastion handshakes and SSH problems, and how many hosts each metrics source covered."""
+    if summary['ssh_results'] is not None:
+        click.echo("Bastion handshakes: {}".format(summary['handshakes']), err=err)
+        echo_scan_problems(summary['ssh_results'], err=err)
+    if summary['skipped']:
+        click.echo("Skipped SSH for {} hosts that recently failed it".format(summary['skipped']), err=err)
+    counts = {}
+    for instance, status, result in results:
+        counts[instance['MetricsSource']] = counts.get(instance['MetricsSource'], 0) + 1
+    if set(counts) - {'ssh'}:
+        click.echo("Metrics sources: {}".format(", ".join(
+            "{} {}".format(source, count) for source, count in sorted(counts.items(), key=lambda item: -item[1]))),
+            err=err)
+
+
+def echo_scan_problems(results, err=False):
+    """Report how many hosts timed out, and why the others that failed over SSH did."""
+    timed_out = sum(status == STATUS_TIMEOUT for instance, status, result in results)
+    if timed_out:
+        click.echo("Timed out: {} of {} hosts".format(timed_out, len(results)), err=err)
+    ssh_errors = {}
+    for instance, status, result in results:
+        if status == STATUS_ERROR:
+            reason = "{}: {}".format(type(result).__name__, result)
+            ssh_errors[reason] = ssh_errors.get(reason, 0) + 1
+    for reason, count in sorted(ssh_errors.items(), key=lambda item: -item[1]):
+        click.echo("SSH failed on {} of {} hosts: {}".format(count, len(results), reason), err=err)
 
 
-def fetch_ec2_instances(profile="default", tags=None, instance_type=None):
-    """Fetch EC2 instances and list their details."""
-    ec2_client = get_boto3_client('ec2', profile)
+def _format_metric(fmt, value):
+    return fmt.format(value) if isinstance(value, float) else value
 
-    filters = [
+
+def _format_summary(summary):
+    return "{:.1f} / {:.1f} / {:.1f} / {:.1f}".format(*summary) if summary else 'N/A'
+
+
+def _render_watch(watches, multi_target, interval, failures):
+    """Redraw the watch table in place with rolling min/avg/p95/max per host."""
+    from .watch import WATCH_CAPACITY
+    table = []
+    for watch in watches:
+        summaries = watch.summaries()
+        instance = watch.instance
+        ebs_details = "\n".join(
+            [f"{vol['Mountpoint']}: {vol['Used']} used of {vol['Size']} ({vol['Use%']})" for vol in
+             watch.ebs_volumes])
+        table.append([
+            len(table) + 1, instance['PrivateIpAddress'], instance['Name'], instance['InstanceType'],
+            _format_summary(summaries['CPUUtilization']),
+            _format_summary(summaries['IOWait']),
+            _format_summary(summaries['RAMUsage']),
+            ebs_details, watch.samples, watch.status
+        ] + instance.get('Target', []))
+
+    headers = ["S.No", "Private IP", "Name", "Instance Type", "CPU (%)", "IO Wait (%)", "RAM Usage (%)",
+               "EBS Details", "Samples", "Status"]
+    if multi_target:
+        headers += TARGET_HEADERS
+    click.clear()
+    click.echo("Every {}s, min / avg / p95 / max over the last {} samples. Ctrl-C to stop.".format(
+        interval, WATCH_CAPACITY))
+    click.echo(tabulate(table, headers, tablefmt="grid"))
+    echo_failures(failures)
+
+
+def fetch_ec2_instances(profile="default", tags=None, instance_type=None, region=None, filters=None,
+                        launched_after=None, launched_before=None):
+    """Fetch EC2 instances from the inventory cache, or page by page from AWS, yielding InstanceRecords.
+
+    `filters` maps EC2 filter names (vpc-id, subnet-id, availability-zone, instance-id,
+    tag-key) to lists of values and is applied by the API; the launch time range is
+    checked locally because DescribeInstances cannot filter on it.
+    """
+    filters = {name: sorted(values) for name, values in (filters or {}).items() if values}
+    key = [profile, region or get_config(profile)['aws_region'], sorted(tags or []), instance_type]
+    if filters or launched_after or launched_before:
+        key += [filters, launched_after, launched_before]
+    records = cached_inventory('ec2-instances', key, lambda: _describe_instances(
+        profile, tags, instance_type, region, filters, launched_after, launched_before))
+    # Cached records come back as plain dicts
+    return (record if isinstance(record, InstanceRecord) else InstanceRecord.from_dict(record)
+            for record in records)
+
+
+def _server_filters(tags, instance_type, filters):
+    server_filters = [
         {'Name': 'instance-state-name', 'Values': ['running']}
     ]
     if tags:
         for tag in tags:
-            key, value = tag.split(':')
-            filters.append({
+            # Tag values may themselves contain colons, e.g. URLs
+            key, _, value = tag.partition(':')
+            server_filters.append({
                 'Name': 'tag:{}'.format(key),
                 'Values': [value]
             })
     if instance_type:
-        filters.append({
+        server_filters.append({
             'Name': 'instance-type',
             'Values': [instance_type]
         })
+    for name, values in filters.items():
+        if name != 'instance-id':
+            server_filters.append({'Name': name, 'Values': list(values)})
+    return server_filters
 
-    response = ec2_client.describe_instances(Filters=filters)
-
-    instances = []
-    for reservation in response['Reservations']:
-        for instance in reservation['Instances']:
-            instance_id = instance['InstanceId']
-            private_ip = instance.get('PrivateIpAddress', 'N/A')
-            name_tag = 'N/A'
-            instance_type = instance.get('InstanceType', 'N/A')
-            for tag in instance.get('Tags', []):
-                if tag['Key'] == 'Name':
-                    name_tag = tag['Value']
-                    break
-            instances.append({
-                'InstanceId': instance_id,
-                'PrivateIpAddress': private_ip,
-                'Name': name_tag,
-                'InstanceType': instance_type
-            })
-    return instances
+
+def _describe_instances(profile, tags, instance_type, region, filters, launched_after, launched_before):
+    ec2_client = get_boto3_client('ec2', profile, region)
+    server_filters = _server_filters(tags, instance_type, filters)
+
+    # Explicit instance IDs go in batches through the instance-id filter: unlike InstanceIds it
+    # keeps pagination available and ignores unknown IDs instead of failing the whole call
+    instance_ids = filters.get('instance-id')
+    batches = ([server_filters + [{'Name': 'instance-id', 'Values': instance_ids[i:i + INSTANCE_ID_BATCH]}]
+                for i in range(0, len(instance_ids), INSTANCE_ID_BATCH)] if instance_ids else [server_filters])
+
+    paginator = ec2_client.get_paginator('describe_instances')
+    for batch_filters in batches:
+        for page in paginator.paginate(Filters=batch_filters, PaginationConfig={'PageSize': DESCRIBE_PAGE_SIZE}):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    launch_time = instance.get('LaunchTime')
+                    if launched_after and (not launch_time or launch_time < launched_after):
+                        continue
+                    if launched_before and (not launch_time or launch_time >= launched_before):
+                        continue
+                    name_tag = 'N/A'
+                    for tag in instance.get('Tags', []):
+                        if tag['Key'] == 'Name':
+                            name_tag = tag['Value']
+                            break
+                    # Only the projected fields outlive the page
+                    yield InstanceRecord(
+                        InstanceId=instance['InstanceId'],
+                        PrivateIpAddress=instance.get('PrivateIpAddress', 'N/A'),
+                        Name=name_tag,
+                        InstanceType=instance.get('InstanceType', 'N/A')
+                    )
 
 
 def list_ec2_instances(profile="default", tags=None, instance_type=None, bastion_ip=None, key_path=None,
-                       bastion_username='ec2-user',visualize=False):
-    """List EC2 instances with details."""
-    instances = fetch_ec2_instances(profile, tags, instance_type)
+                       bastion_username='ec2-user', visualize=False, bastion_connections=1, concurrency=50,
+                       host_timeout=15, deadline=None, regions=None, profiles=None, watch=False, interval=5,
+                       filters=None, launched_after=None, launched_before=None, output='grid', columns=None,
+                       chart_format='png', rules=None, snapshot=False, source='auto'):
+    """List EC2 instances with details, or with `watch` keep refreshing rolling metrics every `interval` seconds.
 
-    table = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {
-            executor.submit(get_instance_metrics_via_ssh, instance, bastion_ip, key_path, bastion_username): instance
-            for instance in instances}
-
-        for future in as_completed(futures):
-            instance = futures[future]
-            try:
-                instance_id, cpu_usage, iowait, ram_usage, ebs_volumes = future.result()
-                instance['CPUUtilization'] = cpu_usage if cpu_usage is not None else 'N/A'
-                instance['IOWait'] = iowait if iowait is not None else 'N/A'
-                instance['RAMUsage'] = ram_usage if ram_usage is not None else 'N/A'
-                instance['EBSVolumes'] = ebs_volumes
-            except Exception as e:
-                instance['CPUUtilization'] = 'N/A'
-                instance['IOWait'] = 'N/A'
-                instance['RAMUsage'] = 'N/A'
-                instance['EBSVolumes'] = []
-
-            ebs_details = "\n".join(
-                [f"{vol['Mountpoint']}: {vol['Used']} used of {vol['Size']} ({vol['Use%']})" for vol in
-                 instance['EBSVolumes']])
-            table.append([
-                len(table) + 1, instance['PrivateIpAddress'], instance['Name'], instance['InstanceType'],
-                "{:.2f}".format(instance['CPUUtilization']) if instance['CPUUtilization'] != 'N/A' else 'N/A',
-                "{:.2f}".format(instance['IOWait']) if instance['IOWait'] != 'N/A' else 'N/A',
-                "{:.2f} %".format(instance['RAMUsage']) if instance['RAMUsage'] != 'N/A' else 'N/A',  # Show % used
-                ebs_details
-            ])
-
-    # Sort the table by CPU utilization and RAM usage
-    table.sort(key=lambda x: (float(x[4]) if x[4] != 'N/A' else -1, float(x[6].split()[0]) if x[6] != 'N/A' else -1),
-               reverse=True)
-
-    headers = ["S.No", "Private IP", "Name", "Instance Type", "CPU (%)", "IO Wait (%)", "RAM Usage (%)", "EBS Details"]
-    click.echo(tabulate(table, headers, tablefmt="grid"))
-    if visualize:
-        visualize_instance_metrics(instances)
+    Rows are ordered by CPU and then RAM usage, highest first. With `rules`, a list of
+    (metric, threshold, severity) tuples, only hosts that break one are listed, worst first.
+    With `snapshot`, every scanned host is also appended to the snapshot history. Metrics
+    come from `source`, as collect_fleet_metrics picks it.
+    """
+    targets = resolve_targets(profiles or [profile], regions)
+    multi_target = len(targets) > 1
+    human = output == 'grid'
+    failures = []
+
+    def tagged_instances():
+        for target, instance in fan_out(
+                lambda p, r: fetch_ec2_instances(p, tags, instance_type, r, filters, launched_after, launched_before),
+                targets, failures):
+            if multi_target:
+                instance['Target'] = target_columns(target)
+            yield target, instance
+
+    if watch:
+        from .bastion import BastionPool
+        from .watch import watch_fleet
+        with BastionPool(bastion_ip, key_path, bastion_username, size=bastion_connections,
+                         timeout=host_timeout) as bastion_pool:
+            watch_fleet([instance for target, instance in tagged_instances()], bastion_pool, key_path, interval,
+                        host_timeout,
+                        lambda watches: _render_watch(watches, multi_target, interval, failures),
+                        concurrency=concurrency)
+        return
+
+    headers = ["S.No", "Private IP", "Name", "Instance Type", "CPU (%)", "IO Wait (%)", "RAM Usage (%)", "EBS Details",
+               "Source"]
+    if rules is not None:
+        headers += ["Severity", "Violations"]
+    if multi_target:
+        headers += TARGET_HEADERS
+    writer = open_writer(output, headers, columns)
+
+    results, summary = collect_fleet_metrics(tagged_instances(), source, bastion_ip, key_path, bastion_username,
+                                             bastion_connections, concurrency, host_timeout, deadline, failures)
+
+    for instance, status, result in results:
+        apply_scan_result(instance, status, result)
+    scanned = [instance for instance, status, result in results]
+    # Metrics are ordered and checked as numbers; cells are only formatted for the hosts printed
+    arrays = metric_arrays(scanned)
+    order = highest_first(arrays['cpu'], arrays['ram'])
+    if rules is not None:
+        severity, reasons = evaluate(arrays, rules)
+        order = violators_first(order, severity)
+    history = Snapshot('instances') if snapshot else None
+    if snapshot:
+        for index, instance in enumerate(scanned):
+            history.add(instance['InstanceId'], Name=instance['Name'], PrivateIpAddress=instance['PrivateIpAddress'],
+                        InstanceType=instance['InstanceType'], CPUUtilization=arrays['cpu'][index],
+                        IOWait=arrays['iowait'][index], RAMUsage=arrays['ram'][index], DiskUsed=arrays['disk'][index])
+
+    for row_number, index in enumerate(order, 1):
+        instance = scanned[index]
+        ebs_details = "\n".join(
+            [f"{vol['Mountpoint']}: {vol['Used']} used of {vol['Size']} ({vol['Use%']})" for vol in
+             instance['EBSVolumes']])
+        if human:
+            metrics = [_format_metric("{:.2f}", instance['CPUUtilization']),
+                       _format_metric("{:.2f}", instance['IOWait']),
+                       _format_metric("{:.2f} %", instance['RAMUsage'])]  # Show % used
+        else:
+            metrics = [instance['CPUUtilization'], instance['IOWait'], instance['RAMUsage']]
+        row = [row_number, instance['PrivateIpAddress'], instance['Name'], instance['InstanceType']] + metrics + [
+            ebs_details, instance['MetricsSource']]
+        if rules is not None:
+            row += [severity_name(severity[index]), ("\n" if human else "; ").join(reasons[index])]
+        writer.write(row + instance.get('Target', []))
+
+    # The chart renders in the background while the table is printed
+    chart = visualize_instance_metrics(scanned, chart_format) if visualize else None
+    writer.close()
+    echo_failures(failures)
+    # Summaries go to stderr when stdout carries machine-readable rows
+    echo_metrics_summary(results, summary, err=not human)
+    if rules is not None:
+        echo_violation_summary(severity, err=not human)
+    save_snapshot(history, err=not human)
+    if chart:
+        echo_chart(chart, err=not human)
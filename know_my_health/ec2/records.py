@@ -0,0 +1,54 @@
+import sys
+
+
+class InstanceRecord:
+    """The projected fields of one EC2 instance, read and written like a dict.
+
+    Only the fields the commands use are kept, in slots rather than a per-instance
+    dict, and repeated values such as instance types are interned, so a fleet of
+    tens of thousands of instances stays small in memory.
+    """
+
+    __slots__ = ('InstanceId', 'PrivateIpAddress', 'Name', 'InstanceType', 'Target',
+                 'CPUUtilization', 'IOWait', 'RAMUsage', 'EBSVolumes', 'MetricsSource')
+
+    def __init__(self, InstanceId, PrivateIpAddress='N/A', Name='N/A', InstanceType='N/A', **fields):
+        self.InstanceId = InstanceId
+        self.PrivateIpAddress = PrivateIpAddress
+        self.Name = sys.intern(Name)
+        self.InstanceType = sys.intern(InstanceType)
+        for field, value in fields.items():
+            self[field] = value
+
+    @classmethod
+    def from_dict(cls, fields):
+        return cls(**fields)
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except (AttributeError, TypeError):
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        if field not in self.__slots__:
+            raise KeyError(field)
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return field in self.__slots__ and hasattr(self, field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [field for field in self.__slots__ if hasattr(self, field)]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.keys()}
+
+    def __repr__(self):
+        return "InstanceRecord({!r})".format(self.to_dict())
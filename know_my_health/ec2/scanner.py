@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+STATUS_OK = 'ok'
+STATUS_TIMEOUT = 'timeout'
+STATUS_ERROR = 'error'
+
+_EXHAUSTED = object()
+
+
+def scan_fleet(instances, collect, concurrency=50, host_timeout=15, deadline=None):
+    """Run `collect(instance)` across the fleet with at most `concurrency` hosts in flight.
+
+    `instances` may be any iterable, including a paginated generator: hosts are
+    scheduled as soon as they are yielded, so scanning overlaps with fetching.
+    Returns a list of (instance, status, result) tuples in no particular order. Hosts that
+    exceed `host_timeout` seconds, are still pending when the global `deadline` expires,
+    or are only yielded after it, are reported with STATUS_TIMEOUT instead of holding a
+    slot; hosts whose `collect` raised are reported with STATUS_ERROR and the exception
+    as the result.
+    """
+    return asyncio.run(_scan_fleet(instances, collect, concurrency, host_timeout, deadline))
+
+
+async def _scan_fleet(instances, collect, concurrency, host_timeout, deadline):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    semaphore = asyncio.Semaphore(concurrency)
+    # Blocking paramiko calls run in threads; the headroom absorbs threads that are
+    # still unwinding after their host timed out so they don't starve new hosts
+    executor = ThreadPoolExecutor(max_workers=concurrency * 2)
+    # Pulling the next page of instances is blocking I/O too, so it gets its own thread
+    feeder = ThreadPoolExecutor(max_workers=1)
+
+    async def scan_host(instance):
+        async with semaphore:
+            try:
+                result = await asyncio.wait_for(loop.run_in_executor(executor, collect, instance), host_timeout)
+                return instance, STATUS_OK, result
+            except asyncio.TimeoutError:
+                return instance, STATUS_TIMEOUT, None
+            except Exception as e:
+                return instance, STATUS_ERROR, e
+
+    tasks = {}
+    results = []
+
+    async def feed():
+        iterator = iter(instances)
+        while True:
+            instance = await loop.run_in_executor(feeder, next, iterator, _EXHAUSTED)
+            if instance is _EXHAUSTED:
+                return
+            if deadline is not None and loop.time() - started >= deadline:
+                # The rest of the fleet is still drained, so every host is reported rather than dropped
+                results.append((instance, STATUS_TIMEOUT, None))
+            else:
+                tasks[asyncio.ensure_future(scan_host(instance))] = instance
+
+    feeding = asyncio.ensure_future(feed())
+    try:
+        try:
+            await asyncio.wait_for(asyncio.shield(feeding), deadline)
+        except asyncio.TimeoutError:
+            pass
+        if tasks:
+            remaining = None if deadline is None else max(0, deadline - (loop.time() - started))
+            done, pending = await asyncio.wait(tasks, timeout=remaining)
+            results.extend(task.result() for task in done)
+            for task in pending:
+                task.cancel()
+                results.append((tasks[task], STATUS_TIMEOUT, None))
+        await feeding
+    finally:
+        feeding.cancel()
+        executor.shutdown(wait=False)
+        feeder.shutdown(wait=False)
+    return results
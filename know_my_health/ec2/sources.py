@@ -0,0 +1,164 @@
+import time
+from ..config import get_boto3_client
+from ..cache import cache_get_all, cache_put_many, cache_delete_many
+from ..cloudwatch import aligned_window, metric_query, get_metric_data
+from ..concurrency import parallel_map
+from .collector import COLLECTOR_SCRIPT, parse_collector_output
+from .scanner import STATUS_OK, STATUS_TIMEOUT, STATUS_ERROR
+
+# Hosts that failed over SSH are sent straight to the other sources for this long, in seconds
+UNREACHABLE_TTL = 3600
+
+# Basic monitoring publishes EC2 metrics every 5 minutes, so the newest closed period is used
+CLOUDWATCH_WINDOW = 900
+CLOUDWATCH_PERIOD = 300
+# CloudWatch agent metrics (CWAgent namespace) and the instance fields they fill
+AGENT_METRICS = [
+    ('mem_used_percent', 'RAMUsage'),
+    ('cpu_usage_iowait', 'IOWait'),
+    ('disk_used_percent', 'EBSVolumes'),
+]
+
+# SendCommand targets at most 50 instances per call
+SSM_BATCH = 50
+SSM_POLL_INTERVAL = 1
+# Terminal invocation statuses; delivery and execution timeouts are StatusDetails of TimedOut
+SSM_DONE = ('Success', 'Failed', 'Cancelled', 'TimedOut', 'Undeliverable', 'Terminated', 'InvalidPlatform',
+            'AccessDenied')
+SSM_WORKERS = 8
+
+
+def known_unreachable():
+    """Return the IDs of hosts that failed over SSH within the last UNREACHABLE_TTL seconds."""
+    return set(cache_get_all('ssh-unreachable'))
+
+
+def remember_reachability(results, timeouts=True):
+    """Record which hosts of an SSH scan failed, and forget earlier failures of those that answered.
+
+    Pass `timeouts=False` when a global deadline may have cut hosts off before they were tried.
+    """
+    failed = {instance['InstanceId']: status for instance, status, result in results
+              if status == STATUS_ERROR or (timeouts and status == STATUS_TIMEOUT)}
+    if failed:
+        cache_put_many('ssh-unreachable', failed, ttl=UNREACHABLE_TTL)
+    answered = [instance['InstanceId'] for instance, status, result in results if status == STATUS_OK]
+    if answered:
+        cache_delete_many('ssh-unreachable', answered)
+
+
+def _agent_dimensions(cloudwatch_client, instance_ids):
+    # The agent's dimensions depend on its configuration (append_dimensions, aggregation), so
+    # the series that exist are listed, a few hundred per call, rather than guessed
+    wanted = set(instance_ids)
+    series = []
+    paginator = cloudwatch_client.get_paginator('list_metrics')
+    for metric_name, field in AGENT_METRICS:
+        seen = set()
+        for page in paginator.paginate(Namespace='CWAgent', MetricName=metric_name, RecentlyActive='PT3H'):
+            for metric in page['Metrics']:
+                dimensions = {dimension['Name']: dimension['Value'] for dimension in metric['Dimensions']}
+                instance_id = dimensions.get('InstanceId')
+                if instance_id not in wanted or dimensions.get('cpu', 'cpu-total') != 'cpu-total':
+                    continue
+                # One series per host, or per mount point for disks
+                key = (instance_id, dimensions.get('path'))
+                if key not in seen:
+                    seen.add(key)
+                    series.append((instance_id, field, metric_name, dimensions))
+    return series
+
+
+def fetch_cloudwatch_metrics(profile, region, instance_ids):
+    """Fetch the latest CPUUtilization and, where the CloudWatch agent runs, memory, iowait and disk usage.
+
+    Every host's queries are packed into shared GetMetricData calls, so the whole fleet
+    of a region costs a few calls. Returns {instance_id: (instance_id, cpu, iowait, ram,
+    filesystems)} for hosts with at least one datapoint.
+    """
+    cloudwatch_client = get_boto3_client('cloudwatch', profile, region)
+    queries = []
+    owners = {}
+
+    def add(instance_id, field, namespace, metric_name, dimensions):
+        query_id = 'q{}'.format(len(queries))
+        owners[query_id] = (instance_id, field, dimensions)
+        queries.append(metric_query(query_id, namespace, metric_name, dimensions, 'Average', CLOUDWATCH_PERIOD))
+
+    for instance_id in instance_ids:
+        add(instance_id, 'CPUUtilization', 'AWS/EC2', 'CPUUtilization', {'InstanceId': instance_id})
+    for instance_id, field, metric_name, dimensions in _agent_dimensions(cloudwatch_client, instance_ids):
+        add(instance_id, field, 'CWAgent', metric_name, dimensions)
+
+    start_time, end_time = aligned_window(CLOUDWATCH_WINDOW)
+    metrics = {}
+    for query_id, values in get_metric_data(cloudwatch_client, queries, start_time, end_time).items():
+        if not values:
+            continue
+        instance_id, field, dimensions = owners[query_id]
+        host = metrics.setdefault(instance_id, {'EBSVolumes': []})
+        # Newest datapoint first
+        if field == 'EBSVolumes':
+            host['EBSVolumes'].append({
+                'Filesystem': dimensions.get('device', 'N/A'), 'Size': 'N/A', 'Used': 'N/A', 'Available': 'N/A',
+                'Use%': "{:.0f}%".format(values[0]), 'Mountpoint': dimensions.get('path', 'N/A')})
+        else:
+            host[field] = values[0]
+    return {instance_id: (instance_id, host.get('CPUUtilization'), host.get('IOWait'), host.get('RAMUsage'),
+                          sorted(host['EBSVolumes'], key=lambda filesystem: filesystem['Mountpoint']))
+            for instance_id, host in metrics.items()}
+
+
+def ssm_online(profile, region):
+    """Return the IDs of instances whose SSM agent is online in a region."""
+    ssm_client = get_boto3_client('ssm', profile, region)
+    paginator = ssm_client.get_paginator('describe_instance_information')
+    return {information['InstanceId']
+            for page in paginator.paginate(Filters=[{'Key': 'PingStatus', 'Values': ['Online']}])
+            for information in page['InstanceInformationList']}
+
+
+def fetch_ssm_metrics(profile, region, instance_ids, timeout):
+    """Run the collector on SSM-managed instances with Run Command, 50 hosts per command.
+
+    Waits up to `timeout` seconds for the commands to finish, cancels them on the hosts
+    that are still running them, and returns {instance_id: (instance_id, cpu, iowait, ram,
+    filesystems)} for hosts that answered.
+    """
+    ssm_client = get_boto3_client('ssm', profile, region)
+    instance_ids = list(instance_ids)
+    pending = {}
+    for i in range(0, len(instance_ids), SSM_BATCH):
+        batch = instance_ids[i:i + SSM_BATCH]
+        command = ssm_client.send_command(InstanceIds=batch, DocumentName='AWS-RunShellScript',
+                                          Parameters={'commands': [COLLECTOR_SCRIPT]},
+                                          TimeoutSeconds=max(30, int(timeout)))['Command']
+        pending[command['CommandId']] = set(batch)
+
+    succeeded = []
+    deadline = time.monotonic() + timeout
+    paginator = ssm_client.get_paginator('list_command_invocations')
+    while pending and time.monotonic() < deadline:
+        time.sleep(SSM_POLL_INTERVAL)
+        for command_id, waiting in list(pending.items()):
+            for page in paginator.paginate(CommandId=command_id):
+                for invocation in page['CommandInvocations']:
+                    if invocation['InstanceId'] in waiting and invocation['Status'] in SSM_DONE:
+                        waiting.discard(invocation['InstanceId'])
+                        if invocation['Status'] == 'Success':
+                            succeeded.append((command_id, invocation['InstanceId']))
+            if not waiting:
+                del pending[command_id]
+
+    def output(item):
+        command_id, instance_id = item
+        # Unlike ListCommandInvocations, this returns up to 24,000 characters of output
+        invocation = ssm_client.get_command_invocation(CommandId=command_id, InstanceId=instance_id)
+        return instance_id, invocation['StandardOutputContent']
+
+    metrics = {instance_id: (instance_id,) + tuple(parse_collector_output(content))
+               for instance_id, content in parallel_map(output, succeeded, SSM_WORKERS)}
+    # Nothing will read what the stragglers produce, so they are not left running
+    for command_id, waiting in pending.items():
+        ssm_client.cancel_command(CommandId=command_id, InstanceIds=sorted(waiting))
+    return metrics
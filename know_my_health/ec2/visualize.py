@@ -1,24 +1,15 @@
-import matplotlib.pyplot as plt
+from ..charts import render_in_background
 
-def visualize_instance_metrics(instances):
-    """Visualize instance metrics using Matplotlib."""
-    instance_ids = [instance['InstanceId'] for instance in instances]
-    cpu_usages = [instance['CPUUtilization'] if instance['CPUUtilization'] != 'N/A' else 0 for instance in instances]
-    ram_usages = [instance['RAMUsage'] if instance['RAMUsage'] != 'N/A' else 0 for instance in instances]
 
-    fig, ax = plt.subplots()
+def _instance_series(instances):
+    labels = [instance['InstanceId'] for instance in instances]
+    return labels, {
+        'CPU Usage (%)': [instance['CPUUtilization'] for instance in instances],
+        'RAM Usage (%)': [instance['RAMUsage'] for instance in instances],
+    }
 
-    bar_width = 0.35
-    index = range(len(instances))
 
-    bar1 = plt.bar(index, cpu_usages, bar_width, label='CPU Usage (%)')
-    bar2 = plt.bar([i + bar_width for i in index], ram_usages, bar_width, label='RAM Usage (%)')
-
-    plt.xlabel('Instance ID')
-    plt.ylabel('Usage (%)')
-    plt.title('CPU and RAM Usage by Instance')
-    plt.xticks([i + bar_width / 2 for i in index], instance_ids, rotation=45)
-    plt.legend()
-
-    plt.tight_layout()
-    plt.show()
+def visualize_instance_metrics(instances, chart_format='png'):
+    """Render CPU and RAM usage by instance to a chart file in the background; returns a Future of its path."""
+    return render_in_background('ec2-instances', 'CPU and RAM Usage by Instance', instances, _instance_series,
+                                chart_format)
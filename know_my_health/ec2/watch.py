@@ -0,0 +1,143 @@
+import math
+import queue
+import socket
+import threading
+import time
+import paramiko
+from array import array
+from .collector import WATCH_DELIMITER, watch_script, parse_collector_output
+
+# Samples kept per host and metric; older samples are overwritten
+WATCH_CAPACITY = 120
+# Seconds to wait before reopening a host's stream after it failed
+RECONNECT_DELAY = 5
+
+WATCH_METRICS = ('CPUUtilization', 'IOWait', 'RAMUsage')
+
+
+class RingBuffer:
+    """A fixed-capacity series of floats in one preallocated array; the newest sample replaces the oldest."""
+
+    def __init__(self, capacity=WATCH_CAPACITY):
+        self._values = array('d', bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        self._values[self._next] = value
+        self._next = (self._next + 1) % len(self._values)
+        self._count = min(self._count + 1, len(self._values))
+
+    def summary(self):
+        """Return (min, avg, p95, max) of the buffered samples, or None if there are none."""
+        if not self._count:
+            return None
+        # Slots beyond the count were never written; order does not matter for these statistics
+        values = sorted(self._values[:self._count])
+        return (values[0], sum(values) / len(values), values[math.ceil(0.95 * len(values)) - 1], values[-1])
+
+
+class HostWatch:
+    """Rolling metrics of one host, fed by a single long-lived collector stream."""
+
+    def __init__(self, instance, capacity=WATCH_CAPACITY):
+        self.instance = instance
+        self.series = {metric: RingBuffer(capacity) for metric in WATCH_METRICS}
+        self.ebs_volumes = []
+        self.status = 'Queued'
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    def record(self, output):
+        cpu_usage, iowait, ram_usage, ebs_volumes = parse_collector_output(output)
+        with self.lock:
+            for metric, value in zip(WATCH_METRICS, (cpu_usage, iowait, ram_usage)):
+                if value is not None:
+                    self.series[metric].append(value)
+            self.ebs_volumes = ebs_volumes
+            self.samples += 1
+            self.status = 'OK'
+
+    def summaries(self):
+        with self.lock:
+            return {metric: series.summary() for metric, series in self.series.items()}
+
+
+def _stream_host(watch, bastion_pool, key_path, interval, host_timeout, stopped, target_username='ec2-user'):
+    """Run one collector exec on the host, recording each sample, until the stream ends or `stopped` is set."""
+    script = watch_script(interval)
+    ssh = None
+    try:
+        watch.status = 'Connecting'
+        ssh = bastion_pool.connect_target(watch.instance.get('PrivateIpAddress', 'N/A'), target_username,
+                                          key_path, timeout=host_timeout)
+        channel = ssh.get_transport().open_session(timeout=host_timeout)
+        # A sample is due every interval; silence well past that means the host is stuck
+        channel.settimeout(interval + host_timeout)
+        channel.exec_command(script)
+        lines = []
+        for line in channel.makefile('rb'):
+            if stopped.is_set():
+                return
+            line = line.decode(errors='replace').rstrip('\n')
+            if line == WATCH_DELIMITER:
+                watch.record("\n".join(lines))
+                lines = []
+            else:
+                lines.append(line)
+        watch.status = 'Disconnected'
+    except socket.timeout:
+        watch.status = 'Timeout'
+    except (paramiko.SSHException, OSError, EOFError) as e:
+        # The table cell says which failure it was, e.g. AuthenticationException
+        watch.status = type(e).__name__
+    finally:
+        if ssh:
+            ssh.close()
+
+
+def _stream_hosts(hosts, bastion_pool, key_path, interval, host_timeout, stopped):
+    """Stream queued hosts one at a time; a host whose stream ends goes to the back of the queue."""
+    while not stopped.is_set():
+        try:
+            watch, retry_at = hosts.get(timeout=1)
+        except queue.Empty:
+            continue
+        if stopped.wait(max(0, retry_at - time.monotonic())):
+            return
+        _stream_host(watch, bastion_pool, key_path, interval, host_timeout, stopped)
+        hosts.put((watch, time.monotonic() + RECONNECT_DELAY))
+
+
+def watch_fleet(instances, bastion_pool, key_path, interval, host_timeout, render, stopped=None,
+                capacity=WATCH_CAPACITY, concurrency=50):
+    """Stream metrics from every instance and call `render(watches)` each interval until interrupted.
+
+    Each host gets one channel running a looping collector, so a sample costs no new
+    connection, and memory per host stays at `capacity` samples per metric however long
+    the watch runs. At most `concurrency` hosts stream at once; the rest wait as Queued
+    and take the slot of any stream that ends, which reconnects after RECONNECT_DELAY.
+    """
+    stopped = stopped or threading.Event()
+    watches = [HostWatch(instance, capacity) for instance in instances]
+    hosts = queue.Queue()
+    for watch in watches:
+        hosts.put((watch, 0))
+    threads = [threading.Thread(target=_stream_hosts,
+                                args=(hosts, bastion_pool, key_path, interval, host_timeout, stopped),
+                                daemon=True)
+               for _ in range(min(concurrency, len(watches)))]
+    for thread in threads:
+        thread.start()
+    try:
+        while not stopped.is_set():
+            render(watches)
+            stopped.wait(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+    return watches
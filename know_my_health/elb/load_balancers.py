@@ -1,126 +1,258 @@
-import click
-from tabulate import tabulate
-from ..config import get_boto3_client
-import datetime
+from ..config import get_boto3_client, get_config
+from ..output import open_writer
+from ..charts import echo_chart
+from ..fanout import resolve_targets, fan_out, target_columns, echo_failures, TARGET_HEADERS
+from ..concurrency import parallel_map
+from ..cache import cache_get_many, cache_put_many, cached_inventory
+from ..cloudwatch import aligned_window, metric_query, get_metric_data
+from ..snapshots import Snapshot, save_snapshot
 from .visualize import visualize_load_balancers
 
+# Bounded pool for the per-load-balancer and per-target-group enrichment calls
+ENRICHMENT_WORKERS = 16
 
-def fetch_classic_elbs(profile="default"):
-    """Fetch classic ELBs and list their details."""
-    elb_client = get_boto3_client('elb', profile)
-
-    response = elb_client.describe_load_balancers()
-
-    load_balancers = []
-    for elb in response['LoadBalancerDescriptions']:
-        elb_name = elb['LoadBalancerName']
-        dns_name = elb['DNSName']
-        scheme = elb['Scheme']
-        created_time = elb['CreatedTime']
-        instances = ', '.join([instance['InstanceId'] for instance in elb['Instances']])
-        listeners = ', '.join(
-            [f"{listener['Listener']['Protocol']}:{listener['Listener']['LoadBalancerPort']}" for listener in
-             elb['ListenerDescriptions']])
-
-        load_balancers.append({
-            'Name': elb_name,
-            'DNSName': dns_name,
-            'Scheme': scheme,
-            'CreatedTime': created_time,
-            'Instances': instances,
-            'Listeners': listeners,
-            'Type': 'Classic ELB'
-        })
-    return load_balancers
-
-
-def fetch_target_group_metrics(elbv2_client, target_group_arn):
-    """Fetch target group metrics such as health and request count."""
-    # Get target health
+# Request metrics cover the last closed hour, aligned to 5 minutes
+METRICS_WINDOW = 3600
+TARGET_GROUP_METRICS = [
+    ('RequestCount', 'RequestCount', 'Sum'),
+    ('SuccessCount', 'HTTPCode_Target_2XX_Count', 'Sum'),
+    ('LatencyP50', 'TargetResponseTime', 'p50'),
+    ('LatencyP90', 'TargetResponseTime', 'p90'),
+    ('LatencyP99', 'TargetResponseTime', 'p99'),
+]
+
+
+def fetch_classic_elbs(profile="default", region=None):
+    """Fetch classic ELBs page by page, yielding their details as they arrive."""
+    elb_client = get_boto3_client('elb', profile, region)
+
+    paginator = elb_client.get_paginator('describe_load_balancers')
+    for page in paginator.paginate():
+        for elb in page['LoadBalancerDescriptions']:
+            elb_name = elb['LoadBalancerName']
+            dns_name = elb['DNSName']
+            scheme = elb['Scheme']
+            created_time = elb['CreatedTime']
+            instances = ', '.join([instance['InstanceId'] for instance in elb['Instances']])
+            listeners = ', '.join(
+                [f"{listener['Listener']['Protocol']}:{listener['Listener']['LoadBalancerPort']}" for listener in
+                 elb['ListenerDescriptions']])
+
+            yield {
+                'Name': elb_name,
+                'DNSName': dns_name,
+                'Scheme': scheme,
+                'CreatedTime': created_time,
+                'Instances': instances,
+                'Listeners': listeners,
+                'Type': 'Classic ELB'
+            }
+
+
+def fetch_target_health(elbv2_client, target_group_arn):
+    """Fetch the healthy and unhealthy target counts of a target group, and each target's ID and state."""
     health_response = elbv2_client.describe_target_health(TargetGroupArn=target_group_arn)
     healthy_count = sum(
         1 for target in health_response['TargetHealthDescriptions'] if target['TargetHealth']['State'] == 'healthy')
     unhealthy_count = sum(
         1 for target in health_response['TargetHealthDescriptions'] if target['TargetHealth']['State'] != 'healthy')
+    targets = [{'Id': target['Target']['Id'], 'State': target['TargetHealth']['State']}
+               for target in health_response['TargetHealthDescriptions']]
+
+    return healthy_count, unhealthy_count, targets
+
+
+def _arn_resource(arn):
+    # CloudWatch dimensions use the ARN resource part, e.g. "targetgroup/web/6d0ecf831eec9f09"
+    return arn.rsplit(':', 1)[-1]
+
+
+def fetch_target_group_metrics(cloudwatch_client, pairs):
+    """Fetch request, 2XX and latency metrics for (load balancer ARN, target group ARN) pairs.
+
+    All pairs are packed into as few GetMetricData calls as possible. Results are cached
+    per aligned metrics window, so reruns within the same window cost no API calls.
+    Returns {(lb_arn, tg_arn): metrics}; only application load balancers report these metrics.
+    """
+    start_time, end_time = aligned_window(METRICS_WINDOW)
+    window_key = "{}/{}".format(start_time.isoformat(), METRICS_WINDOW)
+    keys = {pair: "{}|{}|{}".format(pair[0], pair[1], window_key) for pair in pairs}
+    cached = cache_get_many('elbv2-target-group-metrics', keys.values())
+
+    queries = []
+    query_ids = {}
+    for pair, key in keys.items():
+        lb_dimension = _arn_resource(pair[0]).split('loadbalancer/', 1)[-1]
+        tg_dimension = _arn_resource(pair[1])
+        if key in cached or not lb_dimension.startswith('app/'):
+            continue
+        dimensions = {'TargetGroup': tg_dimension, 'LoadBalancer': lb_dimension}
+        for field, metric_name, stat in TARGET_GROUP_METRICS:
+            query_id = 'm{}'.format(len(queries))
+            query_ids[query_id] = (pair, field)
+            queries.append(metric_query(query_id, 'AWS/ApplicationELB', metric_name, dimensions, stat,
+                                        METRICS_WINDOW))
+
+    fetched = {}
+    if queries:
+        for query_id, values in get_metric_data(cloudwatch_client, queries, start_time, end_time).items():
+            pair, field = query_ids[query_id]
+            metrics = fetched.setdefault(pair, {})
+            # Sums add up across datapoints; percentiles come back as a single window-wide datapoint
+            metrics[field] = sum(values) if field in ('RequestCount', 'SuccessCount') else (
+                max(values) if values else None)
+        cache_put_many('elbv2-target-group-metrics', {keys[pair]: metrics for pair, metrics in fetched.items()},
+                       ttl=METRICS_WINDOW)
+
+    results = {}
+    for pair, key in keys.items():
+        results[pair] = fetched.get(pair) or cached.get(key) or {}
+    return results
+
+
+def _paginate(client, operation, result_key, **kwargs):
+    """Yield every item under `result_key` across all pages of a list/describe call."""
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        yield from page[result_key]
+
+
+def fetch_v2_elbs(profile="default", region=None, max_workers=ENRICHMENT_WORKERS):
+    """Fetch ALBs/NLBs page by page, enriching each page concurrently and yielding their details."""
+    elbv2_client = get_boto3_client('elbv2', profile, region)
+    cloudwatch_client = get_boto3_client('cloudwatch', profile, region)
+
+    # One account-wide pass instead of a describe_target_groups call per load balancer
+    target_groups_by_lb = {}
+    for tg in _paginate(elbv2_client, 'describe_target_groups', 'TargetGroups'):
+        for lb_arn in tg.get('LoadBalancerArns', []):
+            target_groups_by_lb.setdefault(lb_arn, []).append(tg)
+
+    def fetch_listeners(lb_arn):
+        return list(_paginate(elbv2_client, 'describe_listeners', 'Listeners', LoadBalancerArn=lb_arn))
+
+    def fetch_health(tg_arn):
+        return fetch_target_health(elbv2_client, tg_arn)
 
-    # Assume that request count and success count metrics are collected via CloudWatch (simplified example)
-    # Note: Replace with actual CloudWatch metric fetching code if needed.
-    request_count = 0
-    success_count = 0
-
-    return healthy_count, unhealthy_count, request_count, success_count
-
-
-def fetch_v2_elbs(profile="default"):
-    """Fetch ALBs/NLBs and list their details."""
-    elbv2_client = get_boto3_client('elbv2', profile)
-
-    response = elbv2_client.describe_load_balancers()
-
-    load_balancers = []
-    for elb in response['LoadBalancers']:
-        elb_name = elb['LoadBalancerName']
-        dns_name = elb['DNSName']
-        scheme = elb['Scheme']
-        created_time = elb['CreatedTime']
-        elb_type = elb['Type']
-        state = elb['State']['Code']
-        listeners = ', '.join([f"{listener['Protocol']}:{listener['Port']}" for listener in
-                               elbv2_client.describe_listeners(LoadBalancerArn=elb['LoadBalancerArn'])['Listeners']])
-
-        # Fetch target groups associated with the load balancer
-        target_groups = elbv2_client.describe_target_groups(LoadBalancerArn=elb['LoadBalancerArn'])['TargetGroups']
-        target_group_details = []
-        for tg in target_groups:
-            tg_name = tg['TargetGroupName']
-            tg_arn = tg['TargetGroupArn']
-            healthy_count, unhealthy_count, request_count, success_count = fetch_target_group_metrics(elbv2_client,
-                                                                                                      tg_arn)
-            target_group_details.append({
-                'TargetGroupName': tg_name,
-                'HealthyCount': healthy_count,
-                'UnhealthyCount': unhealthy_count,
-                'RequestCount': request_count,
-                'SuccessCount': success_count
-            })
-
-        load_balancers.append({
-            'Name': elb_name,
-            'DNSName': dns_name,
-            'Scheme': scheme,
-            'CreatedTime': created_time,
-            'State': state,
-            'Listeners': listeners,
-            'Type': elb_type,
-            'TargetGroups': target_group_details
-        })
-    return load_balancers
-
-
-def fetch_elb_instances(profile="default"):
-    """Fetch both classic and v2 ELB instances and list their details."""
-    classic_elbs = fetch_classic_elbs(profile)
-    v2_elbs = fetch_v2_elbs(profile)
-    return classic_elbs + v2_elbs
-
-
-def list_elb_instances(profile="default", visualize=False):
-    """List ELB instances with details."""
-    load_balancers = fetch_elb_instances(profile)
-
-    table = []
-    for lb in load_balancers:
+    for page in elbv2_client.get_paginator('describe_load_balancers').paginate():
+        elbs = page['LoadBalancers']
+        lb_arns = [elb['LoadBalancerArn'] for elb in elbs]
+        # A target group can sit behind several load balancers; look each one up once
+        tg_arns = list({tg['TargetGroupArn']: None for lb_arn in lb_arns
+                        for tg in target_groups_by_lb.get(lb_arn, [])})
+
+        listeners_by_lb = dict(zip(lb_arns, parallel_map(fetch_listeners, lb_arns, max_workers)))
+        health_by_tg = dict(zip(tg_arns, parallel_map(fetch_health, tg_arns, max_workers)))
+        metrics_by_pair = fetch_target_group_metrics(
+            cloudwatch_client, [(lb_arn, tg['TargetGroupArn']) for lb_arn in lb_arns
+                                for tg in target_groups_by_lb.get(lb_arn, [])])
+
+        for elb in elbs:
+            elb_name = elb['LoadBalancerName']
+            dns_name = elb['DNSName']
+            scheme = elb['Scheme']
+            created_time = elb['CreatedTime']
+            elb_type = elb['Type']
+            state = elb['State']['Code']
+            listeners = ', '.join([f"{listener['Protocol']}:{listener['Port']}" for listener in
+                                   listeners_by_lb[elb['LoadBalancerArn']]])
+
+            target_group_details = []
+            for tg in target_groups_by_lb.get(elb['LoadBalancerArn'], []):
+                healthy_count, unhealthy_count, targets = health_by_tg[tg['TargetGroupArn']]
+                metrics = metrics_by_pair[(elb['LoadBalancerArn'], tg['TargetGroupArn'])]
+                target_group_details.append({
+                    'TargetGroupName': tg['TargetGroupName'],
+                    'HealthyCount': healthy_count,
+                    'UnhealthyCount': unhealthy_count,
+                    'RequestCount': metrics.get('RequestCount', 'N/A'),
+                    'SuccessCount': metrics.get('SuccessCount', 'N/A'),
+                    'LatencyP50': metrics.get('LatencyP50'),
+                    'LatencyP90': metrics.get('LatencyP90'),
+                    'LatencyP99': metrics.get('LatencyP99'),
+                    'Targets': targets
+                })
+
+            yield {
+                'Name': elb_name,
+                'DNSName': dns_name,
+                'Scheme': scheme,
+                'CreatedTime': created_time,
+                'State': state,
+                'Listeners': listeners,
+                'Type': elb_type,
+                'TargetGroups': target_group_details
+            }
+
+
+def fetch_elb_instances(profile="default", region=None):
+    """Fetch both classic and v2 ELB instances from the inventory cache or AWS, yielding their details."""
+    def fetch():
+        yield from fetch_classic_elbs(profile, region)
+        yield from fetch_v2_elbs(profile, region)
+
+    return cached_inventory('elb-instances', [profile, region or get_config(profile)['aws_region']], fetch)
+
+
+def _format_count(value):
+    return int(value) if isinstance(value, float) else value
+
+
+def _format_latency(tg):
+    latencies = [tg.get(field) for field in ('LatencyP50', 'LatencyP90', 'LatencyP99')]
+    if all(latency is None for latency in latencies):
+        return ""
+    return ", p50/p90/p99: {} ms".format("/".join(
+        "{:.0f}".format(latency * 1000) if latency is not None else "N/A" for latency in latencies))
+
+
+def _snapshot_fields(lb):
+    target_groups = lb.get('TargetGroups', [])
+    requests = [tg['RequestCount'] for tg in target_groups if isinstance(tg['RequestCount'], (int, float))]
+    return {
+        'Name': lb['Name'], 'DNSName': lb['DNSName'], 'Type': lb['Type'], 'State': lb.get('State'),
+        'Listeners': lb['Listeners'], 'TargetGroups': len(target_groups),
+        'HealthyTargets': sum(tg['HealthyCount'] for tg in target_groups),
+        'UnhealthyTargets': sum(tg['UnhealthyCount'] for tg in target_groups),
+        'Requests': sum(requests) if requests else None,
+        # Classic ELBs register instances directly
+        'Instances': len([instance for instance in lb.get('Instances', '').split(', ') if instance]),
+    }
+
+
+def list_elb_instances(profile="default", visualize=False, regions=None, profiles=None, output='grid', columns=None,
+                       chart_format='png', snapshot=False):
+    """List ELB instances with details, and with `snapshot` append them to the snapshot history."""
+    load_balancers = [] if visualize else None
+    history = Snapshot('load-balancers') if snapshot else None
+    targets = resolve_targets(profiles or [profile], regions)
+    multi_target = len(targets) > 1
+    failures = []
+
+    headers = ["S.No", "Name", "DNS Name", "Scheme", "Created Time", "Type", "State", "Listeners", "Target Groups"]
+    if multi_target:
+        headers += TARGET_HEADERS
+    writer = open_writer(output, headers, columns)
+
+    for row_number, (target, lb) in enumerate(fan_out(fetch_elb_instances, targets, failures), 1):
         target_groups_info = "\n".join([
-            f"TG: {tg['TargetGroupName']}, Healthy: {tg['HealthyCount']}, Unhealthy: {tg['UnhealthyCount']}, Requests: {tg['RequestCount']}, Successes: {tg['SuccessCount']}"
+            f"TG: {tg['TargetGroupName']}, Healthy: {tg['HealthyCount']}, Unhealthy: {tg['UnhealthyCount']}, Requests: {_format_count(tg['RequestCount'])}, Successes: {_format_count(tg['SuccessCount'])}{_format_latency(tg)}"
             for tg in lb.get('TargetGroups', [])
         ])
-        table.append([
-            len(table) + 1, lb['Name'], lb['DNSName'], lb['Scheme'], lb['CreatedTime'],
+        writer.write([
+            row_number, lb['Name'], lb['DNSName'], lb['Scheme'], lb['CreatedTime'],
             lb['Type'], lb.get('State', 'N/A'), lb['Listeners'], target_groups_info
-        ])
-
-    headers = ["S.No", "Name", "DNS Name", "Scheme", "Created Time", "Type", "State", "Listeners", "Target Groups"]
-    click.echo(tabulate(table, headers, tablefmt="grid"))
+        ] + (target_columns(target) if multi_target else []))
+        if visualize:
+            load_balancers.append(lb)
+        if snapshot:
+            # Names are only unique per account and region
+            history.add("{}/{}/{}".format(target[0], target[1] or get_config(target[0])['aws_region'], lb['Name']),
+                        **_snapshot_fields(lb))
 
-    if visualize:
-        visualize_load_balancers(load_balancers)
+    # The chart renders in the background while the table is printed
+    chart = visualize_load_balancers(load_balancers, chart_format) if visualize else None
+    writer.close()
+    echo_failures(failures)
+    save_snapshot(history, err=output != 'grid')
+    if chart:
+        echo_chart(chart, err=output != 'grid')
@@ -1,19 +1,19 @@
-import matplotlib.pyplot as plt
+from ..charts import render_in_background
 
 
-def visualize_load_balancers(load_balancers):
-    """Visualize ELB instances using Matplotlib."""
-    names = [lb['Name'] for lb in load_balancers]
-    instances_count = [len(lb['Instances'].split(', ')) for lb in load_balancers]
+def _instance_count(lb):
+    if 'TargetGroups' in lb:
+        return sum(tg['HealthyCount'] + tg['UnhealthyCount'] for tg in lb['TargetGroups'])
+    # Classic ELBs list their instances as one comma-separated string
+    return len([instance for instance in lb.get('Instances', '').split(', ') if instance])
 
-    fig, ax = plt.subplots()
 
-    ax.bar(names, instances_count, color='blue')
+def _load_balancer_series(load_balancers):
+    labels = [lb['Name'] for lb in load_balancers]
+    return labels, {'Registered Instances': [_instance_count(lb) for lb in load_balancers]}
 
-    plt.xlabel('Load Balancer Name')
-    plt.ylabel('Number of Instances')
-    plt.title('Instances behind each Load Balancer')
-    plt.xticks(rotation=45)
 
-    plt.tight_layout()
-    plt.show()
+def visualize_load_balancers(load_balancers, chart_format='png'):
+    """Render the instances behind each load balancer to a chart file in the background; returns a Future of its path."""
+    return render_in_background('elb-instances', 'Instances behind each Load Balancer', load_balancers,
+                                _load_balancer_series, chart_format)
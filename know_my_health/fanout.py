@@ -0,0 +1,119 @@
+import queue
+import threading
+import click
+from concurrent.futures import ThreadPoolExecutor
+from .config import get_boto3_client, get_config, list_profiles
+
+# Profile/region pairs fetched at once; each fetcher adds its own bounded pool on top
+FAN_OUT_WORKERS = 16
+TARGET_HEADERS = ["Account", "Region"]
+
+_DONE = object()
+_accounts = {}
+_accounts_lock = threading.Lock()
+
+
+def parse_list_option(value):
+    """Split a comma-separated option value, e.g. "us-east-1,eu-west-1", into a list."""
+    if not value:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def resolve_targets(profiles, regions=None, regional=True):
+    """Expand profile and region selections (either may be ["all"]) into (profile, region) targets.
+
+    A region of None means the profile's configured region. Global services pass
+    `regional=False` and get one target per profile.
+    """
+    if profiles == ['all']:
+        profiles = list_profiles()
+    if not regional or not regions:
+        return [(profile, None) for profile in profiles]
+
+    targets = []
+    for profile in profiles:
+        if regions == ['all']:
+            ec2_client = get_boto3_client('ec2', profile)
+            # Only regions enabled for the account; opted-out regions would just fail auth
+            profile_regions = sorted(region['RegionName'] for region in ec2_client.describe_regions()['Regions'])
+        else:
+            profile_regions = regions
+        targets.extend((profile, region) for region in profile_regions)
+    return targets
+
+
+def account_label(profile):
+    """Return the AWS account ID behind a profile, falling back to the profile name."""
+    with _accounts_lock:
+        if profile in _accounts:
+            return _accounts[profile]
+    try:
+        account = get_boto3_client('sts', profile).get_caller_identity()['Account']
+    except Exception:
+        account = profile
+    with _accounts_lock:
+        _accounts[profile] = account
+    return account
+
+
+def target_columns(target):
+    """Return the Account and Region table cells for a (profile, region) target."""
+    profile, region = target
+    return [account_label(profile), region or get_config(profile)["aws_region"]]
+
+
+def fan_out(fetch, targets, failures, max_workers=FAN_OUT_WORKERS):
+    """Run `fetch(profile, region)` for every target concurrently, yielding (target, record) as records arrive.
+
+    A failing target is appended to `failures` as (target, error) instead of aborting
+    the others. A single target runs inline so errors surface exactly as before.
+    """
+    if len(targets) == 1:
+        for record in fetch(*targets[0]):
+            yield targets[0], record
+        return
+
+    # Bounded so a slow consumer applies back-pressure instead of buffering whole inventories
+    records = queue.Queue(maxsize=1000)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                records.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def run(target):
+        try:
+            for record in fetch(*target):
+                if stopped.is_set():
+                    return
+                put((target, record))
+        except Exception as e:
+            failures.append((target, e))
+        finally:
+            put((target, _DONE))
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(targets)))
+    try:
+        for target in targets:
+            executor.submit(run, target)
+        remaining = len(targets)
+        while remaining:
+            target, record = records.get()
+            if record is _DONE:
+                remaining -= 1
+                continue
+            yield target, record
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False)
+
+
+def echo_failures(failures):
+    """Print a per-target summary of fetches that failed during a fan-out."""
+    for (profile, region), error in failures:
+        click.echo("Failed: {}{}: {}".format(profile, "/" + region if region else "", error), err=True)
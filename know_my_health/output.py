@@ -0,0 +1,178 @@
+import csv
+import json
+import re
+import sys
+from abc import ABC, abstractmethod
+import click
+
+# Rows buffered per Parquet row group; the other machine formats write every row immediately
+PARQUET_BATCH = 1000
+# Cell values that mean "no value" rather than text
+PLACEHOLDERS = ('', 'N/A', 'Timeout')
+
+
+def numeric(values):
+    """Return a float array of `values`, with placeholders such as 'N/A' or 'Timeout' as NaN."""
+    import numpy as np
+    return np.array([value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+                     for value in values], dtype=float)
+
+
+def _without_placeholders(values):
+    # Machine formats get a null (an empty CSV cell) where the grid shows 'N/A' or 'Timeout'
+    return [None if isinstance(value, str) and value in PLACEHOLDERS else value for value in values]
+
+
+def _normalise(column):
+    return re.sub(r'[^a-z0-9]', '', column.lower())
+
+
+class RowWriter(ABC):
+    """Write table rows, given as lists aligned with `headers`, keeping only the selected `columns`.
+
+    Columns are matched by header ignoring case, spaces and punctuation, so
+    "private_ip" selects "Private IP".
+    """
+
+    def __init__(self, headers, columns=None):
+        if columns:
+            by_name = {_normalise(header): index for index, header in enumerate(headers)}
+            unknown = [column for column in columns if _normalise(column) not in by_name]
+            if unknown:
+                raise click.BadParameter("unknown column(s) {}; choose from: {}".format(
+                    ", ".join(unknown), ", ".join(headers)), param_hint="'--columns'")
+            self.indexes = [by_name[_normalise(column)] for column in columns]
+        else:
+            self.indexes = list(range(len(headers)))
+        self.headers = [headers[index] for index in self.indexes]
+
+    def project(self, row):
+        return [row[index] for index in self.indexes]
+
+    @abstractmethod
+    def write(self, row):
+        """Write one row, in `headers` order."""
+
+    def close(self):
+        pass
+
+
+class GridWriter(RowWriter):
+    """The human-readable grid; it needs every row before it can size the columns."""
+
+    def __init__(self, headers, columns=None, sort_key=None, renumber=False):
+        super().__init__(headers, columns)
+        self.rows = []
+        self.sort_key = sort_key
+        self.renumber = renumber
+
+    def write(self, row):
+        self.rows.append(row)
+
+    def close(self):
+        from tabulate import tabulate
+        if self.sort_key:
+            self.rows.sort(key=self.sort_key)
+        if self.renumber:
+            for index, row in enumerate(self.rows, 1):
+                row[0] = index
+        click.echo(tabulate([self.project(row) for row in self.rows], self.headers, tablefmt="grid"))
+
+
+class JsonlWriter(RowWriter):
+    """One JSON object per row, written as soon as the row is produced; placeholders become null."""
+
+    def write(self, row):
+        click.echo(json.dumps(dict(zip(self.headers, _without_placeholders(self.project(row)))), default=str))
+
+
+class CsvWriter(RowWriter):
+    """RFC 4180 CSV with a header line, written as rows are produced; placeholders become empty cells."""
+
+    def __init__(self, headers, columns=None):
+        super().__init__(headers, columns)
+        self.writer = csv.writer(click.get_text_stream('stdout'))
+        self.writer.writerow(self.headers)
+
+    def write(self, row):
+        self.writer.writerow(_without_placeholders(self.project(row)))
+
+
+class ParquetWriter(RowWriter):
+    """Parquet to stdout in row groups, with column types taken from the first batch."""
+
+    def __init__(self, headers, columns=None):
+        super().__init__(headers, columns)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise click.ClickException("Parquet output requires pyarrow: pip install pyarrow")
+        if sys.stdout.isatty():
+            raise click.ClickException("Parquet is binary; redirect the output to a file")
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.batch = []
+        self.schema = None
+        self.writer = None
+
+    def _column_type(self, values):
+        present = [value for value in values if value is not None and value not in PLACEHOLDERS]
+        if present and all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+            return self.pyarrow.int64()
+        if present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+            return self.pyarrow.float64()
+        return self.pyarrow.string()
+
+    def _coerce(self, value, column_type):
+        # Placeholders such as 'N/A' or 'Timeout' become nulls in numeric columns
+        if value is None or value == '':
+            return None
+        if column_type == self.pyarrow.string():
+            return str(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value if column_type == self.pyarrow.float64() else int(value)
+        return None
+
+    def _flush(self):
+        if not self.batch:
+            return
+        columns = list(zip(*self.batch))
+        if self.schema is None:
+            self.schema = self.pyarrow.schema([(header, self._column_type(values))
+                                               for header, values in zip(self.headers, columns)])
+            self.writer = self.parquet.ParquetWriter(sys.stdout.buffer, self.schema)
+        arrays = [self.pyarrow.array([self._coerce(value, field.type) for value in values], type=field.type)
+                  for field, values in zip(self.schema, columns)]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append(self.project(row))
+        if len(self.batch) >= PARQUET_BATCH:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self.writer is None:
+            # No rows at all: still produce a valid file with every column as text
+            self.schema = self.pyarrow.schema([(header, self.pyarrow.string()) for header in self.headers])
+            self.writer = self.parquet.ParquetWriter(sys.stdout.buffer, self.schema)
+        self.writer.close()
+
+
+def open_writer(output, headers, columns=None, sort_key=None, renumber=False):
+    """Return the writer for an --output format.
+
+    `sort_key` and `renumber` only shape the grid; streaming formats emit rows in
+    the order they arrive so nothing has to be held in memory.
+    """
+    if output == 'grid':
+        return GridWriter(headers, columns, sort_key, renumber)
+    if output == 'jsonl':
+        return JsonlWriter(headers, columns)
+    if output == 'csv':
+        return CsvWriter(headers, columns)
+    if output == 'parquet':
+        return ParquetWriter(headers, columns)
+    raise click.BadParameter("unknown output format '{}'".format(output), param_hint="'--output'")
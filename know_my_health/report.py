@@ -0,0 +1,138 @@
+import click
+from concurrent.futures import ThreadPoolExecutor
+from .output import open_writer
+from .fanout import resolve_targets, fan_out, target_columns, echo_failures, TARGET_HEADERS
+from .ec2.instances import fetch_ec2_instances, metrics_collector, apply_scan_result, echo_scan_problems
+from .ebs.volumes import fetch_ebs_volumes
+from .elb.load_balancers import fetch_elb_instances
+from .rules import metric_arrays, evaluate, violators_first, severity_name, echo_violation_summary
+
+
+def index_volumes(volumes):
+    """Return {instance_id: [(volume, attachment)]} for every attached volume."""
+    index = {}
+    for volume in volumes:
+        for attachment in volume.get('AttachedInstances', []):
+            index.setdefault(attachment['InstanceId'], []).append((volume, attachment))
+    return index
+
+
+def index_load_balancers(load_balancers):
+    """Return {instance_id: [(load balancer, target group or None, state)]} for every registered target."""
+    index = {}
+    for lb in load_balancers:
+        for tg in lb.get('TargetGroups', []):
+            for target in tg.get('Targets', []):
+                index.setdefault(target['Id'], []).append((lb['Name'], tg['TargetGroupName'], target['State']))
+        # Classic ELBs register instances directly, without per-target health
+        for instance_id in lb.get('Instances', '').split(', '):
+            if instance_id:
+                index.setdefault(instance_id, []).append((lb['Name'], None, 'registered'))
+    return index
+
+
+def _format_volume(volume, attachment):
+    state = "" if attachment['State'] == 'attached' else " ({})".format(attachment['State'])
+    return "{} {}: {} GiB {}{}".format(volume['VolumeId'], attachment['Device'], volume['Size'],
+                                       volume['VolumeType'], state)
+
+
+def _format_membership(lb_name, tg_name, state):
+    return "{}/{}: {}".format(lb_name, tg_name, state) if tg_name else "{}: {}".format(lb_name, state)
+
+
+def _format_metric(value, fmt):
+    return fmt.format(value) if isinstance(value, float) else value
+
+
+def report_instances(profile="default", tags=None, instance_type=None, filters=None, regions=None, profiles=None,
+                     bastion_ip=None, key_path=None, bastion_username='ec2-user', bastion_connections=1,
+                     concurrency=50, host_timeout=15, output='grid', columns=None, rules=None):
+    """Print one row per instance joined with its volumes, load balancer targets and, with a bastion, SSH metrics.
+
+    EC2, EBS and ELB are each fetched once per target and concurrently; instances are
+    scanned over SSH while the other inventories are still loading, and everything is
+    joined through instance-ID indexes. With `rules`, only instances that break one
+    (unhealthy targets included) are listed, worst first.
+    """
+    targets = resolve_targets(profiles or [profile], regions)
+    multi_target = len(targets) > 1
+    human = output == 'grid'
+    failures = []
+
+    def tagged_instances():
+        for target, instance in fan_out(lambda p, r: fetch_ec2_instances(p, tags, instance_type, r, filters),
+                                        targets, failures):
+            if multi_target:
+                instance['Target'] = target_columns(target)
+            yield instance
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        volumes = executor.submit(lambda: [volume for _, volume in fan_out(
+            lambda p, r: fetch_ebs_volumes(p, None, r), targets, failures)])
+        load_balancers = executor.submit(lambda: [lb for _, lb in fan_out(fetch_elb_instances, targets, failures)])
+        if bastion_ip:
+            # paramiko is only loaded when hosts are sampled over SSH
+            from .ec2.bastion import BastionPool
+            from .ec2.scanner import scan_fleet
+            with BastionPool(bastion_ip, key_path, bastion_username, size=bastion_connections,
+                             timeout=host_timeout) as bastion_pool:
+                results = scan_fleet(tagged_instances(), metrics_collector(bastion_pool, key_path, host_timeout),
+                                     concurrency=concurrency, host_timeout=host_timeout)
+            for instance, status, result in results:
+                apply_scan_result(instance, status, result)
+            instances = [instance for instance, status, result in results]
+        else:
+            results = None
+            instances = list(tagged_instances())
+        volumes = volumes.result()
+        load_balancers = load_balancers.result()
+
+    volumes_by_instance = index_volumes(volumes)
+    targets_by_instance = index_load_balancers(load_balancers)
+
+    headers = ["S.No", "Instance ID", "Private IP", "Name", "Instance Type"]
+    if bastion_ip:
+        headers += ["CPU (%)", "IO Wait (%)", "RAM Usage (%)"]
+    headers += ["Volumes", "Load Balancers", "Unhealthy Targets"]
+    if rules is not None:
+        headers += ["Severity", "Violations"]
+    if multi_target:
+        headers += TARGET_HEADERS
+    writer = open_writer(output, headers, columns)
+
+    memberships = [targets_by_instance.get(instance['InstanceId'], []) for instance in instances]
+    unhealthy = [sum(state not in ('healthy', 'registered') for _, _, state in instance_memberships)
+                 for instance_memberships in memberships]
+    # Instances failing health checks first, then by name
+    order = sorted(range(len(instances)), key=lambda index: (-unhealthy[index], instances[index]['Name']))
+    if rules is not None:
+        severity, reasons = evaluate(metric_arrays(instances, unhealthy), rules)
+        order = violators_first(order, severity)
+
+    for row_number, index in enumerate(order, 1):
+        instance = instances[index]
+        row = [row_number, instance['InstanceId'], instance['PrivateIpAddress'], instance['Name'],
+               instance['InstanceType']]
+        if bastion_ip:
+            metrics = [instance['CPUUtilization'], instance['IOWait'], instance['RAMUsage']]
+            row += [_format_metric(metric, "{:.2f}") for metric in metrics] if human else metrics
+        row += ["\n".join(_format_volume(volume, attachment)
+                          for volume, attachment in volumes_by_instance.get(instance['InstanceId'], [])),
+                "\n".join(_format_membership(*membership) for membership in memberships[index]),
+                unhealthy[index]]
+        if rules is not None:
+            row += [severity_name(severity[index]), ("\n" if human else "; ").join(reasons[index])]
+        writer.write(row + instance.get('Target', []))
+    writer.close()
+
+    echo_failures(failures)
+    unattached = [volume for volume in volumes if not volume.get('AttachedInstances')]
+    if unattached:
+        click.echo("Unattached volumes: {} ({} GiB)".format(
+            len(unattached), sum(volume['Size'] for volume in unattached)), err=not human)
+    if results is not None:
+        click.echo("Bastion handshakes: {}".format(bastion_pool.handshakes), err=not human)
+        echo_scan_problems(results, err=not human)
+    if rules is not None:
+        echo_violation_summary(severity, err=not human)
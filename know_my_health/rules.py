@@ -0,0 +1,119 @@
+import re
+import click
+from .output import numeric
+from .fanout import parse_list_option
+
+# Metrics a rule can test, with the label used when reporting a violation
+RULE_METRICS = {
+    'cpu': 'CPU',
+    'iowait': 'IO wait',
+    'ram': 'RAM',
+    'disk': 'Disk',
+    'unhealthy': 'Unhealthy targets',
+}
+SEVERITIES = ('warning', 'critical')
+# Used unless --rule or the profile's `rules` setting says otherwise
+DEFAULT_RULES = "cpu>80, cpu>95:critical, iowait>20, ram>90, disk>85, disk>95:critical, unhealthy>0:critical"
+_RULE = re.compile(r'^(\w+)\s*>\s*(\d+(?:\.\d+)?)(?::(\w+))?$')
+
+
+def parse_rules(texts, param_hint="'--rule'"):
+    """Parse rules such as "cpu>90" or "disk>95:critical" into (metric, threshold, severity) tuples."""
+    rules = []
+    for text in texts:
+        match = _RULE.match(text.strip())
+        if not match or match.group(1) not in RULE_METRICS or (match.group(3) or 'warning') not in SEVERITIES:
+            raise click.BadParameter(
+                "'{}' is not METRIC>THRESHOLD[:SEVERITY] with METRIC one of {} and SEVERITY one of {}".format(
+                    text, ", ".join(RULE_METRICS), ", ".join(SEVERITIES)), param_hint=param_hint)
+        rules.append((match.group(1), float(match.group(2)), match.group(3) or 'warning'))
+    return rules
+
+
+def configured_rules(profile, rules=None):
+    """Return `rules` if given, else the profile's `rules` setting, else DEFAULT_RULES, parsed."""
+    from .config import get_setting
+    if rules:
+        return parse_rules(rules)
+    setting = get_setting(profile, 'rules')
+    if setting:
+        return parse_rules(parse_list_option(setting), param_hint="'rules' setting of profile '{}'".format(profile))
+    return parse_rules(parse_list_option(DEFAULT_RULES))
+
+
+def _fullest_mount(filesystems):
+    used = [int(filesystem['Use%'].rstrip('%')) for filesystem in filesystems or []
+            if filesystem['Use%'].rstrip('%').isdigit()]
+    return max(used) if used else None
+
+
+def metric_arrays(instances, unhealthy=None):
+    """Return {metric: float array aligned with `instances`}; unavailable values are NaN.
+
+    `unhealthy` is the unhealthy target count of each instance, when known.
+    """
+    arrays = {
+        'cpu': numeric([instance.get('CPUUtilization') for instance in instances]),
+        'iowait': numeric([instance.get('IOWait') for instance in instances]),
+        'ram': numeric([instance.get('RAMUsage') for instance in instances]),
+        'disk': numeric([_fullest_mount(instance.get('EBSVolumes')) for instance in instances]),
+    }
+    if unhealthy is not None:
+        arrays['unhealthy'] = numeric(unhealthy)
+    return arrays
+
+
+def evaluate(arrays, rules):
+    """Apply `rules` to every host at once.
+
+    Returns (severity, reasons): an int array with 0 for hosts that break no rule
+    and 1 + the SEVERITIES index of the worst rule broken otherwise, and
+    {host index: [reason]} for the violators only. Rules on metrics missing from
+    `arrays` are skipped.
+    """
+    import numpy as np
+    size = len(arrays['cpu'])
+    severity = np.zeros(size, dtype=np.int8)
+    matches = {}
+    # Ascending thresholds, so each metric reports the highest threshold it crossed
+    for metric, threshold, level in sorted(rules, key=lambda rule: rule[1]):
+        if metric not in arrays:
+            continue
+        # NaN compares false, so hosts without the metric never violate
+        crossed = np.flatnonzero(arrays[metric] > threshold)
+        np.maximum.at(severity, crossed, SEVERITIES.index(level) + 1)
+        for index in crossed:
+            matches.setdefault(int(index), {})[metric] = (threshold, level)
+
+    reasons = {}
+    for index, crossed in matches.items():
+        reasons[index] = ["{} {:g} > {:g} ({})".format(RULE_METRICS[metric], arrays[metric][index], threshold, level)
+                          for metric, (threshold, level) in crossed.items()]
+    return severity, reasons
+
+
+def highest_first(*keys):
+    """Return host indexes ordered by the first key array, then the next, highest first; NaN sorts last."""
+    import numpy as np
+    # lexsort sorts by its last key first, and is stable
+    return np.lexsort([-np.nan_to_num(key, nan=-1.0) for key in reversed(keys)])
+
+
+def violators_first(order, severity):
+    """Keep only the hosts of `order` that broke a rule, worst severity first and otherwise in `order`."""
+    import numpy as np
+    order = np.asarray(order, dtype=int)
+    order = order[severity[order] > 0]
+    return order[np.argsort(-severity[order], kind='stable')]
+
+
+def severity_name(level):
+    return SEVERITIES[level - 1]
+
+
+def echo_violation_summary(severity, err=False):
+    """Print how many hosts broke a rule at each severity."""
+    counts = [int((severity == index + 1).sum()) for index in range(len(SEVERITIES))]
+    click.echo("Violations: {} of {} hosts ({})".format(
+        sum(counts), len(severity),
+        ", ".join("{} {}".format(count, name) for name, count in reversed(list(zip(SEVERITIES, counts))))), err=err)
@@ -1,64 +1,131 @@
-import click
-from tabulate import tabulate
+from itertools import islice
 from ..config import get_boto3_client
+from ..concurrency import parallel_map
+from ..cache import cached_inventory
+from ..output import open_writer
+from ..charts import echo_chart
+from ..fanout import resolve_targets, fan_out, account_label, echo_failures
+from .sizing import bucket_region, fetch_bucket_sizes, count_bucket_objects
+from ..snapshots import Snapshot, save_snapshot
 from .visualize import visualize_buckets
 
-def fetch_s3_buckets(profile="default"):
-    """Fetch S3 buckets and list their details."""
+# Buckets are sized in batches so their CloudWatch queries share GetMetricData calls
+SIZING_BATCH = 500
+
+# Bounded pool for the per-bucket location and ACL lookups
+ENRICHMENT_WORKERS = 16
+
+
+def _list_buckets(s3_client):
+    """Yield every bucket, following ContinuationToken where the SDK supports paginating ListBuckets."""
+    if s3_client.can_paginate('list_buckets'):
+        for page in s3_client.get_paginator('list_buckets').paginate():
+            yield from page['Buckets']
+    else:
+        yield from s3_client.list_buckets()['Buckets']
+
+
+def fetch_s3_buckets(profile="default", exact=False, max_workers=ENRICHMENT_WORKERS, regions=None):
+    """Fetch S3 buckets page by page, yielding their details as they arrive.
+
+    Sizes come from the daily CloudWatch storage metrics unless `exact` is set,
+    in which case every object is listed. Bucket listing is global, so `regions`
+    filters buckets by their location instead of selecting an endpoint. Results are
+    served from the inventory cache while it is fresh.
+    """
+    return cached_inventory('s3-buckets', [profile, exact, sorted(regions or [])],
+                            lambda: _fetch_s3_buckets(profile, exact, max_workers, regions))
+
+
+def _fetch_s3_buckets(profile, exact, max_workers, regions):
     s3_client = get_boto3_client('s3', profile)
-    response = s3_client.list_buckets()
 
-    buckets = []
-    for bucket in response['Buckets']:
-        bucket_name = bucket['Name']
-        creation_date = bucket['CreationDate']
+    def enrich(bucket):
+        # GetBucketLocation answers from any region; everything else goes to the bucket's own endpoint
+        bucket_location = s3_client.get_bucket_location(Bucket=bucket['Name'])['LocationConstraint']
+        bucket_client = get_boto3_client('s3', profile, bucket_region(bucket_location))
+        bucket_acl = bucket_client.get_bucket_acl(Bucket=bucket['Name'])
+        return bucket, bucket_location, bucket_acl
+
+    all_buckets = _list_buckets(s3_client)
+    while True:
+        batch = list(islice(all_buckets, SIZING_BATCH))
+        if not batch:
+            break
 
-        # Fetching bucket metrics
-        bucket_location = s3_client.get_bucket_location(Bucket=bucket_name)['LocationConstraint']
-        bucket_acl = s3_client.get_bucket_acl(Bucket=bucket_name)
+        details = parallel_map(enrich, batch, max_workers)
+        if regions:
+            details = [detail for detail in details if bucket_region(detail[1]) in regions]
 
-        # Get the number of objects and total size in the bucket
-        bucket_objects = s3_client.list_objects_v2(Bucket=bucket_name)
-        total_size = 0
-        object_count = 0
+        sizes = {}
+        if not exact:
+            buckets_by_region = {}
+            for bucket, bucket_location, bucket_acl in details:
+                buckets_by_region.setdefault(bucket_region(bucket_location), []).append(bucket['Name'])
+            for region_sizes in parallel_map(lambda item: fetch_bucket_sizes(profile, item[1], item[0]),
+                                             buckets_by_region.items(), max_workers):
+                sizes.update(region_sizes)
 
-        if 'Contents' in bucket_objects:
-            for obj in bucket_objects['Contents']:
-                total_size += obj['Size']
-                object_count += 1
+        for bucket, bucket_location, bucket_acl in details:
+            bucket_name = bucket['Name']
+            if exact:
+                bucket_client = get_boto3_client('s3', profile, bucket_region(bucket_location))
+                total_size, object_count = count_bucket_objects(bucket_client, bucket_name)
+                storage_classes = None
+            else:
+                size = sizes[bucket_name]
+                total_size, object_count = size['TotalSizeBytes'], size['ObjectCount']
+                storage_classes = size['StorageClasses']
 
-        total_size_gb = total_size / (1024 ** 3)  # Convert bytes to GB
+            total_size_gb = total_size / (1024 ** 3)  # Convert bytes to GB
 
-        buckets.append({
-            'Name': bucket_name,
-            'CreationDate': creation_date,
-            'Location': bucket_location,
-            'ACL': bucket_acl['Grants'],
-            'ObjectCount': object_count,
-            'TotalSizeBytes': total_size,
-            'TotalSizeGB': total_size_gb
-        })
+            yield {
+                'Name': bucket_name,
+                'CreationDate': bucket['CreationDate'],
+                'Location': bucket_location,
+                'ACL': bucket_acl['Grants'],
+                'ObjectCount': object_count,
+                'TotalSizeBytes': total_size,
+                'TotalSizeGB': total_size_gb,
+                'StorageClasses': storage_classes
+            }
 
-    return buckets
 
+def list_s3_buckets(profile="default", visualize=False, exact=False, regions=None, profiles=None, output='grid',
+                    columns=None, chart_format='png', snapshot=False):
+    """List S3 buckets with details, and with `snapshot` append them to the snapshot history."""
+    buckets = [] if visualize else None
+    history = Snapshot('buckets') if snapshot else None
+    targets = resolve_targets(profiles or [profile], regional=False)
+    multi_target = len(targets) > 1
+    region_filter = None if regions == ['all'] else regions
+    failures = []
 
-def list_s3_buckets(profile="default", visualize=False):
-    """List S3 buckets with details."""
-    buckets = fetch_s3_buckets(profile)
+    headers = ["S.No", "Name", "Creation Date", "Location", "Object Count", "Total Size (Bytes)", "Total Size (GB)",
+               "ACL"]
+    if multi_target:
+        headers.append("Account")
+    writer = open_writer(output, headers, columns)
 
-    table = []
-    for bucket in buckets:
+    for row_number, (target, bucket) in enumerate(
+            fan_out(lambda p, r: fetch_s3_buckets(p, exact, regions=region_filter), targets, failures), 1):
         acl_info = "\n".join([
                                  f"Grantee: {grant['Grantee']['DisplayName'] if 'DisplayName' in grant['Grantee'] else 'N/A'}, Permission: {grant['Permission']}"
                                  for grant in bucket['ACL']])
-        table.append([
-            len(table) + 1, bucket['Name'], bucket['CreationDate'], bucket['Location'],
+        writer.write([
+            row_number, bucket['Name'], bucket['CreationDate'], bucket['Location'],
             bucket['ObjectCount'], bucket['TotalSizeBytes'], bucket['TotalSizeGB'], acl_info
-        ])
-
-    headers = ["S.No", "Name", "Creation Date", "Location", "Object Count", "Total Size (Bytes)", "Total Size (GB)",
-               "ACL"]
-    click.echo(tabulate(table, headers, tablefmt="grid"))
+        ] + ([account_label(target[0])] if multi_target else []))
+        if visualize:
+            buckets.append(bucket)
+        if snapshot:
+            history.add(bucket['Name'], Name=bucket['Name'], Location=bucket['Location'],
+                        ObjectCount=bucket['ObjectCount'], TotalSizeBytes=bucket['TotalSizeBytes'])
 
-    if visualize:
-        visualize_buckets(buckets)
+    # The chart renders in the background while the table is printed
+    chart = visualize_buckets(buckets, chart_format) if visualize else None
+    writer.close()
+    echo_failures(failures)
+    save_snapshot(history, err=output != 'grid')
+    if chart:
+        echo_chart(chart, err=output != 'grid')
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta, timezone
+from ..config import get_boto3_client
+from ..cache import cache_get_many, cache_put_many, cache_delete_many
+from ..cloudwatch import metric_query, get_metric_data
+from ..concurrency import parallel_map
+
+# S3 storage metrics are published once a day, usually with a lag of a day or more
+STORAGE_METRICS_PERIOD = 86400
+STORAGE_METRICS_LOOKBACK = timedelta(days=3)
+
+# Exact listing checkpoints are kept for a day so an interrupted run can resume
+EXACT_CHECKPOINT_TTL = 86400
+EXACT_CHECKPOINT_EVERY = 10
+
+
+def bucket_region(location):
+    """Map a GetBucketLocation LocationConstraint to a region name."""
+    if not location:
+        return 'us-east-1'
+    if location == 'EU':
+        return 'eu-west-1'
+    return location
+
+
+def _storage_types(cloudwatch_client, bucket_names):
+    """Discover which storage classes each bucket publishes BucketSizeBytes for, in one region-wide sweep."""
+    storage_types = {}
+    paginator = cloudwatch_client.get_paginator('list_metrics')
+    for page in paginator.paginate(Namespace='AWS/S3', MetricName='BucketSizeBytes'):
+        for metric in page['Metrics']:
+            dimensions = {dimension['Name']: dimension['Value'] for dimension in metric['Dimensions']}
+            if dimensions.get('BucketName') in bucket_names and 'StorageType' in dimensions:
+                storage_types.setdefault(dimensions['BucketName'], []).append(dimensions['StorageType'])
+    return storage_types
+
+
+def fetch_bucket_sizes(profile, bucket_names, region):
+    """Size buckets in one region from the daily BucketSizeBytes/NumberOfObjects CloudWatch metrics.
+
+    Returns {bucket_name: {'TotalSizeBytes', 'ObjectCount', 'StorageClasses'}}; buckets without
+    published metrics (e.g. created today or empty) report zero.
+    """
+    bucket_names = set(bucket_names)
+    cloudwatch_client = get_boto3_client('cloudwatch', profile, region)
+    storage_types = _storage_types(cloudwatch_client, bucket_names)
+
+    queries = []
+    query_ids = {}
+    for bucket_name in sorted(bucket_names):
+        metrics = [('NumberOfObjects', 'AllStorageTypes')]
+        metrics += [('BucketSizeBytes', storage_type) for storage_type in storage_types.get(bucket_name, [])]
+        for metric_name, storage_type in metrics:
+            query_id = 'q{}'.format(len(queries))
+            query_ids[query_id] = (bucket_name, metric_name, storage_type)
+            queries.append(metric_query(query_id, 'AWS/S3', metric_name,
+                                        {'BucketName': bucket_name, 'StorageType': storage_type},
+                                        'Average', STORAGE_METRICS_PERIOD))
+
+    end_time = datetime.now(timezone.utc)
+    sizes = {bucket_name: {'TotalSizeBytes': 0, 'ObjectCount': 0, 'StorageClasses': {}}
+             for bucket_name in bucket_names}
+    for query_id, values in get_metric_data(cloudwatch_client, queries, end_time - STORAGE_METRICS_LOOKBACK,
+                                            end_time).items():
+        if not values:
+            continue
+        bucket_name, metric_name, storage_type = query_ids[query_id]
+        # Datapoints come back newest first
+        latest = int(values[0])
+        if metric_name == 'NumberOfObjects':
+            sizes[bucket_name]['ObjectCount'] = latest
+        else:
+            sizes[bucket_name]['StorageClasses'][storage_type] = latest
+            sizes[bucket_name]['TotalSizeBytes'] += latest
+    return sizes
+
+
+def _count_prefix(s3_client, bucket_name, prefix):
+    """List every key under `prefix`, checkpointing the continuation token so reruns resume."""
+    key = "{}|{}".format(bucket_name, prefix)
+    state = cache_get_many('s3-exact-listing', [key]).get(key) or {'Token': None, 'Size': 0, 'Count': 0,
+                                                                     'Done': False}
+    if state['Done']:
+        return state['Size'], state['Count']
+
+    request = {'Bucket': bucket_name, 'Prefix': prefix}
+    page_number = 0
+    while True:
+        if state['Token']:
+            request['ContinuationToken'] = state['Token']
+        page = s3_client.list_objects_v2(**request)
+        for obj in page.get('Contents', []):
+            state['Size'] += obj['Size']
+            state['Count'] += 1
+        state['Token'] = page.get('NextContinuationToken')
+        if not state['Token']:
+            break
+        page_number += 1
+        if page_number % EXACT_CHECKPOINT_EVERY == 0:
+            cache_put_many('s3-exact-listing', {key: state}, ttl=EXACT_CHECKPOINT_TTL)
+
+    state['Done'] = True
+    cache_put_many('s3-exact-listing', {key: state}, ttl=EXACT_CHECKPOINT_TTL)
+    return state['Size'], state['Count']
+
+
+def count_bucket_objects(s3_client, bucket_name, max_workers=16):
+    """Exactly size a bucket by listing every object, fanning out over its top-level prefixes.
+
+    Progress is checkpointed per prefix, so an interrupted listing resumes where it left off.
+    """
+    prefixes = []
+    total_size = 0
+    object_count = 0
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Delimiter='/'):
+        # Keys at the top level are counted directly; everything else is listed per prefix
+        for obj in page.get('Contents', []):
+            total_size += obj['Size']
+            object_count += 1
+        prefixes.extend(prefix['Prefix'] for prefix in page.get('CommonPrefixes', []))
+
+    for size, count in parallel_map(lambda prefix: _count_prefix(s3_client, bucket_name, prefix), prefixes,
+                                    max_workers):
+        total_size += size
+        object_count += count
+
+    # The listing finished, so the next --exact run should start fresh rather than reuse these counts
+    cache_delete_many('s3-exact-listing', ["{}|{}".format(bucket_name, prefix) for prefix in prefixes])
+    return total_size, object_count
@@ -0,0 +1,203 @@
+import bisect
+import gzip
+import json
+import math
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone
+import click
+from .config import CONFIG_DIR
+from .output import open_writer, PLACEHOLDERS
+
+SNAPSHOT_DIR = os.path.join(CONFIG_DIR, "snapshots")
+SNAPSHOT_KINDS = ('instances', 'volumes', 'load-balancers', 'buckets')
+# File names sort in the order snapshots were taken, so history is searched without opening files
+_NAME_FORMAT = '%Y%m%dT%H%M%S.%fZ'
+_SUFFIX = '.json.gz'
+_DURATION = re.compile(r'^(\d+)([smhdw])$')
+_DURATION_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+CHANGE_ORDER = {'changed': 0, 'added': 1, 'removed': 2}
+
+
+def _plain(value):
+    # Placeholders and NaN both mean "no value"; everything else is kept as a number or text
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, float):
+        return None if math.isnan(value) else float(value)
+    if isinstance(value, int):
+        return value
+    return None if value in PLACEHOLDERS else str(value)
+
+
+class Snapshot:
+    """One run's resources of a kind, collected row by row and stored column by column.
+
+    Each column is a list aligned with `ids`, so a snapshot of thousands of resources
+    is one small gzip JSON file, and diffs only read the two files they compare.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.ids = []
+        self.columns = {}
+
+    def add(self, resource_id, **values):
+        row = len(self.ids)
+        self.ids.append(resource_id)
+        for name, value in values.items():
+            self.columns.setdefault(name, [None] * row).append(_plain(value))
+        for column in self.columns.values():
+            if len(column) <= row:
+                column.append(None)
+
+    def save(self):
+        """Write the snapshot to the store and return its path."""
+        taken_at = datetime.now(timezone.utc)
+        directory = os.path.join(SNAPSHOT_DIR, self.kind)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, taken_at.strftime(_NAME_FORMAT) + _SUFFIX)
+        payload = {'kind': self.kind, 'taken_at': taken_at.isoformat(), 'ids': self.ids, 'columns': self.columns}
+        # Written aside and renamed, so an interrupted run never leaves half a snapshot behind
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with gzip.open(os.fdopen(descriptor, 'wb'), 'wt', encoding='utf-8') as f:
+                json.dump(payload, f, separators=(',', ':'))
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return path
+
+
+def save_snapshot(snapshot, err=False):
+    """Save `snapshot` if one was collected and say where it went."""
+    if snapshot is not None:
+        click.echo("Snapshot saved: {}".format(snapshot.save()), err=err)
+
+
+def _snapshot_names(kind):
+    try:
+        return sorted(name for name in os.listdir(os.path.join(SNAPSHOT_DIR, kind)) if name.endswith(_SUFFIX))
+    except FileNotFoundError:
+        return []
+
+
+def _parse_time(ref):
+    match = _DURATION.match(ref)
+    if match:
+        return datetime.now(timezone.utc) - timedelta(seconds=int(match.group(1)) * _DURATION_SECONDS[match.group(2)])
+    try:
+        moment = datetime.fromisoformat(ref)
+    except ValueError:
+        return None
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+
+def resolve_snapshot(kind, ref, param_hint, before=None):
+    """Return the file name of the snapshot `ref` names.
+
+    `ref` is "latest", "previous" (the one before `before`, or before the latest), an age
+    such as 90m, 24h or 7d, or a UTC time such as 2024-05-01T12:00; ages and times pick
+    the last snapshot taken at or before them.
+    """
+    names = _snapshot_names(kind)
+    if ref == 'latest':
+        index = len(names) - 1
+    elif ref == 'previous':
+        index = (names.index(before) if before in names else len(names) - 1) - 1
+    else:
+        moment = _parse_time(ref)
+        if moment is None:
+            raise click.BadParameter("'{}' is not latest, previous, an age such as 24h or a UTC time".format(ref),
+                                     param_hint=param_hint)
+        index = bisect.bisect_right(names, moment.astimezone(timezone.utc).strftime(_NAME_FORMAT) + _SUFFIX) - 1
+    if not names:
+        raise click.ClickException("No {} snapshots yet; save some with --snapshot".format(kind))
+    if index < 0:
+        raise click.ClickException("No {} snapshot matches {} {}; the oldest of {} is {}".format(
+            kind, param_hint, ref, len(names), names[0][:-len(_SUFFIX)]))
+    return names[index]
+
+
+def load_snapshot(kind, name):
+    with gzip.open(os.path.join(SNAPSHOT_DIR, kind, name), 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _delta(before, after):
+    numbers = (int, float)
+    if isinstance(before, numbers) and isinstance(after, numbers) and not isinstance(before, bool) \
+            and not isinstance(after, bool):
+        return after - before
+    return None
+
+
+def diff_snapshots(before, after, fields=None, min_delta=0):
+    """Yield (change, resource ID, name, field, before, after, delta) between two loaded snapshots.
+
+    Resources are joined through a hash index of the older snapshot's IDs. Numeric
+    changes smaller than `min_delta` are skipped; `fields` limits changes to those columns.
+    """
+    before_rows = {resource_id: row for row, resource_id in enumerate(before['ids'])}
+    after_rows = {resource_id: row for row, resource_id in enumerate(after['ids'])}
+    before_columns, after_columns = before['columns'], after['columns']
+    compared = [name for name in after_columns if name in before_columns and (not fields or name in fields)]
+
+    def name_of(snapshot, row):
+        names = snapshot['columns'].get('Name')
+        return names[row] if names else None
+
+    for resource_id, row in after_rows.items():
+        old_row = before_rows.get(resource_id)
+        if old_row is None:
+            yield 'added', resource_id, name_of(after, row), None, None, None, None
+            continue
+        for field in compared:
+            old, new = before_columns[field][old_row], after_columns[field][row]
+            if old == new:
+                continue
+            delta = _delta(old, new)
+            if delta is not None and abs(delta) < min_delta:
+                continue
+            yield 'changed', resource_id, name_of(after, row), field, old, new, delta
+    for resource_id, row in before_rows.items():
+        if resource_id not in after_rows:
+            yield 'removed', resource_id, name_of(before, row), None, None, None, None
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    return "{:.2f}".format(value) if isinstance(value, float) else value
+
+
+def compare_snapshots(kind, from_ref='previous', to_ref='latest', fields=None, min_delta=0, output='grid', columns=None):
+    """Print the resources added, removed and changed between two stored snapshots of `kind`."""
+    human = output == 'grid'
+    to_name = resolve_snapshot(kind, to_ref, "'--to'")
+    from_name = resolve_snapshot(kind, from_ref, "'--from'", before=to_name if from_ref == 'previous' else None)
+    if from_name == to_name:
+        raise click.ClickException("--from {} and --to {} are the same snapshot".format(from_ref, to_ref))
+    before, after = load_snapshot(kind, from_name), load_snapshot(kind, to_name)
+    click.echo("Comparing {} with {}".format(before['taken_at'], after['taken_at']), err=not human)
+
+    headers = ["S.No", "Change", "ID", "Name", "Field", "Before", "After", "Delta"]
+    writer = open_writer(output, headers, columns)
+    # Both snapshots are in memory already, so every format gets changes first, largest moves
+    # first, then additions and removals
+    changes = sorted(diff_snapshots(before, after, fields, min_delta), key=lambda change: (
+        CHANGE_ORDER[change[0]], -abs(change[6]) if change[6] is not None else 0, str(change[1]), str(change[3])))
+    counts = dict.fromkeys(CHANGE_ORDER, 0)
+    changed_resources = set()
+    for row_number, (change, resource_id, name, field, old, new, delta) in enumerate(changes, 1):
+        counts[change] += 1
+        if change == 'changed':
+            changed_resources.add(resource_id)
+        values = [old, new, delta]
+        writer.write([row_number, change, resource_id, name, field] +
+                     ([_format_value(value) for value in values] if human else values))
+    writer.close()
+    click.echo("Added: {}, removed: {}, changed: {} ({} changes)".format(
+        counts['added'], counts['removed'], len(changed_resources), counts['changed']), err=not human)
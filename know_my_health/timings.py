@@ -0,0 +1,181 @@
+import bisect
+import contextlib
+import json
+import threading
+import time
+from array import array
+import click
+from tabulate import tabulate
+from .concurrency import THROTTLING_ERROR_CODES
+
+# Histogram bucket upper bounds in seconds, as in the Prometheus client defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_STARTED = 'know_my_health_started'
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+class _Operation:
+    """Latencies and outcome counters of one (service, operation)."""
+
+    __slots__ = ('latencies', 'errors', 'throttles', 'retries')
+
+    def __init__(self):
+        self.latencies = array('d')
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+        return {
+            'calls': len(ordered),
+            'errors': self.errors,
+            'throttles': self.throttles,
+            'retries': self.retries,
+            'total_seconds': sum(ordered),
+            'p50_seconds': _percentile(ordered, 0.5),
+            'p95_seconds': _percentile(ordered, 0.95),
+            'max_seconds': ordered[-1] if ordered else 0.0,
+            # Cumulative, like Prometheus buckets; the last one is +Inf
+            'buckets': [bisect.bisect_right(ordered, bound) for bound in LATENCY_BUCKETS] + [len(ordered)],
+        }
+
+
+_operations = {}
+_lock = threading.Lock()
+_enabled = {'enabled': False}
+
+
+def _operation(service, operation):
+    key = (service, operation)
+    with _lock:
+        if key not in _operations:
+            _operations[key] = _Operation()
+        return _operations[key]
+
+
+def record(service, operation, seconds, error=False, retries=0):
+    """Record one completed call of `service` `operation` that took `seconds`."""
+    if not _enabled['enabled']:
+        return
+    entry = _operation(service, operation)
+    with _lock:
+        entry.latencies.append(seconds)
+        entry.errors += error
+        entry.retries += retries
+
+
+@contextlib.contextmanager
+def timed(service, operation):
+    """Time the enclosed step, e.g. `with timed('ssh', 'exec'):`; exceptions count as errors and propagate."""
+    if not _enabled['enabled']:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record(service, operation, time.perf_counter() - started, error=True)
+        raise
+    record(service, operation, time.perf_counter() - started)
+
+
+def _before_call(model, context, **kwargs):
+    context[_STARTED] = (model.service_model.service_name, model.name, time.perf_counter())
+
+
+def _after_call(http_response, parsed, context, **kwargs):
+    service, operation, started = context.pop(_STARTED, (None, None, None))
+    if started is not None:
+        record(service, operation, time.perf_counter() - started, error=http_response.status_code >= 300,
+               retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+
+def _after_call_error(context, **kwargs):
+    # Connection failures and timeouts that exhausted their retries never reach after-call
+    service, operation, started = context.pop(_STARTED, (None, None, None))
+    if started is not None:
+        record(service, operation, time.perf_counter() - started, error=True)
+
+
+def _needs_retry(operation, response=None, **kwargs):
+    # Sees every attempt, so throttles that a retry later recovered from are counted too
+    if response is None or not _enabled['enabled']:
+        return None
+    if response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+        entry = _operation(operation.service_model.service_name, operation.name)
+        with _lock:
+            entry.throttles += 1
+    return None
+
+
+def enable_timings():
+    """Start recording every AWS API call and SSH step made by this process."""
+    from .config import register_event_handler
+    if _enabled['enabled']:
+        return
+    _enabled['enabled'] = True
+    register_event_handler('before-call', _before_call)
+    register_event_handler('after-call', _after_call)
+    register_event_handler('after-call-error', _after_call_error)
+    register_event_handler('needs-retry', _needs_retry)
+
+
+def snapshot():
+    """Return a summary of every recorded (service, operation), sorted by total time spent."""
+    with _lock:
+        summaries = [dict(service=service, operation=operation, **entry.summary())
+                     for (service, operation), entry in _operations.items()]
+    return sorted(summaries, key=lambda summary: -summary['total_seconds'])
+
+
+def echo_timings():
+    """Print the recorded timings as a table on stderr."""
+    rows = [[summary['service'], summary['operation'], summary['calls'], summary['errors'], summary['throttles'],
+             summary['retries'], "{:.3f}".format(summary['p50_seconds']), "{:.3f}".format(summary['p95_seconds']),
+             "{:.3f}".format(summary['max_seconds']), "{:.2f}".format(summary['total_seconds'])]
+            for summary in snapshot()]
+    click.echo(tabulate(rows, ["Service", "Operation", "Calls", "Errors", "Throttled", "Retries", "p50 (s)",
+                               "p95 (s)", "Max (s)", "Total (s)"], tablefmt="grid"), err=True)
+
+
+def _prometheus_labels(summary, **extra):
+    labels = dict(service=summary['service'], operation=summary['operation'], **extra)
+    return ",".join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels.items())
+
+
+def prometheus_text(summaries):
+    """Render summaries in the Prometheus text exposition format."""
+    lines = ["# HELP know_my_health_call_duration_seconds Latency of AWS API calls and SSH steps.",
+             "# TYPE know_my_health_call_duration_seconds histogram"]
+    for summary in summaries:
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), summary['buckets']):
+            lines.append("know_my_health_call_duration_seconds_bucket{{{}}} {}".format(
+                _prometheus_labels(summary, le=bound), count))
+        lines.append("know_my_health_call_duration_seconds_sum{{{}}} {}".format(
+            _prometheus_labels(summary), summary['total_seconds']))
+        lines.append("know_my_health_call_duration_seconds_count{{{}}} {}".format(
+            _prometheus_labels(summary), summary['calls']))
+    for name, description in (('errors', 'Calls that failed.'),
+                              ('throttles', 'Attempts rejected by throttling.'),
+                              ('retries', 'Retried attempts of completed calls.')):
+        lines.append("# HELP know_my_health_call_{}_total {}".format(name, description))
+        lines.append("# TYPE know_my_health_call_{}_total counter".format(name))
+        lines.extend("know_my_health_call_{}_total{{{}}} {}".format(name, _prometheus_labels(summary), summary[name])
+                     for summary in summaries)
+    return "\n".join(lines) + "\n"
+
+
+def export_timings(path, export_format='json'):
+    """Write the recorded timings to `path` as JSON or Prometheus text."""
+    summaries = snapshot()
+    with open(path, 'w', encoding='utf-8') as f:
+        if export_format == 'prometheus':
+            f.write(prometheus_text(summaries))
+        else:
+            json.dump({'latency_buckets': list(LATENCY_BUCKETS), 'operations': summaries}, f, indent=2)
+            f.write("\n")
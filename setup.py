@@ -7,8 +7,13 @@ setup(
     install_requires=[
         "boto3",
         "click",
-        "matplotlib"
+        "matplotlib",
+        "numpy"
     ],
+    extras_require={
+        "bench": ["moto[ec2,elbv2,s3,cloudwatch]"],
+        "parquet": ["pyarrow"],
+    },
     entry_points={
         "console_scripts": [
             "know-my-health=know_my_health.cli:cli",